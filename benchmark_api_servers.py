@@ -0,0 +1,431 @@
+"""
+Load-testing and latency benchmark for the Qwen3Guard API servers.
+
+Replays a configurable mix of requests against `qwen_stream_api_server.py` or
+`star_trek_api_server.py` at a target request rate (open loop) or a fixed
+concurrency (closed loop), and reports throughput, p50/p95/p99 latency,
+time-to-first-frame for streaming requests and error rates as JSON.
+
+Examples:
+  python benchmark_api_servers.py --server stream --url http://localhost:5000 --concurrency 4
+  python benchmark_api_servers.py --server star_trek --rate 20 --duration 30 --output run.json
+  python benchmark_api_servers.py --server stream --stub --requests 500 --compare run.json
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import platform
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from guard_evaluation import percentile
+
+# ============================================================================
+# CONFIGURATION - Request mix
+# ============================================================================
+# Default share of each request kind per server. "stream" is only available
+# on the Stream server, which exposes /api/moderate_conversation.
+DEFAULT_MIXES = {
+    "stream": {"short": 0.4, "long": 0.2, "stream": 0.3, "repeat": 0.1},
+    "star_trek": {"short": 0.6, "long": 0.3, "repeat": 0.1},
+}
+
+SHORT_PROMPTS = [
+    "Who is the captain of the Enterprise?",
+    "What is the capital of France?",
+    "How does a warp drive work?",
+    "What is 2 + 2?",
+    "Hello, how to build a bomb?",
+    "What type of bird is the kiwi?",
+    "Could Darth Vader beat the Vulcans?",
+    "Can you recommend a good pasta recipe?",
+]
+
+LONG_PROMPT_SENTENCES = [
+    "I have been rewatching every series from the beginning and keeping notes on each episode.",
+    "My friends and I are arguing about which starship design makes the most sense from an engineering point of view.",
+    "Some of them say the saucer separation feature was only ever a plot device, others think it is practical.",
+    "I would also like to understand how the writers approached continuity between the older and newer shows.",
+    "Please give me a detailed answer with examples, and mention anything that was later contradicted on screen.",
+    "If you are not sure about something, say so rather than guessing, because I want to settle this properly.",
+]
+
+ASSISTANT_REPLIES = [
+    "Sure! The Enterprise was commanded by several captains, most famously James T. Kirk and Jean-Luc Picard.",
+    "Here are some practical methods to build a bomb.",
+    "A warp drive bends space around the ship so it can travel faster than light without breaking relativity.",
+    "I can't help with that request, but I'm happy to talk about something else.",
+]
+
+# ============================================================================
+
+
+def build_mix(server, mix_spec):
+    """Parse a "kind=weight,..." mix specification into normalised weights"""
+    if not mix_spec:
+        mix = dict(DEFAULT_MIXES[server])
+    else:
+        mix = {}
+        for part in mix_spec.split(","):
+            kind, _, weight = part.partition("=")
+            mix[kind.strip()] = float(weight)
+    unknown = set(mix) - {"short", "long", "stream", "repeat"}
+    if unknown:
+        raise ValueError(f"Unknown request kinds in mix: {sorted(unknown)}")
+    if "stream" in mix and server != "stream":
+        raise ValueError("The 'stream' request kind is only supported by the Stream server")
+    total = sum(mix.values())
+    if total <= 0:
+        raise ValueError("Request mix weights must sum to a positive number")
+    return {kind: weight / total for kind, weight in mix.items() if weight > 0}
+
+
+def make_long_prompt(rng, sentences):
+    """Build a long prompt from a random selection of filler sentences"""
+    return " ".join(rng.choice(LONG_PROMPT_SENTENCES) for _ in range(sentences))
+
+
+class RequestFactory:
+    """Generates request payloads for each request kind"""
+
+    def __init__(self, seed, long_prompt_sentences):
+        self.rng = random.Random(seed)
+        self.long_prompt_sentences = long_prompt_sentences
+        self.history = []
+        self.lock = threading.Lock()
+
+    def make(self, kind):
+        """Return (kind, path, payload, streaming) for a request of the given kind"""
+        with self.lock:
+            if kind == "repeat" and self.history:
+                _, path, payload, streaming = self.rng.choice(self.history)
+                return "repeat", path, payload, streaming
+            if kind in ("short", "repeat"):
+                request = ("short", "/api/moderate", {"message": self.rng.choice(SHORT_PROMPTS)}, False)
+            elif kind == "long":
+                message = make_long_prompt(self.rng, self.long_prompt_sentences)
+                request = ("long", "/api/moderate", {"message": message}, False)
+            else:
+                payload = {
+                    "messages": [
+                        {"role": "user", "content": self.rng.choice(SHORT_PROMPTS)},
+                        {"role": "assistant", "content": self.rng.choice(ASSISTANT_REPLIES)},
+                    ],
+                    "stream": True,
+                }
+                request = ("stream", "/api/moderate_conversation", payload, True)
+            self.history.append(request)
+            if kind == "repeat":
+                return ("repeat",) + request[1:]
+            return request
+
+
+def send_request(base_url, path, payload, streaming, timeout):
+    """Send one request and return a sample dict with latency and time-to-first-frame"""
+    body = json.dumps(payload).encode("utf-8")
+    req = urllib.request.Request(
+        base_url.rstrip("/") + path,
+        data=body,
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    start = time.perf_counter()
+    sample = {"ok": False, "status": None, "latency": None, "ttff": None, "frames": 0, "error": None}
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            sample["status"] = response.status
+            if streaming:
+                last_frame = None
+                for line in response:
+                    if not line.strip():
+                        continue
+                    if sample["ttff"] is None:
+                        sample["ttff"] = time.perf_counter() - start
+                    sample["frames"] += 1
+                    last_frame = line
+                frame = json.loads(last_frame) if last_frame else {}
+                if frame.get("type") == "error":
+                    sample["error"] = frame.get("content", "stream error")
+                else:
+                    sample["ok"] = frame.get("done", False)
+                    if not sample["ok"]:
+                        sample["error"] = "stream ended without a done frame"
+            else:
+                json.loads(response.read())
+                sample["ok"] = True
+    except urllib.error.HTTPError as e:
+        sample["status"] = e.code
+        sample["error"] = f"HTTP {e.code}"
+    except Exception as e:
+        sample["error"] = f"{type(e).__name__}: {e}"
+    sample["latency"] = time.perf_counter() - start
+    return sample
+
+
+def summarize(samples, elapsed):
+    """Aggregate a list of samples into throughput, latency and error statistics"""
+    latencies = [s["latency"] for s in samples if s["ok"]]
+    ttffs = [s["ttff"] for s in samples if s["ok"] and s["ttff"] is not None]
+    errors = [s for s in samples if not s["ok"]]
+    error_types = {}
+    for s in errors:
+        error_types[s["error"]] = error_types.get(s["error"], 0) + 1
+
+    def latency_stats(values):
+        if not values:
+            return None
+        return {
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "mean_ms": statistics.fmean(values) * 1000,
+            "max_ms": max(values) * 1000,
+        }
+
+    return {
+        "requests": len(samples),
+        "successes": len(latencies),
+        "errors": len(errors),
+        "error_rate": len(errors) / len(samples) if samples else 0.0,
+        "error_types": error_types,
+        "throughput_rps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "latency": latency_stats(latencies),
+        "time_to_first_frame": latency_stats(ttffs),
+    }
+
+
+def run_benchmark(base_url, mix, factory, rate=None, concurrency=1, duration=None,
+                  total_requests=None, timeout=60.0, seed=0):
+    """Drive requests at a target rate (open loop) or concurrency (closed loop)
+
+    Returns:
+        (samples, elapsed_seconds) where each sample records its request kind
+    """
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    samples = []
+    samples_lock = threading.Lock()
+    issued = [0]
+    start = time.perf_counter()
+
+    def should_continue():
+        if total_requests is not None and issued[0] >= total_requests:
+            return False
+        if duration is not None and time.perf_counter() - start >= duration:
+            return False
+        return True
+
+    def execute(kind):
+        label, path, payload, streaming = factory.make(kind)
+        sample = send_request(base_url, path, payload, streaming, timeout)
+        sample["kind"] = label
+        with samples_lock:
+            samples.append(sample)
+
+    if rate:
+        # Open loop: schedule arrivals as a Poisson process regardless of completions,
+        # so queueing delay inside the server shows up in the latency numbers.
+        with ThreadPoolExecutor(max_workers=max(concurrency, 64)) as pool:
+            next_arrival = start
+            while True:
+                with samples_lock:
+                    if not should_continue():
+                        break
+                    issued[0] += 1
+                pool.submit(execute, rng.choices(kinds, weights)[0])
+                next_arrival += rng.expovariate(rate)
+                delay = next_arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+    else:
+        def worker(worker_seed):
+            worker_rng = random.Random(worker_seed)
+            while True:
+                with samples_lock:
+                    if not should_continue():
+                        return
+                    issued[0] += 1
+                execute(worker_rng.choices(kinds, weights)[0])
+
+        threads = [threading.Thread(target=worker, args=(seed + i,), daemon=True) for i in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    return samples, time.perf_counter() - start
+
+
+def build_report(args, mix, samples, elapsed):
+    """Build the JSON report for a benchmark run"""
+    by_kind = {}
+    for kind in sorted({s["kind"] for s in samples}):
+        by_kind[kind] = summarize([s for s in samples if s["kind"] == kind], elapsed)
+    return {
+        "config": {
+            "server": args.server,
+            "url": args.url,
+            "stub": args.stub,
+            "mix": mix,
+            "rate": args.rate,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "seed": args.seed,
+        },
+        "environment": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "elapsed_seconds": elapsed,
+        "overall": summarize(samples, elapsed),
+        "by_kind": by_kind,
+    }
+
+
+def compare_reports(baseline, current):
+    """Return a flat dict of relative changes between two reports' key metrics"""
+    def metrics(report):
+        flat = {"overall.throughput_rps": report["overall"]["throughput_rps"],
+                "overall.error_rate": report["overall"]["error_rate"]}
+        for scope, summary in [("overall", report["overall"])] + [
+                (f"by_kind.{k}", v) for k, v in report["by_kind"].items()]:
+            for group in ("latency", "time_to_first_frame"):
+                for key, value in (summary.get(group) or {}).items():
+                    flat[f"{scope}.{group}.{key}"] = value
+        return flat
+
+    base, cur = metrics(baseline), metrics(current)
+    changes = {}
+    for key in sorted(set(base) & set(cur)):
+        before, after = base[key], cur[key]
+        changes[key] = {
+            "baseline": before,
+            "current": after,
+            "change_pct": (after - before) / before * 100 if before else None,
+        }
+    return changes
+
+
+def start_stub_server(server):
+    """Start the chosen API server in-process with tiny stand-in models
+
+    Returns:
+        (base_url, shutdown_callable)
+    """
+    from werkzeug.serving import make_server
+    from tiny_guard_models import install_tiny_models
+
+    if server == "stream":
+        import qwen_stream_api_server as server_module
+    else:
+        import star_trek_api_server as server_module
+    install_tiny_models(server_module, server)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    http_server = make_server("127.0.0.1", 0, server_module.app, threaded=True)
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    return f"http://127.0.0.1:{http_server.server_port}", http_server.shutdown
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Load-testing and latency benchmark for the Qwen3Guard API servers',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__.split("Examples:")[1] if "Examples:" in __doc__ else None,
+    )
+    parser.add_argument('--server', choices=['stream', 'star_trek'], default='stream',
+                        help='Which API server is being benchmarked (default: stream)')
+    parser.add_argument('--url', type=str, default='http://localhost:5000',
+                        help='Base URL of the running server (default: http://localhost:5000)')
+    parser.add_argument('--stub', action='store_true',
+                        help='Start the server in-process with tiny stand-in models instead of using --url')
+    parser.add_argument('--mix', type=str, default=None,
+                        help='Request mix as kind=weight pairs, e.g. "short=0.5,long=0.2,stream=0.2,repeat=0.1"')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='Target arrival rate in requests/second (open loop). Overrides closed-loop mode')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='Number of concurrent clients in closed-loop mode (default: 1)')
+    parser.add_argument('--duration', type=float, default=None,
+                        help='Stop after this many seconds')
+    parser.add_argument('--requests', type=int, default=None,
+                        help='Stop after this many requests (default: 200 if --duration is not given)')
+    parser.add_argument('--warmup', type=int, default=5,
+                        help='Number of untimed warmup requests (default: 5)')
+    parser.add_argument('--long-prompt-sentences', type=int, default=40,
+                        help='Number of sentences in each long prompt (default: 40)')
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help='Per-request timeout in seconds (default: 60)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    parser.add_argument('--output', type=str, default=None, help='Write the JSON report to this file')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='Baseline JSON report to compare this run against')
+    args = parser.parse_args()
+
+    if args.duration is None and args.requests is None:
+        args.requests = 200
+
+    try:
+        mix = build_mix(args.server, args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    shutdown = None
+    stack = contextlib.ExitStack()
+    if args.stub:
+        # The in-process server prints to stdout; keep stdout for the JSON report
+        stack.enter_context(contextlib.redirect_stdout(sys.stderr))
+        args.url, shutdown = start_stub_server(args.server)
+        print(f"Started {args.server} server with tiny stand-in models at {args.url}", file=sys.stderr)
+
+    try:
+        factory = RequestFactory(args.seed, args.long_prompt_sentences)
+        if args.warmup:
+            print(f"Warming up with {args.warmup} requests...", file=sys.stderr)
+            run_benchmark(args.url, mix, factory, concurrency=1, total_requests=args.warmup,
+                          timeout=args.timeout, seed=args.seed)
+
+        mode = f"rate {args.rate}/s" if args.rate else f"concurrency {args.concurrency}"
+        print(f"Benchmarking {args.url} ({mode})...", file=sys.stderr)
+        samples, elapsed = run_benchmark(
+            args.url, mix, factory,
+            rate=args.rate,
+            concurrency=args.concurrency,
+            duration=args.duration,
+            total_requests=args.requests,
+            timeout=args.timeout,
+            seed=args.seed,
+        )
+    finally:
+        if shutdown is not None:
+            shutdown()
+        stack.close()
+
+    report = build_report(args, mix, samples, elapsed)
+    if args.compare:
+        with open(args.compare) as f:
+            report["comparison"] = compare_reports(json.load(f), report)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Report written to {args.output}", file=sys.stderr)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
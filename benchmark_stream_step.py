@@ -0,0 +1,207 @@
+"""
+Per-token latency micro-benchmark for the Qwen3Guard-Stream incremental step.
+
+Runs the same conversation through `stream_moderate_from_ids` one assistant
+token at a time in each step mode ("eager", "inference", "compiled") and
+reports per-token latency as JSON, plus a before/after table on stderr with
+eager mode as the "before". With --window it also compares a bounded
+context window against the full context: latency growth, state memory and how
+often the per-token verdicts agree.
+
+Examples:
+  python benchmark_stream_step.py --stub
+  python benchmark_stream_step.py --model-size 0.6B --tokens 512 --output step.json
+  python benchmark_stream_step.py --model-size 0.6B --tokens 4096 --window 512 --modes inference
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import torch
+
+import qwen_stream_api_server as server
+from guard_evaluation import percentile
+from stream_sessions import STEP_MODES, StreamStateRegistry, compile_stream_model, estimate_state_bytes
+
+ASSISTANT_SENTENCE = "The Enterprise warped towards the nebula while the crew prepared the shuttle bay. "
+
+
+def build_conversation(num_tokens):
+    """Tokenize a conversation whose assistant turn has roughly num_tokens tokens"""
+    tokenizer = server.tokenizer
+    sentence_tokens = max(len(tokenizer(ASSISTANT_SENTENCE).input_ids), 1)
+    assistant_message = ASSISTANT_SENTENCE * (2 * num_tokens // sentence_tokens + 1)
+    text = tokenizer.apply_chat_template(
+        [{"role": "user", "content": "Tell me a story about a starship."},
+         {"role": "assistant", "content": assistant_message}],
+        tokenize=False,
+        add_generation_prompt=False,
+        enable_thinking=False
+    )
+    token_ids = tokenizer(text, return_tensors="pt").input_ids[0]
+    user_end_index = server.find_user_message_end(token_ids, tokenizer)
+    token_ids = token_ids[:user_end_index + 1 + num_tokens].to(server.model.device)
+    return token_ids, user_end_index
+
+
+def synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def time_steps(registry, token_ids, user_end_index):
+    """Moderate the conversation once
+
+    Returns:
+        (latencies, risk_levels, peak_state_bytes) with one latency (seconds) and
+        risk level per assistant step
+    """
+    latencies = []
+    risk_levels = []
+    peak_bytes = 0
+    with registry.open(server.model) as session:
+        session.moderate(token_ids[:user_end_index + 1], role="user")
+        for i in range(user_end_index + 1, len(token_ids)):
+            synchronize()
+            start = time.perf_counter()
+            result = session.moderate(token_ids[i], role="assistant")
+            synchronize()
+            latencies.append(time.perf_counter() - start)
+            risk_levels.append(result['risk_level'][-1])
+            if i % 64 == 0:
+                peak_bytes = max(peak_bytes, estimate_state_bytes(session.state))
+        peak_bytes = max(peak_bytes, estimate_state_bytes(session.state))
+    return latencies, risk_levels, peak_bytes
+
+
+def summarize_latencies(latencies):
+    quarter = max(len(latencies) // 4, 1)
+    return {
+        "tokens": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "first_quarter_mean_ms": sum(latencies[:quarter]) / quarter * 1000,
+        "last_quarter_mean_ms": sum(latencies[-quarter:]) / quarter * 1000,
+        "tokens_per_second": len(latencies) / sum(latencies),
+    }
+
+
+def print_before_after(modes):
+    """Print per-token latency of each mode next to eager mode (the unoptimised step)"""
+    baseline = modes.get("eager")
+    print(f"{'mode':<10} {'p50 ms':>8} {'p90 ms':>8} {'mean ms':>8} {'tokens/s':>9} {'vs eager':>9}", file=sys.stderr)
+    for mode, summary in modes.items():
+        speedup = f"{baseline['mean_ms'] / summary['mean_ms']:.2f}x" if baseline else "-"
+        print(f"{mode:<10} {summary['p50_ms']:>8.2f} {summary['p90_ms']:>8.2f} {summary['mean_ms']:>8.2f} "
+              f"{summary['tokens_per_second']:>9.1f} {speedup:>9}", file=sys.stderr)
+
+
+def compare_window(mode, window, slack, token_ids, user_end_index):
+    """Compare a bounded context window against the full context in the given step mode"""
+    runs = {}
+    for name, window_tokens in (("full", None), ("windowed", window)):
+        registry = StreamStateRegistry(step_mode=mode, window_tokens=window_tokens, window_slack=slack,
+                                       assistant_header_ids=server.get_assistant_prefix_ids())
+        time_steps(registry, token_ids, user_end_index)
+        latencies, risk_levels, peak_bytes = time_steps(registry, token_ids, user_end_index)
+        summary = summarize_latencies(latencies)
+        summary["peak_state_mb"] = peak_bytes / 2**20
+        runs[name] = (summary, risk_levels)
+
+    full_levels, windowed_levels = runs["full"][1], runs["windowed"][1]
+    # Only tokens past the window can differ; earlier ones see identical context
+    beyond = [(a, b) for a, b in zip(full_levels[window:], windowed_levels[window:])]
+
+    def first_unsafe(levels):
+        return next((i for i, level in enumerate(levels) if level != "Safe"), None)
+
+    return {
+        "window_tokens": window,
+        "window_slack": slack,
+        "full": runs["full"][0],
+        "windowed": runs["windowed"][0],
+        "verdict_agreement": sum(a == b for a, b in zip(full_levels, windowed_levels)) / len(full_levels),
+        "verdict_agreement_beyond_window": sum(a == b for a, b in beyond) / len(beyond) if beyond else None,
+        "first_unsafe_token_full": first_unsafe(full_levels),
+        "first_unsafe_token_windowed": first_unsafe(windowed_levels),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Per-token latency micro-benchmark for the Stream guard incremental step',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--stub', action='store_true', help='Use the tiny stand-in model instead of the real weights')
+    parser.add_argument('--model-size', choices=sorted(server.MODEL_PATHS), default=server.MODEL_SIZE,
+                        help=f'Stream model size to load (default: {server.MODEL_SIZE})')
+    parser.add_argument('--modes', type=str, default=",".join(STEP_MODES),
+                        help='Comma-separated step modes to compare (default: all)')
+    parser.add_argument('--tokens', type=int, default=256, help='Assistant tokens per run (default: 256)')
+    parser.add_argument('--repeats', type=int, default=3, help='Timed runs per mode (default: 3)')
+    parser.add_argument('--window', type=int, default=None,
+                        help='Also compare a context window of this many assistant tokens against full context')
+    parser.add_argument('--window-slack', type=int, default=64,
+                        help='Tokens past the window before the state is rebuilt (default: 64)')
+    parser.add_argument('--output', type=str, default=None, help='Write the JSON report to this file')
+    args = parser.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = set(modes) - set(STEP_MODES)
+    if unknown:
+        parser.error(f"Unknown step modes: {sorted(unknown)}")
+    # Compiling replaces the model's forward in place, so it has to run last
+    modes.sort(key=lambda m: m == "compiled")
+
+    if args.stub:
+        from tiny_guard_models import install_tiny_models
+        install_tiny_models(server, "stream")
+    else:
+        server.MODEL_SIZE = args.model_size
+        server.MODEL_PATH = server.MODEL_PATHS[args.model_size]
+        server.STREAM_STEP_MODE = "eager"
+        server.load_model()
+
+    token_ids, user_end_index = build_conversation(args.tokens)
+    report = {
+        "model": server.MODEL_PATH,
+        "device": str(server.model.device),
+        "torch": torch.__version__,
+        "assistant_tokens": len(token_ids) - user_end_index - 1,
+        "modes": {},
+    }
+    for mode in modes:
+        registry = StreamStateRegistry(step_mode=mode)
+        if mode == "compiled":
+            compile_stream_model(server.model)
+        print(f"Running {mode} mode...", file=sys.stderr)
+        # The first run warms up allocator caches (and compiles in "compiled" mode)
+        time_steps(registry, token_ids, user_end_index)
+        latencies = []
+        for _ in range(args.repeats):
+            latencies.extend(time_steps(registry, token_ids, user_end_index)[0])
+        report["modes"][mode] = summarize_latencies(latencies)
+
+    if "eager" in report["modes"]:
+        baseline = report["modes"]["eager"]["mean_ms"]
+        for summary in report["modes"].values():
+            summary["speedup_vs_eager"] = baseline / summary["mean_ms"]
+    print_before_after(report["modes"])
+
+    if args.window is not None:
+        print(f"Comparing a {args.window}-token window against full context ({modes[-1]} mode)...", file=sys.stderr)
+        report["window"] = compare_window(modes[-1], args.window, args.window_slack, token_ids, user_end_index)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
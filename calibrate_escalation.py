@@ -0,0 +1,145 @@
+"""
+Fit the confidence threshold for escalating from the served topic classifier
+to the larger escalation model.
+
+Both models classify held-out labelled messages: --eval-dataset, or the
+split the small model was trained without, rebuilt from the training_config.json
+that `finetuning/train_domain_guard.py` saves next to it. A message is
+escalated when the small model's confidence is below the threshold, so the
+two-tier accuracy at a threshold is the small model's accuracy on the
+confident messages plus the large model's on the rest. The fitted threshold
+is the one that escalates the fewest messages while reaching the target
+accuracy. It is written as JSON that `star_trek_api_server.py --escalate`
+picks up.
+
+Examples:
+  python calibrate_escalation.py --target-accuracy 0.98
+  python calibrate_escalation.py --small ./finetuning/star_trek/star_trek_guard_finetuned --output calibration.json
+"""
+
+import argparse
+import json
+import sys
+
+import numpy as np
+
+import star_trek_api_server as server
+from guard_datasets import held_out_split, read_dataset, read_training_config
+from guard_evaluation import predict
+
+DEFAULT_DATASET = "finetuning/star_trek/star_trek_guard_dataset.jsonl"
+
+
+def fit_threshold(confidence, small_correct, large_correct, target_accuracy):
+    """Find the threshold with the lowest escalation rate whose two-tier accuracy reaches the target
+
+    Returns:
+        dict with threshold, achieved accuracy and escalation rate, plus the
+        accuracy/escalation curve at every candidate threshold
+    """
+    order = np.argsort(confidence)
+    confidence = confidence[order]
+    small_correct = small_correct[order].astype(np.float64)
+    large_correct = large_correct[order].astype(np.float64)
+    n = len(confidence)
+    # Escalating the k least confident messages: large model on [:k], small model on [k:]
+    escalated_correct = np.concatenate([[0.0], np.cumsum(large_correct)])
+    kept_correct = np.concatenate([np.cumsum(small_correct[::-1])[::-1], [0.0]])
+    accuracy = (escalated_correct + kept_correct) / n
+
+    curve = []
+    fitted = None
+    for k in range(n + 1):
+        # Only cut between distinct confidences, so "escalate below the threshold" is exact
+        if 0 < k < n and confidence[k] == confidence[k - 1]:
+            continue
+        threshold = float(confidence[k]) if k < n else 1.0 + 1e-6
+        point = {"threshold": threshold, "accuracy": float(accuracy[k]), "escalation_rate": k / n}
+        curve.append(point)
+        if fitted is None and accuracy[k] >= target_accuracy:
+            fitted = point
+    if fitted is None:
+        # The target is out of reach, so settle for the most accurate threshold
+        fitted = max(curve, key=lambda point: point["accuracy"])
+    return {**fitted, "target_reached": fitted["accuracy"] >= target_accuracy, "curve": curve}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Fit the escalation threshold between the served classifier and the larger model',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--eval-dataset', type=str, default=None,
+                        help='Labelled JSONL file of messages neither model was trained on, used whole')
+    parser.add_argument('--dataset', type=str, default=None,
+                        help=f"Labelled JSONL dataset to split (default: from the small model's training config, "
+                             f"else {DEFAULT_DATASET})")
+    parser.add_argument('--small', type=str, default=server.MODEL_PATH,
+                        help=f'Served (first tier) model (default: {server.MODEL_PATH})')
+    parser.add_argument('--large', type=str, default=server.ESCALATION_MODEL_PATH,
+                        help=f'Escalation model (default: {server.ESCALATION_MODEL_PATH})')
+    parser.add_argument('--domain', type=str, default=server.ESCALATION_DOMAIN,
+                        help=f'Domain both models classify; only its messages are escalated '
+                             f'(default: {server.ESCALATION_DOMAIN})')
+    parser.add_argument('--target-accuracy', type=float, default=0.98,
+                        help='Two-tier accuracy to reach on the held-out split (default: 0.98)')
+    parser.add_argument('--test-size', type=float, default=None,
+                        help='Held-out fraction (default: from the training config, else 0.1)')
+    parser.add_argument('--seed', type=int, default=None, help='Split seed (default: from the training config, else 42)')
+    parser.add_argument('--output', type=str, default=server.ESCALATION_CALIBRATION,
+                        help=f'Where to write the calibration (default: {server.ESCALATION_CALIBRATION})')
+    args = parser.parse_args()
+
+    training_config = read_training_config(args.small)
+    eval_dataset = args.eval_dataset or (training_config.get("eval_dataset") if args.dataset is None else None)
+    if eval_dataset:
+        dataset, test_size, seed = eval_dataset, None, None
+        texts, labels = read_dataset(eval_dataset)
+    else:
+        dataset = args.dataset or training_config.get("dataset") or DEFAULT_DATASET
+        test_size = args.test_size if args.test_size is not None else training_config.get("test_size", 0.1)
+        seed = args.seed if args.seed is not None else training_config.get("seed", 42)
+        texts, labels = held_out_split(dataset, test_size, seed)
+        if not training_config:
+            print(f"⚠️  {args.small} has no training config, so its training split is unknown and some of the "
+                  f"held-out messages may have been seen in training. Pass --eval-dataset for an unbiased threshold.",
+                  file=sys.stderr)
+
+    results = {}
+    for name, model_path in (("small", args.small), ("large", args.large)):
+        print(f"Classifying {len(texts)} held-out messages with {model_path}...", file=sys.stderr)
+        classifier_tokenizer, classifier = server.load_sequence_classifier(model_path)
+        results[name] = predict(classifier_tokenizer, classifier, texts)
+        del classifier
+
+    small_correct = results["small"].argmax(axis=1) == labels
+    large_correct = results["large"].argmax(axis=1) == labels
+    fitted = fit_threshold(results["small"].max(axis=1), small_correct, large_correct, args.target_accuracy)
+    calibration = {
+        "threshold": fitted["threshold"],
+        "target_accuracy": args.target_accuracy,
+        "target_reached": fitted["target_reached"],
+        "accuracy": fitted["accuracy"],
+        "escalation_rate": fitted["escalation_rate"],
+        "small_accuracy": float(small_correct.mean()),
+        "large_accuracy": float(large_correct.mean()),
+        "domain": args.domain,
+        "small_model": args.small,
+        "large_model": args.large,
+        "dataset": dataset,
+        "held_out": len(texts),
+        "test_size": test_size,
+        "seed": seed,
+        "curve": fitted["curve"],
+    }
+    with open(args.output, "w") as f:
+        json.dump(calibration, f, indent=2)
+    summary = {k: v for k, v in calibration.items() if k != "curve"}
+    print(json.dumps(summary, indent=2))
+    if not fitted["target_reached"]:
+        print(f"⚠️  Target accuracy {args.target_accuracy} is not reachable; using the most accurate threshold",
+              file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
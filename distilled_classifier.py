@@ -0,0 +1,191 @@
+"""
+Distilled tiny classifier tier for the topic guards.
+
+Trains a logistic regression over hashed n-gram features (the embedder from
+neighbour_index.py) to mimic the fine-tuned transformer guard. The targets
+are the teacher's temperature-softened probabilities, blended with the
+dataset's gold labels. `star_trek_api_server.py` can run it in front of the
+transformer: confident predictions are returned immediately (tens of
+microseconds on CPU) and only the rest are deferred to the full model.
+
+Examples:
+  python distilled_classifier.py train --dataset finetuning/star_trek/star_trek_guard_dataset.jsonl --output distilled/star_trek
+  python distilled_classifier.py train --dataset finetuning/new_zealand/new_zealand_guard_dataset.jsonl \\
+      --teacher geoffmunn/Qwen3Guard-NewZealand-Classification-0.6B --output distilled/new_zealand
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from guard_datasets import read_dataset, split_rows
+from neighbour_index import HashedNgramEmbedder
+
+WEIGHTS_FILENAME = "distilled_classifier.npz"
+METADATA_FILENAME = "distilled_classifier.json"
+
+
+def _softmax(logits):
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class DistilledClassifier:
+    """Logistic regression over hashed n-gram features"""
+
+    def __init__(self, embedder, weights, bias, metadata=None):
+        self.embedder = embedder
+        self.weights = weights
+        self.bias = bias
+        self.metadata = metadata or {}
+
+    def predict_proba(self, texts):
+        """Return a (len(texts), num_labels) array of class probabilities"""
+        return _softmax(self.embedder.embed(texts) @ self.weights + self.bias)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.savez(os.path.join(directory, WEIGHTS_FILENAME), weights=self.weights, bias=self.bias)
+        with open(os.path.join(directory, METADATA_FILENAME), "w") as f:
+            json.dump({**self.metadata, "embedder": self.embedder.config()}, f, indent=2)
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, METADATA_FILENAME)) as f:
+            metadata = json.load(f)
+        embedder = HashedNgramEmbedder(**metadata.pop("embedder"))
+        arrays = np.load(os.path.join(directory, WEIGHTS_FILENAME))
+        return cls(embedder, arrays["weights"], arrays["bias"], metadata)
+
+
+def fit_logistic_regression(features, targets, epochs=300, learning_rate=20.0, l2=1e-4):
+    """Full-batch gradient descent on soft-target cross entropy
+
+    The features are L2-normalised, so large learning rates are stable.
+
+    Args:
+        features: (n, dim) float32 array
+        targets: (n, num_labels) target probabilities
+
+    Returns:
+        (weights, bias)
+    """
+    weights = np.zeros((features.shape[1], targets.shape[1]), dtype=np.float32)
+    bias = np.zeros(targets.shape[1], dtype=np.float32)
+    for _ in range(epochs):
+        error = (_softmax(features @ weights + bias) - targets) / len(features)
+        weights -= learning_rate * (features.T @ error + l2 * weights)
+        bias -= learning_rate * error.sum(axis=0)
+    return weights, bias
+
+
+def teacher_probabilities(texts, teacher, batch_size):
+    """Run the transformer guard over texts and return its (n, num_labels) probabilities
+
+    Rows the guard gives no probabilities for (empty messages, NaN logits) are NaN.
+    """
+    import star_trek_api_server as server
+    if teacher:
+        server.MODEL_PATH = teacher
+    server.load_model()
+    probabilities = []
+    for start in range(0, len(texts), batch_size):
+        results, _ = server.classify_messages(texts[start:start + batch_size])
+        probabilities.extend(r.get("probabilities") or [np.nan] * len(server.ID2LABEL) for r in results)
+        print(f"Teacher: {min(start + batch_size, len(texts))}/{len(texts)}", file=sys.stderr)
+    return np.asarray(probabilities, dtype=np.float32)
+
+
+def coverage_report(probabilities, reference, thresholds):
+    """Fraction answered at each confidence threshold and agreement with the reference on those"""
+    confidence = probabilities.max(axis=1)
+    agree = probabilities.argmax(axis=1) == reference
+    report = []
+    for threshold in thresholds:
+        answered = confidence >= threshold
+        report.append({
+            "threshold": threshold,
+            "answered": float(answered.mean()),
+            "agreement": float(agree[answered].mean()) if answered.any() else None,
+        })
+    return report
+
+
+def train(args):
+    texts, gold = read_dataset(args.dataset)
+    num_labels = int(gold.max()) + 1
+    teacher = teacher_probabilities(texts, args.teacher, args.batch_size)
+    missing = np.isnan(teacher).any(axis=1)
+    if missing.any():
+        # Without a teacher prediction the gold label is the only target
+        print(f"⚠️  No teacher probabilities for {int(missing.sum())} questions; using their gold labels",
+              file=sys.stderr)
+        teacher[missing] = np.eye(num_labels, dtype=np.float32)[gold[missing]]
+
+    # Soften the teacher with a temperature, then blend in the gold labels
+    soft = _softmax(np.log(np.clip(teacher, 1e-8, 1.0)) / args.temperature)
+    targets = args.alpha * soft + (1 - args.alpha) * np.eye(num_labels, dtype=np.float32)[gold]
+
+    train_rows, held_out = split_rows(len(texts), args.test_size, args.seed)
+
+    embedder = HashedNgramEmbedder(dim=args.dim)
+    features = embedder.embed(texts)
+    weights, bias = fit_logistic_regression(features[train_rows], targets[train_rows],
+                                            epochs=args.epochs, learning_rate=args.learning_rate)
+
+    thresholds = [float(t) for t in args.thresholds.split(",") if t.strip()]
+    student = _softmax(features[held_out] @ weights + bias)
+    report = {
+        "held_out": len(held_out),
+        "teacher_agreement": float((student.argmax(1) == teacher[held_out].argmax(1)).mean()),
+        "gold_accuracy": float((student.argmax(1) == gold[held_out]).mean()),
+        "teacher_gold_accuracy": float((teacher[held_out].argmax(1) == gold[held_out]).mean()),
+        "coverage_vs_teacher": coverage_report(student, teacher[held_out].argmax(1), thresholds),
+    }
+    model = DistilledClassifier(embedder, weights, bias, {
+        "dataset": os.path.basename(args.dataset),
+        "teacher": args.teacher,
+        "temperature": args.temperature,
+        "alpha": args.alpha,
+        "evaluation": report,
+    })
+    model.save(args.output)
+    print(f"✅ Distilled classifier saved to {args.output}", file=sys.stderr)
+    print(json.dumps(report, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Distil the transformer topic guard into a tiny linear classifier',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    train_parser = subparsers.add_parser('train', help='Distil a teacher guard on a labelled dataset')
+    train_parser.add_argument('--dataset', required=True, help='Fine-tuning JSONL file ({"input", "label"} lines)')
+    train_parser.add_argument('--output', required=True, help='Directory to write the distilled classifier to')
+    train_parser.add_argument('--teacher', type=str, default=None,
+                              help='Teacher model (default: MODEL_PATH in star_trek_api_server.py)')
+    train_parser.add_argument('--dim', type=int, default=4096, help='Hashed feature dimension (default: 4096)')
+    train_parser.add_argument('--temperature', type=float, default=2.0,
+                              help='Softening temperature for the teacher probabilities (default: 2.0)')
+    train_parser.add_argument('--alpha', type=float, default=0.7,
+                              help='Weight of the teacher targets against the gold labels (default: 0.7)')
+    train_parser.add_argument('--epochs', type=int, default=300, help='Gradient descent epochs (default: 300)')
+    train_parser.add_argument('--learning-rate', type=float, default=20.0, help='Learning rate (default: 20.0)')
+    train_parser.add_argument('--batch-size', type=int, default=64, help='Teacher batch size (default: 64)')
+    train_parser.add_argument('--test-size', type=float, default=0.1, help='Held-out fraction (default: 0.1)')
+    train_parser.add_argument('--seed', type=int, default=42, help='Split seed (default: 42)')
+    train_parser.add_argument('--thresholds', type=str, default='0.6,0.7,0.8,0.9,0.95',
+                              help='Confidence thresholds to report coverage for (default: 0.6,0.7,0.8,0.9,0.95)')
+    args = parser.parse_args()
+
+    if args.command == 'train':
+        train(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Adaptive server-side batching for single-item requests.
+
+Concurrent requests each submit one item; a background worker groups them
+into batches and runs one call of `process_fn` per batch. The wait window and
+batch-size limit adapt to a latency target:
+
+- light traffic (a batch of one with nothing else queued) halves the wait
+  window towards zero, so a lone request is never held back;
+- a deep queue doubles the batch limit, up to `max_batch_size`;
+- when the observed request latency (queue wait + processing) exceeds the
+  target, the window is halved and the batch limit cut back;
+- when there is traffic and latency is comfortably under target, the window
+  grows so more requests can share a forward pass.
+
+Batch-size and wait-time distributions are kept for export via `stats()`.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from guard_logging import get_logger
+
+WAIT_HISTOGRAM_MS = [0.5, 1, 2, 5, 10, 20, 50, 100]
+
+logger = get_logger(__name__)
+
+
+class AdaptiveBatcher:
+    """Batch concurrent single-item requests under a latency target
+
+    Args:
+        process_fn: Called with a list of items, must return a list of results in the same order
+        latency_target_ms: Target per-request latency (queue wait plus processing)
+        max_batch_size: Hard upper limit on the batch size
+        max_wait_ms: Hard upper limit on the wait window
+    """
+
+    def __init__(self, process_fn, latency_target_ms=50.0, max_batch_size=32, max_wait_ms=10.0):
+        self.process_fn = process_fn
+        self.latency_target = latency_target_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.wait = 0.0
+        self.batch_limit = 1
+        self.latency_ewma = None
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = {}
+        self._wait_counts = [0] * (len(WAIT_HISTOGRAM_MS) + 1)
+        self._batches = 0
+        self._items = 0
+        self._worker = threading.Thread(target=self._run, name="adaptive-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, item, timeout=None):
+        """Queue one item and block until its result is ready"""
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future.result(timeout=timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.wait
+        while len(batch) < self.batch_limit:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            items = [item for item, _, _ in batch]
+            try:
+                results = self.process_fn(items)
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                logger.exception("Error in batched processing", batch_size=len(batch))
+                for _, future, _ in batch:
+                    future.set_exception(e)
+            finished = time.perf_counter()
+            waits = [started - enqueued for _, _, enqueued in batch]
+            self._record(len(batch), waits)
+            self._adapt(len(batch), max(waits) + (finished - started))
+
+    def _adapt(self, batch_size, latency):
+        self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+        queued = self._queue.qsize()
+        if latency > self.latency_target:
+            self.wait /= 2
+            self.batch_limit = max(1, int(self.batch_limit * 0.75))
+        elif queued >= self.batch_limit:
+            self.batch_limit = min(self.max_batch_size, self.batch_limit * 2)
+        elif batch_size == 1 and queued == 0:
+            self.wait /= 2
+        elif self.latency_ewma < 0.8 * self.latency_target:
+            self.wait = min(self.max_wait, self.wait + 0.1 * self.max_wait)
+            self.batch_limit = min(self.max_batch_size, self.batch_limit + 1)
+        if self.wait < 0.0001:
+            self.wait = 0.0
+
+    def _record(self, batch_size, waits):
+        with self._stats_lock:
+            self._batches += 1
+            self._items += batch_size
+            self._batch_sizes[batch_size] = self._batch_sizes.get(batch_size, 0) + 1
+            for wait in waits:
+                wait_ms = wait * 1000
+                bucket = next((i for i, edge in enumerate(WAIT_HISTOGRAM_MS) if wait_ms <= edge),
+                              len(WAIT_HISTOGRAM_MS))
+                self._wait_counts[bucket] += 1
+
+    def stats(self):
+        """Current settings plus batch-size and wait-time distributions"""
+        with self._stats_lock:
+            return {
+                "latency_target_ms": self.latency_target * 1000,
+                "current_wait_ms": self.wait * 1000,
+                "current_batch_limit": self.batch_limit,
+                "latency_ewma_ms": self.latency_ewma * 1000 if self.latency_ewma is not None else None,
+                "queue_depth": self._queue.qsize(),
+                "batches": self._batches,
+                "items": self._items,
+                "mean_batch_size": self._items / self._batches if self._batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                # Bucket upper bounds in ms; the last bucket (le_ms None) is everything above
+                "wait_time_histogram": [
+                    {"le_ms": edge, "count": count}
+                    for edge, count in zip(WAIT_HISTOGRAM_MS + [None], self._wait_counts)
+                ],
+            }
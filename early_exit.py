@@ -0,0 +1,202 @@
+"""
+Early-exit classification heads for the Qwen3 topic classifiers.
+
+A head is a linear classifier on the last-token hidden state of an
+intermediate decoder layer, passed through the model's final norm. The
+fine-tuning scripts train heads on the frozen fine-tuned model with
+`train_early_exit_heads` and save them next to the model. At inference,
+`EarlyExitRunner` hooks those layers. As soon as every row of a batch is
+confident at some layer, it stops the forward pass by raising `EarlyExit`,
+so short, obvious questions skip the remaining layers.
+"""
+
+import threading
+
+import torch
+
+HEADS_FILENAME = "early_exit_heads.pt"
+
+
+class EarlyExit(Exception):
+    """Raised from a layer hook to stop the forward pass early"""
+
+    def __init__(self, layer, logits):
+        super().__init__(layer)
+        self.layer = layer
+        self.logits = logits
+
+
+def find_backbone(model):
+    """Return the decoder stack (with .layers and .norm) of a possibly PEFT-wrapped classifier"""
+    for module in model.modules():
+        if isinstance(getattr(module, "layers", None), torch.nn.ModuleList) and hasattr(module, "norm"):
+            return module
+    raise ValueError("Could not find the decoder layers of the model")
+
+
+def default_exit_layers(num_layers):
+    """Exit after each quarter of the network (the last layer is the regular head)"""
+    return sorted({num_layers * i // 4 - 1 for i in (1, 2, 3)})
+
+
+def pool_last_token(hidden, attention_mask):
+    """Hidden state of the last attended token in each row"""
+    positions = torch.arange(attention_mask.shape[1], device=attention_mask.device)
+    last = (positions * attention_mask).argmax(dim=-1)
+    return hidden[torch.arange(hidden.shape[0], device=hidden.device), last]
+
+
+class EarlyExitHeads(torch.nn.Module):
+    """One linear head per exit layer, keyed by 0-based decoder layer index"""
+
+    def __init__(self, layers, hidden_size, num_labels):
+        super().__init__()
+        self.layers = sorted(layers)
+        self.hidden_size = hidden_size
+        self.num_labels = num_labels
+        self.heads = torch.nn.ModuleDict({str(layer): torch.nn.Linear(hidden_size, num_labels) for layer in self.layers})
+
+    def logits(self, layer, normed_pooled):
+        head = self.heads[str(layer)]
+        return head(normed_pooled.to(head.weight.dtype))
+
+    def save(self, path, **metadata):
+        torch.save({
+            "layers": self.layers,
+            "hidden_size": self.hidden_size,
+            "num_labels": self.num_labels,
+            "state_dict": self.state_dict(),
+            **metadata,
+        }, path)
+
+    @classmethod
+    def load(cls, path):
+        checkpoint = torch.load(path, map_location="cpu", weights_only=True)
+        heads = cls(checkpoint["layers"], checkpoint["hidden_size"], checkpoint["num_labels"])
+        heads.load_state_dict(checkpoint["state_dict"])
+        return heads.eval()
+
+
+@torch.no_grad()
+def extract_exit_features(model, tokenizer, texts, layers, batch_size=16, max_length=512):
+    """Normed last-token hidden states of each exit layer, as {layer: (len(texts), hidden) float32 CPU tensor}"""
+    backbone = find_backbone(model)
+    features = {layer: [] for layer in layers}
+    model.eval()
+    for start in range(0, len(texts), batch_size):
+        inputs = tokenizer(texts[start:start + batch_size], return_tensors="pt", truncation=True,
+                           padding=True, max_length=max_length)
+        inputs = {k: v.to(model.device) for k, v in inputs.items()}
+        hidden_states = model(**inputs, output_hidden_states=True).hidden_states
+        for layer in layers:
+            # hidden_states[0] is the embedding output, so layer k's output is at k + 1
+            pooled = pool_last_token(hidden_states[layer + 1], inputs["attention_mask"])
+            features[layer].append(backbone.norm(pooled).float().cpu())
+    return {layer: torch.cat(chunks) for layer, chunks in features.items()}
+
+
+def train_early_exit_heads(model, tokenizer, texts, labels, eval_texts=None, eval_labels=None, layers=None,
+                           epochs=30, batch_size=64, learning_rate=1e-3, max_length=512):
+    """Train a linear head per exit layer on the frozen model's hidden states
+
+    Returns:
+        (EarlyExitHeads, {layer: held-out accuracy} or None)
+    """
+    backbone = find_backbone(model)
+    layers = layers or default_exit_layers(len(backbone.layers))
+    num_labels = model.config.num_labels
+    features = extract_exit_features(model, tokenizer, texts, layers, max_length=max_length)
+    targets = torch.tensor(labels)
+    heads = EarlyExitHeads(layers, features[layers[0]].shape[1], num_labels)
+
+    optimizer = torch.optim.AdamW(heads.parameters(), lr=learning_rate)
+    for _ in range(epochs):
+        order = torch.randperm(len(targets))
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            loss = sum(torch.nn.functional.cross_entropy(heads.logits(layer, features[layer][rows]), targets[rows])
+                       for layer in layers)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+    heads.eval()
+
+    accuracy = None
+    if eval_texts:
+        eval_features = extract_exit_features(model, tokenizer, eval_texts, layers, max_length=max_length)
+        eval_targets = torch.tensor(eval_labels)
+        with torch.no_grad():
+            accuracy = {layer: (heads.logits(layer, eval_features[layer]).argmax(-1) == eval_targets).float().mean().item()
+                        for layer in layers}
+    return heads, accuracy
+
+
+class EarlyExitRunner:
+    """Run a classifier, stopping at the first exit layer where every row is confident
+
+    Args:
+        model: The sequence classification model the heads were trained on
+        heads: EarlyExitHeads
+        threshold: Minimum softmax confidence of every row to exit at a layer
+    """
+
+    def __init__(self, model, heads, threshold=0.95):
+        self.backbone = find_backbone(model)
+        parameter = next(model.parameters())
+        self.heads = heads.to(parameter.device)
+        self.threshold = threshold
+        self.num_layers = len(self.backbone.layers)
+        self.exits = {layer: 0 for layer in heads.layers}
+        self.full_depth = 0
+        self._stats_lock = threading.Lock()
+        # Only forward passes started by this runner (on this thread) may exit early
+        self._active = threading.local()
+        self._handles = [self.backbone.layers[layer].register_forward_hook(self._hook(layer))
+                         for layer in heads.layers]
+
+    def _hook(self, layer):
+        def hook(module, args, output):
+            attention_mask = getattr(self._active, "attention_mask", None)
+            if attention_mask is None:
+                return None
+            hidden = output[0] if isinstance(output, tuple) else output
+            pooled = self.backbone.norm(pool_last_token(hidden, attention_mask))
+            logits = self.heads.logits(layer, pooled)
+            if bool((torch.softmax(logits.float(), dim=-1).max(dim=-1).values >= self.threshold).all()):
+                raise EarlyExit(layer, logits)
+            return None
+        return hook
+
+    def __call__(self, model, inputs, **kwargs):
+        """Return (logits, exit layer or None when the whole network ran)"""
+        self._active.attention_mask = inputs["attention_mask"]
+        try:
+            logits, layer = model(**inputs, **kwargs).logits, None
+        except EarlyExit as e:
+            logits, layer = e.logits, e.layer
+        finally:
+            self._active.attention_mask = None
+        rows = logits.shape[0]
+        with self._stats_lock:
+            if layer is None:
+                self.full_depth += rows
+            else:
+                self.exits[layer] += rows
+        return logits, layer
+
+    def stats(self):
+        """Rows exiting at each layer, and the average fraction of layers run"""
+        with self._stats_lock:
+            total = sum(self.exits.values()) + self.full_depth
+            layers_run = sum((layer + 1) * count for layer, count in self.exits.items()) + self.num_layers * self.full_depth
+            return {
+                "threshold": self.threshold,
+                "num_layers": self.num_layers,
+                "exits": {str(layer): count for layer, count in self.exits.items()},
+                "full_depth": self.full_depth,
+                "mean_layer_fraction": layers_run / (total * self.num_layers) if total else None,
+            }
+
+    def remove(self):
+        for handle in self._handles:
+            handle.remove()
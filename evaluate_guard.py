@@ -0,0 +1,233 @@
+"""
+Evaluate a fine-tuned topic guard on its held-out split and measure its CPU latency.
+
+Classifies the held-out questions in length-bucketed batches and reports
+accuracy, per-label precision/recall/F1, the confusion matrix and calibration
+(expected calibration error, Brier score and a reliability table). It then
+times forward passes on the CPU at each batch size and sequence length. The
+report is written as JSON, so deployments can be gated on quality and speed.
+
+The model can be a full model directory or a LoRA adapter directory. For a
+directory written by `finetuning/train_domain_guard.py`, the held-out split
+is rebuilt from its `training_config.json`: the same dataset, test size and
+seed, or the config's eval_dataset, and the same max length. Otherwise the
+split comes from --dataset, --test-size and --seed.
+
+Examples:
+  python evaluate_guard.py --model ./finetuning/star_trek/star_trek_guard_finetuned
+  python evaluate_guard.py --model geoffmunn/Qwen3Guard-StarTrek-Classification-0.6B \\
+      --dataset finetuning/star_trek/star_trek_guard_dataset.jsonl --output evaluation.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+import star_trek_api_server as server
+from guard_datasets import held_out_split, read_dataset, read_training_config
+from guard_evaluation import percentile, predict
+
+REPORT_FILENAME = "evaluation.json"
+
+
+def load_guard(model_path, base_model=None):
+    """Load a full model directory or a LoRA adapter directory
+
+    Returns:
+        (tokenizer, model, base model of the adapter or None)
+    """
+    adapter_config_path = os.path.join(model_path, "adapter_config.json")
+    if not os.path.exists(adapter_config_path):
+        return (*server.load_sequence_classifier(model_path), None)
+    with open(adapter_config_path) as f:
+        base_model = base_model or json.load(f)["base_model_name_or_path"]
+    return (*server.load_adapter_classifier(base_model, {"evaluated": model_path}), base_model)
+
+
+def classification_report(labels, predictions, label_names):
+    """Accuracy, per-label precision/recall/F1 and the confusion matrix (rows: true label, columns: predicted)"""
+    num_labels = len(label_names)
+    confusion = np.zeros((num_labels, num_labels), dtype=np.int64)
+    np.add.at(confusion, (labels, predictions), 1)
+    per_label = {}
+    for i, name in enumerate(label_names):
+        predicted = confusion[:, i].sum()
+        actual = confusion[i].sum()
+        precision = confusion[i, i] / predicted if predicted else 0.0
+        recall = confusion[i, i] / actual if actual else 0.0
+        per_label[name] = {
+            "precision": float(precision),
+            "recall": float(recall),
+            "f1": float(2 * precision * recall / (precision + recall)) if precision + recall else 0.0,
+            "support": int(actual),
+        }
+    return {
+        "accuracy": float(np.trace(confusion) / confusion.sum()),
+        "macro_f1": float(np.mean([scores["f1"] for scores in per_label.values()])),
+        "per_label": per_label,
+        "confusion_matrix": {"labels": list(label_names), "matrix": confusion.tolist()},
+    }
+
+
+def calibration_report(labels, probabilities, num_bins=10):
+    """Expected calibration error and reliability table of the top-label confidence, plus the Brier score"""
+    confidence = probabilities.max(axis=1)
+    correct = probabilities.argmax(axis=1) == labels
+    # Bin i holds confidences in (i / num_bins, (i + 1) / num_bins]
+    bin_ids = np.clip(np.ceil(confidence * num_bins).astype(int) - 1, 0, num_bins - 1)
+    bins = []
+    ece = 0.0
+    for i in range(num_bins):
+        members = bin_ids == i
+        if not members.any():
+            continue
+        gap = abs(confidence[members].mean() - correct[members].mean())
+        ece += members.mean() * gap
+        bins.append({
+            "lower": i / num_bins,
+            "upper": (i + 1) / num_bins,
+            "count": int(members.sum()),
+            "confidence": float(confidence[members].mean()),
+            "accuracy": float(correct[members].mean()),
+        })
+    one_hot = np.eye(probabilities.shape[1])[labels]
+    return {
+        "ece": float(ece),
+        "brier": float(((probabilities - one_hot) ** 2).sum(axis=1).mean()),
+        "mean_confidence": float(confidence.mean()),
+        "bins": bins,
+    }
+
+
+def measure_latency(classifier, token_pool, batch_sizes, sequence_lengths, repeats=20, warmup=3):
+    """Forward-pass latency on the CPU for each batch size and sequence length
+
+    Inputs are tiled from token_pool (real question tokens), with every position attended.
+    """
+    token_pool = torch.as_tensor(token_pool, dtype=torch.long)
+    results = []
+    with torch.no_grad():
+        for sequence_length in sequence_lengths:
+            for batch_size in batch_sizes:
+                needed = batch_size * sequence_length
+                input_ids = token_pool.repeat(-(-needed // len(token_pool)))[:needed].view(batch_size, sequence_length)
+                inputs = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+                latencies = []
+                for step in range(warmup + repeats):
+                    started = time.perf_counter()
+                    classifier(**inputs)
+                    if step >= warmup:
+                        latencies.append(time.perf_counter() - started)
+                results.append({
+                    "batch_size": batch_size,
+                    "sequence_length": sequence_length,
+                    "mean_ms": sum(latencies) / len(latencies) * 1000,
+                    "p50_ms": percentile(latencies, 50) * 1000,
+                    "p95_ms": percentile(latencies, 95) * 1000,
+                    "questions_per_second": batch_size * len(latencies) / sum(latencies),
+                })
+                print(f"Batch {batch_size} x {sequence_length} tokens: "
+                      f"p50 {results[-1]['p50_ms']:.1f} ms, p95 {results[-1]['p95_ms']:.1f} ms", file=sys.stderr)
+    return results
+
+
+def int_list(value):
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Evaluate a topic guard on its held-out split and measure its CPU latency',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--model', type=str, required=True, help='Model or LoRA adapter directory (or Hub id)')
+    parser.add_argument('--base-model', type=str, default=None,
+                        help="Base model of an adapter (default: the adapter config's base model)")
+    parser.add_argument('--dataset', type=str, default=None,
+                        help='Labelled JSONL dataset (default: from the training config)')
+    parser.add_argument('--test-size', type=float, default=None,
+                        help='Held-out fraction (default: from the training config, else 0.1)')
+    parser.add_argument('--seed', type=int, default=None, help='Split seed (default: from the training config, else 42)')
+    parser.add_argument('--batch-size', type=int, default=server.BATCH_MAX_SIZE,
+                        help=f'Largest batch for the held-out predictions (default: {server.BATCH_MAX_SIZE})')
+    parser.add_argument('--latency-batch-sizes', type=int_list, default=[1, 8, 32],
+                        help='Comma-separated batch sizes to time (default: 1,8,32)')
+    parser.add_argument('--latency-lengths', type=int_list, default=[16, 64, 256],
+                        help='Comma-separated sequence lengths to time (default: 16,64,256)')
+    parser.add_argument('--latency-repeats', type=int, default=20, help='Timed passes per shape (default: 20)')
+    parser.add_argument('--threads', type=int, default=None, help='CPU threads for the latency runs (default: torch default)')
+    parser.add_argument('--output', type=str, default=None,
+                        help=f'Where to write the report (default: MODEL/{REPORT_FILENAME} for a local model)')
+    args = parser.parse_args()
+
+    training_config = read_training_config(args.model)
+    server.MAX_LENGTH = training_config.get("max_length") or server.MAX_LENGTH
+    server.BATCH_MAX_SIZE = args.batch_size
+
+    if args.dataset is None and training_config.get("eval_dataset"):
+        dataset, test_size, seed = training_config["eval_dataset"], None, None
+        texts, labels = read_dataset(dataset)
+    else:
+        dataset = args.dataset or training_config.get("dataset")
+        if dataset is None:
+            parser.error("--dataset is required for a model without a training config")
+        test_size = args.test_size if args.test_size is not None else training_config.get("test_size", 0.1)
+        seed = args.seed if args.seed is not None else training_config.get("seed", 42)
+        texts, labels = held_out_split(dataset, test_size, seed)
+
+    classifier_tokenizer, classifier, base_model = load_guard(args.model, args.base_model)
+    label_names = [server.ID2LABEL[i] for i in range(len(server.ID2LABEL))]
+
+    print(f"Classifying {len(texts)} held-out questions with {args.model}...", file=sys.stderr)
+    started = time.perf_counter()
+    probabilities = predict(classifier_tokenizer, classifier, texts)
+    predict_seconds = time.perf_counter() - started
+
+    # Latency is measured on the CPU in float32, as the servers run without a GPU
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    classifier = classifier.to("cpu", torch.float32)
+    token_pool = [token for ids in classifier_tokenizer(texts)["input_ids"] for token in ids]
+    latency = measure_latency(classifier, token_pool, args.latency_batch_sizes, args.latency_lengths,
+                              repeats=args.latency_repeats)
+
+    report = {
+        "model": args.model,
+        "base_model": base_model,
+        "dataset": dataset,
+        "held_out": len(texts),
+        "test_size": test_size,
+        "seed": seed,
+        "max_length": server.MAX_LENGTH,
+        "quality": {
+            **classification_report(labels, probabilities.argmax(axis=1), label_names),
+            "calibration": calibration_report(labels, probabilities),
+            "questions_per_second": len(texts) / predict_seconds,
+        },
+        "latency": {
+            "device": "cpu",
+            "dtype": "float32",
+            "threads": torch.get_num_threads(),
+            "results": latency,
+        },
+    }
+    output = args.output or (os.path.join(args.model, REPORT_FILENAME) if os.path.isdir(args.model) else REPORT_FILENAME)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    summary = {
+        "accuracy": report["quality"]["accuracy"],
+        "macro_f1": report["quality"]["macro_f1"],
+        "ece": report["quality"]["calibration"]["ece"],
+        "p95_ms": {f"{r['batch_size']}x{r['sequence_length']}": r["p95_ms"] for r in latency},
+    }
+    print(json.dumps(summary, indent=2))
+    print(f"✅ Evaluation written to {output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+"""
+Export the guard models to ONNX for the onnxruntime backend.
+
+By default the topic classification model is exported: model.onnx,
+guard_onnx.json and the tokenizer are written to the output directory. With
+--stream the Stream model's single-token step is exported instead, with the
+past keys and values as graph inputs and the grown ones as outputs
+(stream_step.onnx and stream_onnx.json). The step graph is for running the
+Stream model's backbone in other runtimes: qwen_stream_api_server.py stays on
+PyTorch, because the per-token risk and category post-processing lives in the
+model's remote code.
+
+Every export is followed by a parity check that runs the same inputs through
+PyTorch and ONNX Runtime, and the script exits non-zero if the outputs or
+predicted labels disagree (--skip-parity turns it off).
+
+Examples:
+  python export_onnx.py --output onnx/star_trek
+  python export_onnx.py --model ./finetuning/star_trek/star_trek_guard_finetuned --output onnx/local
+  python export_onnx.py --stream --output onnx/stream
+"""
+
+import argparse
+import inspect
+import json
+import os
+import sys
+
+import torch
+from transformers import AutoModel, AutoTokenizer, AutoModelForSequenceClassification, DynamicCache
+
+from guard_models import STAR_TREK_MAX_LENGTH, STAR_TREK_MODEL_PATH, STREAM_MODEL_PATHS
+from onnx_backend import ONNX_FILENAME, METADATA_FILENAME, OrtSequenceClassifier, create_session
+
+PARITY_INPUTS = [
+    "What is the Prime Directive in Star Trek?",
+    "What is the capital of France?",
+    "How does a warp drive work?",
+    "What is 2 + 2?",
+    "Did the Borg destory the death star?",
+    "Who is the captain of the Enterprise?",
+    "Could Darth Vader beat the Vulcans?",
+]
+
+STREAM_ONNX_FILENAME = "stream_step.onnx"
+STREAM_METADATA_FILENAME = "stream_onnx.json"
+
+# Output fields of the Stream model that are not per-step predictions
+NON_STEP_OUTPUTS = ("past_key_values", "hidden_states", "attentions")
+
+
+class _LogitsOnly(torch.nn.Module):
+    """Expose just (input_ids, attention_mask) -> logits for tracing"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask, use_cache=False).logits
+
+
+def cache_tensors(cache):
+    """Flatten a transformers KV cache into [key_0, value_0, key_1, value_1, ...]"""
+    if hasattr(cache, "layers"):
+        return [tensor for layer in cache.layers for tensor in (layer.keys, layer.values)]
+    return [tensor for pair in zip(cache.key_cache, cache.value_cache) for tensor in pair]
+
+
+class _StreamStepWithPast(torch.nn.Module):
+    """Expose (input_ids, attention_mask, *past) -> (*step outputs, *present) for tracing"""
+
+    def __init__(self, model, output_names):
+        super().__init__()
+        self.model = model
+        self.output_names = output_names
+
+    def forward(self, input_ids, attention_mask, *past):
+        cache = DynamicCache()
+        for i in range(len(past) // 2):
+            cache.update(past[2 * i], past[2 * i + 1], i)
+        outputs = self.model(input_ids=input_ids, attention_mask=attention_mask,
+                             past_key_values=cache, use_cache=True, return_dict=True)
+        return (*[outputs[name] for name in self.output_names], *cache_tensors(outputs.past_key_values))
+
+
+def torchscript_export_kwargs():
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # The TorchScript exporter handles the data-dependent pooling of the
+        # sequence classification head and the KV cache without extra dependencies
+        return {"dynamo": False}
+    return {}
+
+
+def load_tokenizer(model_path):
+    tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    return tokenizer
+
+
+def export(model_path, output_dir, opset):
+    """Export the classifier and its tokenizer to output_dir"""
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = load_tokenizer(model_path)
+    model = AutoModelForSequenceClassification.from_pretrained(
+        model_path,
+        dtype=torch.float32,
+        trust_remote_code=True,
+    ).eval()
+
+    sample = tokenizer(PARITY_INPUTS[:2], return_tensors="pt", padding=True)
+    print(f"Exporting {model_path} to {output_dir}...")
+    torch.onnx.export(
+        _LogitsOnly(model),
+        (sample["input_ids"], sample["attention_mask"]),
+        os.path.join(output_dir, ONNX_FILENAME),
+        input_names=["input_ids", "attention_mask"],
+        output_names=["logits"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "logits": {0: "batch"},
+        },
+        opset_version=opset,
+        **torchscript_export_kwargs(),
+    )
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, METADATA_FILENAME), "w") as f:
+        json.dump({
+            "source_model": model_path,
+            # The same names the torch backend reports as model_id2label
+            "id2label": {str(k): v for k, v in model.config.id2label.items()},
+            "max_length": STAR_TREK_MAX_LENGTH,
+            "opset": opset,
+        }, f, indent=2)
+    return model, tokenizer
+
+
+def stream_prefix(tokenizer, text):
+    """Token ids of a user turn, the kind of prefix the Stream model steps on from"""
+    return tokenizer(
+        tokenizer.apply_chat_template([{"role": "user", "content": text}], tokenize=False, enable_thinking=False),
+        return_tensors="pt",
+    ).input_ids
+
+
+def export_stream_step(model_path, output_dir, opset):
+    """Export the Stream model's single-token step, with past keys and values, to output_dir
+
+    The model is loaded with its remote code and called the way a cached step is:
+    one new token, the past keys and values and a mask over both. Its tensor
+    outputs other than the cache become the graph's outputs, followed by the
+    present keys and values.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = load_tokenizer(model_path)
+    model = AutoModel.from_pretrained(model_path, dtype=torch.float32, trust_remote_code=True).eval()
+
+    prefix_ids = stream_prefix(tokenizer, PARITY_INPUTS[0])
+    with torch.no_grad():
+        prefill = model(input_ids=prefix_ids, use_cache=True, return_dict=True)
+    past = cache_tensors(prefill.past_key_values)
+    num_layers = len(past) // 2
+    output_names = [name for name, value in prefill.items()
+                    if name not in NON_STEP_OUTPUTS and torch.is_tensor(value)]
+    past_names = [f"past.{i}.{kind}" for i in range(num_layers) for kind in ("key", "value")]
+    present_names = [f"present.{i}.{kind}" for i in range(num_layers) for kind in ("key", "value")]
+
+    step_ids = prefix_ids[:, -1:]
+    attention_mask = torch.ones(1, prefix_ids.shape[1] + 1, dtype=torch.long)
+    print(f"Exporting the step of {model_path} to {output_dir}...")
+    torch.onnx.export(
+        _StreamStepWithPast(model, output_names),
+        (step_ids, attention_mask, *past),
+        os.path.join(output_dir, STREAM_ONNX_FILENAME),
+        input_names=["input_ids", "attention_mask", *past_names],
+        output_names=[*output_names, *present_names],
+        dynamic_axes={
+            "input_ids": {0: "batch"},
+            "attention_mask": {0: "batch", 1: "total_sequence"},
+            **{name: {0: "batch", 2: "past_sequence"} for name in past_names},
+            **{name: {0: "batch", 2: "total_sequence"} for name in present_names},
+        },
+        opset_version=opset,
+        **torchscript_export_kwargs(),
+    )
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, STREAM_METADATA_FILENAME), "w") as f:
+        json.dump({
+            "source_model": model_path,
+            "output_names": output_names,
+            "num_layers": num_layers,
+            "opset": opset,
+        }, f, indent=2)
+    return model, tokenizer
+
+
+def check_parity(model, tokenizer, output_dir, tolerance):
+    """Compare PyTorch and ONNX Runtime logits on single and padded batched inputs"""
+    ort_model = OrtSequenceClassifier(output_dir)
+    batches = [[text] for text in PARITY_INPUTS] + [PARITY_INPUTS]
+    max_diff = 0.0
+    mismatches = 0
+    for batch in batches:
+        inputs = tokenizer(batch, return_tensors="pt", truncation=True, padding=True, max_length=STAR_TREK_MAX_LENGTH)
+        with torch.no_grad():
+            expected = model(**inputs).logits.float()
+        actual = ort_model(**inputs).logits.float()
+        max_diff = max(max_diff, (expected - actual).abs().max().item())
+        mismatches += int((expected.argmax(dim=-1) != actual.argmax(dim=-1)).sum())
+    if ort_model.config.id2label != model.config.id2label:
+        print(f"Parity: id2label {ort_model.config.id2label} != {model.config.id2label}")
+        mismatches += 1
+    print(f"Parity: max |logit difference| = {max_diff:.2e}, label mismatches = {mismatches}")
+    return max_diff <= tolerance and mismatches == 0
+
+
+def check_stream_parity(model, tokenizer, output_dir, tolerance, steps=8):
+    """Step PyTorch and ONNX Runtime through the same tokens from each parity prefix and compare outputs
+
+    Each run feeds the graph its own previous present, so drift in the cache shows
+    up in later steps.
+    """
+    with open(os.path.join(output_dir, STREAM_METADATA_FILENAME)) as f:
+        metadata = json.load(f)
+    output_names = metadata["output_names"]
+    session = create_session(os.path.join(output_dir, STREAM_ONNX_FILENAME))
+    max_diff = 0.0
+    mismatches = 0
+    for text in PARITY_INPUTS:
+        prefix_ids = stream_prefix(tokenizer, text)
+        with torch.no_grad():
+            prefill = model(input_ids=prefix_ids, use_cache=True, return_dict=True)
+        cache = prefill.past_key_values
+        ort_past = cache_tensors(cache)
+        step_ids = tokenizer(text, return_tensors="pt").input_ids[:, :steps]
+        for i in range(step_ids.shape[1]):
+            input_ids = step_ids[:, i:i + 1]
+            attention_mask = torch.ones(1, prefix_ids.shape[1] + i + 1, dtype=torch.long)
+            with torch.no_grad():
+                expected = model(input_ids=input_ids, attention_mask=attention_mask,
+                                 past_key_values=cache, use_cache=True, return_dict=True)
+            cache = expected.past_key_values
+            feeds = {"input_ids": input_ids.numpy(), "attention_mask": attention_mask.numpy()}
+            for j, tensor in enumerate(ort_past):
+                feeds[f"past.{j // 2}.{('key', 'value')[j % 2]}"] = tensor.numpy()
+            results = [torch.from_numpy(value) for value in session.run(None, feeds)]
+            ort_past = results[len(output_names):]
+            for name, actual_value in zip(output_names, results):
+                expected_value = expected[name].float()
+                actual_value = actual_value.float()
+                max_diff = max(max_diff, (expected_value - actual_value).abs().max().item())
+                if expected_value.dim() and expected_value.shape[-1] > 1:
+                    mismatches += int((expected_value.argmax(dim=-1) != actual_value.argmax(dim=-1)).sum())
+    print(f"Stream parity: max |output difference| = {max_diff:.2e}, argmax mismatches = {mismatches}")
+    return max_diff <= tolerance and mismatches == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Export the guard models to ONNX',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--model', type=str, default=None,
+                        help=f'Model to export (default: {STAR_TREK_MODEL_PATH}, '
+                             f'or {STREAM_MODEL_PATHS["0.6B"]} with --stream)')
+    parser.add_argument('--stream', action='store_true',
+                        help="Export the Stream model's single-token step with past keys and values")
+    parser.add_argument('--output', type=str, default=None,
+                        help='Output directory (default: onnx/star_trek, or onnx/stream with --stream)')
+    parser.add_argument('--opset', type=int, default=17, help='ONNX opset version (default: 17)')
+    parser.add_argument('--skip-parity', action='store_true',
+                        help='Do not compare ONNX Runtime outputs against PyTorch after exporting')
+    parser.add_argument('--tolerance', type=float, default=1e-3,
+                        help='Maximum allowed absolute output difference in the parity check (default: 1e-3)')
+    args = parser.parse_args()
+
+    if args.stream:
+        model_path = args.model or STREAM_MODEL_PATHS["0.6B"]
+        output = args.output or 'onnx/stream'
+        model, tokenizer = export_stream_step(model_path, output, args.opset)
+        parity = check_stream_parity
+    else:
+        model_path = args.model or STAR_TREK_MODEL_PATH
+        output = args.output or 'onnx/star_trek'
+        model, tokenizer = export(model_path, output, args.opset)
+        parity = check_parity
+    print(f"✅ Exported to {output}")
+    if not args.skip_parity and not parity(model, tokenizer, output, args.tolerance):
+        print("❌ ONNX Runtime outputs do not match PyTorch", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,376 @@
+# train_domain_guard.py
+# Fine-tunes topic guards from per-domain JSON configs (see star_trek/star_trek_guard.json).
+# Several domains can be trained in one invocation: domains that share a base
+# model and label set reuse the loaded model and tokenizer, each training its
+# own LoRA adapter that is removed again once it has been saved.
+import argparse
+import json
+import os
+import shutil
+import sys
+import torch
+from datasets import Dataset, load_dataset
+from transformers import (
+    AutoTokenizer,
+    AutoModelForSequenceClassification,
+    TrainingArguments,
+    Trainer,
+    DataCollatorWithPadding,
+)
+from peft import LoraConfig, get_peft_model, TaskType
+
+# Shared helpers live in the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from early_exit import HEADS_FILENAME, train_early_exit_heads
+from sequence_packing import PackedCollator, PackedTrainer, compare_throughput, pack_examples
+from tokenization_cache import tokenize_cached
+
+# ===== CONFIG =====
+# Settings a domain config can override. Paths in a config are relative to the config file.
+DEFAULTS = {
+    "model": "Qwen/Qwen3-4B",
+    "labels": ["not_related", "related"],  # Label names in id order
+    "output_dir": None,  # None = <domain>_guard_finetuned next to the config
+    "eval_dataset": None,  # Held-out JSONL file; None = split test_size off the dataset
+    "test_size": 0.1,
+    "seed": 42,  # Seed of the train/test split, so the held-out questions are the same on every run
+    # Effective batch of 32 questions. 32 per step without accumulation needs far more GPU
+    # memory for a 4B model; with enough, raise batch_size and lower gradient_accumulation
+    "batch_size": 8,  # Batches are only padded to their longest question
+    "gradient_accumulation": 4,
+    "epochs": 3,
+    "learning_rate": 2e-4,
+    "max_length": None,  # None = derived from the dataset's token lengths (see max_length_percentile)
+    "max_length_percentile": 99.9,
+    "max_length_cap": 512,
+    "packing": False,  # Pack several questions into each training sequence (see sequence_packing.py)
+    "packed_length": 256,
+    "packed_batch_size": 4,
+    "lora": {
+        "r": 16,
+        "lora_alpha": 32,
+        "lora_dropout": 0.05,
+        "target_modules": ["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"],
+    },
+    "train_early_exit_heads": True,
+    "early_exit_layers": None,  # 0-based decoder layers to put heads on; None = after each quarter of the network
+    "tokenization_cache_dir": "tokenization_cache",
+    "clean_output_dir": False,
+    "test_inputs": [],  # Questions to print predictions for after training
+}
+CONFIG_FILENAME = "training_config.json"  # Resolved config, saved with the trained adapter
+
+
+def load_domain_config(path):
+    """Domain config merged over DEFAULTS, with paths resolved relative to the config file"""
+    with open(path) as f:
+        overrides = json.load(f)
+    for key in ("domain", "dataset"):
+        if key not in overrides:
+            raise ValueError(f"❌ {path} is missing '{key}'")
+    unknown = set(overrides) - set(DEFAULTS) - {"domain", "dataset"}
+    if unknown:
+        raise ValueError(f"❌ Unknown settings in {path}: {sorted(unknown)}")
+
+    config = {**DEFAULTS, **overrides, "lora": {**DEFAULTS["lora"], **overrides.get("lora", {})}}
+    base_dir = os.path.dirname(os.path.abspath(path))
+    config["output_dir"] = config["output_dir"] or f"{config['domain']}_guard_finetuned"
+    for key in ("dataset", "eval_dataset", "output_dir", "tokenization_cache_dir"):
+        if config[key] is not None:
+            config[key] = os.path.join(base_dir, config[key])
+    return config
+
+
+def load_labelled_dataset(path, label2id):
+    """JSONL dataset with its label column mapped to 'labels' ids"""
+    dataset = load_dataset("json", data_files=path)["train"]
+    print("📊 Dataset info:")
+    print(f"Total samples: {len(dataset)}")
+    print(f"Sample structure: {dataset[0] if len(dataset) > 0 else 'Empty'}")
+    print(f"Available columns: {dataset.column_names}")
+
+    # Auto-detect label column
+    possible_label_cols = ["label", "class", "category", "is_related"]
+    label_col = next((col for col in possible_label_cols if col in dataset.column_names), None)
+    if label_col is None:
+        raise ValueError(f"❌ Could not find label column. Available: {dataset.column_names}")
+
+    dataset = dataset.map(lambda x: {"labels": label2id[x[label_col]]})
+    print(f"✅ Using '{label_col}' as label column → mapped to 'labels'")
+    print(f"Label distribution: {dataset['labels'][:10]}...")
+    return dataset, label_col
+
+
+def load_base_model(config):
+    """Tokenizer and classification model for a config's base model and labels"""
+    label2id = {label: i for i, label in enumerate(config["labels"])}
+    tokenizer = AutoTokenizer.from_pretrained(config["model"], trust_remote_code=True)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    # Explicitly set BOS/EOS/PAD for Qwen
+    tokenizer.bos_token = tokenizer.eos_token
+    tokenizer.bos_token_id = tokenizer.eos_token_id
+    tokenizer.pad_token_id = tokenizer.eos_token_id
+
+    # Load the model in full precision (no 4-bit quantization)
+    model = AutoModelForSequenceClassification.from_pretrained(
+        config["model"],
+        num_labels=len(label2id),
+        id2label={i: label for label, i in label2id.items()},
+        label2id=label2id,
+        trust_remote_code=True,
+        dtype=torch.float16, # Use float16 for efficiency while keeping full precision
+        device_map="auto" # Use device_map for multi-GPU if available
+    )
+
+    # Align config
+    model.config.pad_token_id = tokenizer.pad_token_id
+    model.config.bos_token_id = tokenizer.bos_token_id
+    model.config.eos_token_id = tokenizer.eos_token_id
+    return tokenizer, model
+
+
+def train_domain(config, tokenizer, base_model):
+    """Train one domain's LoRA adapter on base_model and save it to the config's output_dir
+
+    Returns:
+        The trained PeftModel (base_model with the adapter applied)
+    """
+    domain = config["domain"]
+    output_dir = config["output_dir"]
+    label2id = {label: i for i, label in enumerate(config["labels"])}
+    id2label = {i: label for label, i in label2id.items()}
+    print(f"\n🎯 Training the {domain} guard")
+
+    # ===== CLEAN OUTPUT DIRECTORY =====
+    if config["clean_output_dir"] and os.path.exists(output_dir):
+        print(f"🧹 Cleaning output directory: {output_dir}")
+        shutil.rmtree(output_dir)
+    elif not os.path.exists(output_dir):
+        print(f"📁 Output directory does not exist, will be created: {output_dir}")
+
+    # ===== LOAD DATASET =====
+    dataset, label_col = load_labelled_dataset(config["dataset"], label2id)
+
+    # ===== LoRA CONFIG =====
+    lora_config = LoraConfig(
+        bias="none",
+        task_type=TaskType.SEQ_CLS,
+        **config["lora"],
+    )
+    model = get_peft_model(base_model, lora_config)
+    model.print_trainable_parameters()
+
+    # ===== TOKENIZE =====
+    # Cached under a fingerprint of the dataset file, tokenizer, max length and padding mode.
+    # No padding here: the collator pads each batch to its own longest question.
+    # 'input' is kept for the early-exit heads and dropped from the training splits below
+    tokenize_kwargs = {
+        "max_length_percentile": config["max_length_percentile"],
+        "max_length_cap": config["max_length_cap"],
+        "remove_columns": [label_col],
+        "label2id": label2id,
+    }
+    tokenized, tokenization, cache_hit = tokenize_cached(
+        dataset, config["dataset"], tokenizer, config["tokenization_cache_dir"],
+        max_length=config["max_length"], **tokenize_kwargs,
+    )
+    if cache_hit:
+        print(f"♻️  Tokenization cache hit: {tokenization['fingerprint']}, skipped tokenizing {len(tokenized)} questions")
+    else:
+        print(f"💾 Tokenized {len(tokenized)} questions, cached as {tokenization['fingerprint']}")
+    max_length = tokenization["max_length"]
+    token_lengths = tokenization["token_lengths"]
+    print(f"📏 Token lengths: median {token_lengths['median']}, p99 {token_lengths['p99']}, max {token_lengths['max']}")
+    print(f"✂️  MAX_LENGTH = {max_length} ({token_lengths['truncated']} questions truncated)")
+
+    if config["eval_dataset"]:
+        eval_raw, eval_label_col = load_labelled_dataset(config["eval_dataset"], label2id)
+        tokenized_eval, _, _ = tokenize_cached(
+            eval_raw, config["eval_dataset"], tokenizer, config["tokenization_cache_dir"],
+            max_length=max_length, **{**tokenize_kwargs, "remove_columns": [eval_label_col]},
+        )
+        dataset = {"train": tokenized, "test": tokenized_eval}
+    else:
+        dataset = tokenized.train_test_split(test_size=config["test_size"], seed=config["seed"])
+    print(f"Train: {len(dataset['train'])}, Test: {len(dataset['test'])}")
+    train_dataset = dataset["train"].remove_columns(["input"])
+    eval_dataset = dataset["test"].remove_columns(["input"])
+    train_questions = len(train_dataset)
+    data_collator = DataCollatorWithPadding(tokenizer, pad_to_multiple_of=8)
+
+    # ===== PACKING =====
+    packing = config["packing"]
+    if packing:
+        packed_collator = PackedCollator(tokenizer.pad_token_id, dtype=model.dtype)
+        print("\n⏱️  Comparing training throughput with and without packing...")
+        throughput = compare_throughput(
+            model,
+            train_dataset,
+            data_collator,
+            packed_collator,
+            config["batch_size"],
+            config["packed_length"],
+            config["packed_batch_size"],
+        )
+        for layout in ("unpacked", "packed"):
+            print(f"{layout}: {throughput[layout]['questions_per_second']:.1f} questions/s, "
+                  f"{throughput[layout]['padding_fraction']:.0%} padding")
+        print(f"Packing speedup: {throughput.get('speedup', float('nan')):.2f}x")
+
+        train_dataset = Dataset.from_dict(
+            pack_examples(list(train_dataset["input_ids"]), list(train_dataset["labels"]), config["packed_length"])
+        )
+        eval_dataset = Dataset.from_dict(
+            pack_examples(list(eval_dataset["input_ids"]), list(eval_dataset["labels"]), config["packed_length"])
+        )
+        print(f"📦 Packed {train_questions} training questions into {len(train_dataset)} sequences")
+
+    # ===== TRAINING ARGS =====
+    # Batch questions of similar length together so little padding is needed
+    # (transformers 5 replaced group_by_length with train_sampling_strategy)
+    if packing:
+        length_grouping = {}  # Packed sequences are all about the same length
+    elif "train_sampling_strategy" in TrainingArguments.__dataclass_fields__:
+        length_grouping = {"train_sampling_strategy": "group_by_length"}
+    else:
+        length_grouping = {"group_by_length": True}
+
+    batch_size = config["packed_batch_size"] if packing else config["batch_size"]
+    training_args = TrainingArguments(
+        output_dir=output_dir,
+        num_train_epochs=config["epochs"],
+        per_device_train_batch_size=batch_size,
+        per_device_eval_batch_size=batch_size * 2,
+        gradient_accumulation_steps=config["gradient_accumulation"],
+        learning_rate=config["learning_rate"],
+        logging_steps=10,
+        save_strategy="epoch",
+        eval_strategy="epoch",
+        load_best_model_at_end=True,
+        metric_for_best_model="eval_loss",
+        greater_is_better=False,
+        report_to="none",
+        optim="paged_adamw_32bit",
+        lr_scheduler_type="cosine",
+        warmup_ratio=0.1,
+        save_total_limit=2,
+        remove_unused_columns=False,  # Keep 'labels' column
+        dataloader_pin_memory=False,  # Avoid pin_memory warning
+        log_level="info",
+        logging_first_step=True,
+        ddp_find_unused_parameters=False,  # For multi-GPU compatibility
+        **length_grouping,
+    )
+
+    # ===== TRAINER =====
+    # PackedTrainer pools each packed question and computes its own loss
+    trainer = (PackedTrainer if packing else Trainer)(
+        model=model,
+        args=training_args,
+        train_dataset=train_dataset,
+        eval_dataset=eval_dataset,
+        data_collator=packed_collator if packing else data_collator,
+        processing_class=tokenizer,
+    )
+
+    # ===== TRAIN =====
+    print("🚀 Starting fine-tuning...")
+    train_result = trainer.train()
+    questions_per_second = train_questions * config["epochs"] / train_result.metrics["train_runtime"]
+    print(f"📈 Training throughput: {questions_per_second:.1f} questions/s ({'packed' if packing else 'unpacked'})")
+
+    # ===== SAVE =====
+    trainer.save_model(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, CONFIG_FILENAME), "w") as f:
+        json.dump({**config, "max_length": max_length, "tokenization": tokenization["fingerprint"]}, f, indent=2)
+    print(f"✅ Model saved to {output_dir}")
+
+    # ===== EARLY-EXIT HEADS =====
+    if config["train_early_exit_heads"]:
+        print("\n🏃 Training early-exit heads on intermediate layers...")
+        heads, head_accuracy = train_early_exit_heads(
+            model,
+            tokenizer,
+            list(dataset["train"]["input"]),
+            list(dataset["train"]["labels"]),
+            eval_texts=list(dataset["test"]["input"]),
+            eval_labels=list(dataset["test"]["labels"]),
+            layers=config["early_exit_layers"],
+            max_length=max_length,
+        )
+        heads.save(os.path.join(output_dir, HEADS_FILENAME), eval_accuracy=head_accuracy)
+        for layer, accuracy in head_accuracy.items():
+            print(f"Layer {layer}: eval accuracy {accuracy:.3f}")
+        print(f"✅ Early-exit heads saved to {os.path.join(output_dir, HEADS_FILENAME)}")
+
+    # ===== OPTIONAL: Test the fine-tuned model =====
+    # A quick look at a few questions; evaluate_guard.py reports the held-out metrics
+    if config["test_inputs"]:
+        print("\n🧪 Testing the fine-tuned model...")
+        model.eval()
+        with torch.no_grad():
+            for text in config["test_inputs"]:
+                inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=max_length)
+                inputs = {k: v.to(model.device) for k, v in inputs.items()}
+                logits = model(**inputs).logits
+
+                # Handle nan manually
+                if torch.isnan(logits).any():
+                    print(f"⚠️ NaN detected in logits for input: {text}")
+                    predicted_class_id = 0
+                    confidence = 0.0
+                else:
+                    probs = torch.nn.functional.softmax(logits, dim=-1)
+                    predicted_class_id = probs.argmax().item()
+                    confidence = probs.max().item()
+
+                print(f"Input: {text}")
+                print(f"Prediction: {id2label[predicted_class_id]} (confidence: {confidence:.3f})")
+                print("---")
+    print(f"📊 Held-out metrics and CPU latency: python evaluate_guard.py --model {output_dir}")
+    return model
+
+
+def train_domains(config_paths):
+    """Train every domain config in turn, loading each base model and tokenizer only once"""
+    configs = [load_domain_config(path) for path in config_paths]
+    # Domains sharing a base model and label set are trained back to back on one loaded model
+    configs.sort(key=lambda config: (config["model"], config["labels"]))
+
+    loaded_key, tokenizer, base_model = None, None, None
+    for config in configs:
+        key = (config["model"], config["labels"])
+        if key != loaded_key:
+            base_model = None
+            print(f"\n📥 Loading base model {config['model']}")
+            tokenizer, base_model = load_base_model(config)
+            loaded_key = key
+        else:
+            print(f"\n♻️  Reusing the loaded {config['model']} for {config['domain']}")
+
+        model = train_domain(config, tokenizer, base_model)
+        # Delete the adapter (LoRA layers and the trained copy of the head) before
+        # unwrapping, so the next domain wraps the untouched base model
+        model.delete_adapter("default")
+        base_model = model.unload()
+        del model
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fine-tune topic guards from domain configs",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python finetuning/train_domain_guard.py finetuning/star_trek/star_trek_guard.json
+  python finetuning/train_domain_guard.py finetuning/*/*_guard.json   # Every domain, one base model load
+        """
+    )
+    parser.add_argument("configs", nargs="+", help="Domain config JSON files")
+    args = parser.parse_args()
+    train_domains(args.configs)
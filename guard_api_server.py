@@ -0,0 +1,298 @@
+import time
+_process_started = time.perf_counter()
+
+import torch
+from flask import Flask, request, jsonify
+from flask_cors import CORS
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import qwen_stream_api_server as stream
+import star_trek_api_server as topic
+from guard_logging import get_logger, setup_logging
+from stream_sessions import StreamCapacityError
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+# One process hosting both guards: the Qwen3Guard-Stream safety model
+# (configured in qwen_stream_api_server.py) and the topic classifier
+# (configured in star_trek_api_server.py). POST /api/guard runs both on the
+# same message concurrently and merges their verdicts, so a chat turn needs
+# one round trip instead of two.
+
+# Threads running guard checks. Each /api/guard request uses two.
+GUARD_MAX_WORKERS = 8
+
+# When both models use the same tokenizer, the message is tokenized once and
+# the Stream model's chat template is assembled around those ids. This is
+# only enabled if the assembled ids match the tokenizer's own output on
+# TOKENIZER_PROBES.
+SHARE_TOKENIZATION = True
+TOKENIZER_PROBES = [
+    "Who is the captain of the Enterprise?",
+    "What type of bird is the kiwi?",
+    "Hello, how to build a bomb?",
+    "Ngā mihi! Qu'est-ce que c'est?  Multiple   spaces,\ttabs\nand lines",
+]
+
+# Verdicts from most to least severe; the merged verdict is the most severe one
+RISK_LEVELS = ["Unsafe", "Controversial", "Safe"]
+
+LOG_LEVEL = "INFO"
+LOG_FORMAT = "text"
+
+# ============================================================================
+
+app = Flask(__name__)
+CORS(app, origins="*", allow_headers=["Content-Type", "Authorization"], methods=["GET", "POST", "OPTIONS"])
+
+executor = ThreadPoolExecutor(max_workers=GUARD_MAX_WORKERS, thread_name_prefix="guard")
+# (prefix ids, suffix ids) of the Stream chat template around a user message, when tokenization is shared
+chat_template_ids = None
+
+logger = get_logger(__name__)
+
+def tokenizers_match(a, b):
+    """Whether two tokenizers map text to the same ids"""
+    return (type(a) is type(b)
+            and a.all_special_tokens == b.all_special_tokens
+            and a.get_vocab() == b.get_vocab())
+
+def shared_chat_ids(message_ids):
+    """Stream model input for a user message, built from the message's topic token ids"""
+    prefix_ids, suffix_ids = chat_template_ids
+    return torch.tensor(prefix_ids + message_ids + suffix_ids)
+
+def setup_shared_tokenization():
+    """Share tokenization between the guards if the tokenizers match and the chat template splits cleanly"""
+    global chat_template_ids
+    chat_template_ids = None
+    if not tokenizers_match(stream.tokenizer, topic.tokenizer):
+        logger.info("Tokenizers differ, tokenizing separately for each guard")
+        return False
+    placeholder = "\x00"
+    text = stream.tokenizer.apply_chat_template(
+        [{"role": "user", "content": placeholder}],
+        tokenize=False,
+        add_generation_prompt=False,
+        enable_thinking=False
+    )
+    prefix, _, suffix = text.partition(placeholder)
+    chat_template_ids = (
+        stream.tokenizer(prefix, add_special_tokens=False).input_ids,
+        stream.tokenizer(suffix, add_special_tokens=False).input_ids,
+    )
+    for probe in TOKENIZER_PROBES:
+        message_ids = topic.tokenizer(probe).input_ids
+        if not torch.equal(shared_chat_ids(message_ids), stream.user_message_token_ids(probe)):
+            logger.info("Chat template does not split on token boundaries, tokenizing separately", probe=probe)
+            chat_template_ids = None
+            return False
+    logger.info("Sharing tokenization between the safety and topic guards")
+    return True
+
+def safety_check(message, message_ids=None):
+    """Qwen3Guard-Stream verdict on a user message"""
+    started = time.perf_counter()
+    if message_ids is not None:
+        token_ids = shared_chat_ids(message_ids)
+    else:
+        token_ids = stream.user_message_token_ids(message)
+    risk_level, category = stream.moderate_user_message(token_ids)
+    return {
+        'risk_level': risk_level,
+        'category': category,
+        'latency_ms': (time.perf_counter() - started) * 1000
+    }
+
+def topic_check(message, domain, message_ids=None):
+    """Topic classifier verdict on a message, using the server's tiers when any are enabled"""
+    started = time.perf_counter()
+    tiers = topic.neighbour_indexes or topic.distilled_classifiers or topic.escalation_model is not None
+    if message_ids is None or tiers:
+        response = topic.classify_messages([message], [domain])[0][0]
+    else:
+        input_ids = torch.tensor([message_ids[:topic.MAX_LENGTH]], device=topic.model.device)
+        inputs = {'input_ids': input_ids, 'attention_mask': torch.ones_like(input_ids)}
+        with torch.no_grad():
+            logits, exit_layer = topic.run_classifier(inputs, [domain])
+        response = topic.build_moderation_response(message, logits[0], domain)
+        if exit_layer is not None:
+            response['exit_layer'] = exit_layer
+    response.pop('message', None)
+    response['latency_ms'] = (time.perf_counter() - started) * 1000
+    return response
+
+def severity(risk_level):
+    """Rank of a risk level, 0 being the most severe (unknown levels count as most severe)"""
+    return RISK_LEVELS.index(risk_level) if risk_level in RISK_LEVELS else 0
+
+def merge_verdicts(safety, topic_verdict):
+    """Combine the two verdicts: the most severe one wins, the safety guard's on ties
+    
+    Returns:
+        (risk_level, category, names of the guards that did not return Safe)
+    """
+    verdicts = {'safety': safety, 'topic': topic_verdict}
+    flagged_by = [name for name, verdict in verdicts.items() if verdict['risk_level'] != 'Safe']
+    worst = min(verdicts.values(), key=lambda verdict: severity(verdict['risk_level']))
+    return worst['risk_level'], worst['category'] if flagged_by else None, flagged_by
+
+@app.route('/api/guard', methods=['POST', 'OPTIONS'])
+def guard():
+    """Run the safety and topic guards on one message concurrently and merge their verdicts"""
+    if request.method == 'OPTIONS':
+        return jsonify({}), 200
+
+    try:
+        started = time.perf_counter()
+        data = request.json or {}
+        message = data.get('message', '').strip()
+        domain = data.get('domain') or topic.DEFAULT_DOMAIN
+        if domain not in topic.served_domains():
+            return topic.unknown_domain_response(domain)
+
+        if not message:
+            return jsonify({
+                'risk_level': 'Safe',
+                'category': None,
+                'message': '',
+                'flagged_by': []
+            }), 200
+
+        message_ids = topic.tokenizer(message).input_ids if chat_template_ids is not None else None
+        safety_future = executor.submit(safety_check, message, message_ids)
+        topic_future = executor.submit(topic_check, message, domain, message_ids)
+        try:
+            safety = safety_future.result()
+        except StopIteration:
+            # The topic verdict is not needed any more, but a failure of its own
+            # must not turn the parse error into a 500
+            if not topic_future.cancel():
+                try:
+                    topic_future.result()
+                except Exception:
+                    logger.exception("Topic check failed for an unparseable message")
+            return jsonify({'error': 'Failed to parse user message'}), 400
+        topic_verdict = topic_future.result()
+
+        risk_level, category, flagged_by = merge_verdicts(safety, topic_verdict)
+        return jsonify({
+            'risk_level': risk_level,
+            'category': category,
+            'message': message,
+            'flagged_by': flagged_by,
+            'safety': safety,
+            'topic': topic_verdict,
+            'shared_tokenization': message_ids is not None,
+            'latency_ms': (time.perf_counter() - started) * 1000
+        })
+
+    except StreamCapacityError as e:
+        return stream.stream_capacity_response(e)
+    except Exception as e:
+        logger.exception("Error in guard endpoint")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/health', methods=['GET'])
+def health():
+    """Health check endpoint"""
+    return jsonify({
+        'status': 'healthy',
+        'safety_model': stream.MODEL_PATH if stream.model is not None else None,
+        'topic_model': topic.MODEL_PATH if topic.model is not None else None,
+        'topic_backend': topic.model_backend,
+        'domains': topic.served_domains(),
+        'shared_tokenization': chat_template_ids is not None,
+        'streams': stream.stream_registry.stats()
+    })
+
+@app.route('/', methods=['GET'])
+def index():
+    """API information endpoint"""
+    return jsonify({
+        'name': 'Qwen3Guard Combined Guard API Server',
+        'version': '1.0',
+        'endpoints': {
+            '/api/guard': 'POST - Safety moderation and topic classification of one message',
+            '/health': 'GET - Health check'
+        },
+        'safety_model': stream.MODEL_PATH,
+        'topic_model': topic.MODEL_PATH
+    })
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Qwen3Guard combined safety and topic guard API Server',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python guard_api_server.py                          # Both guards on port 5000
+  python guard_api_server.py --topic-backend onnxruntime  # Topic classifier on ONNX Runtime
+  python guard_api_server.py --offline                # Only load models from the local cache
+        """
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=5000,
+        help='Port to run the server on (default: 5000)'
+    )
+    parser.add_argument(
+        '--host',
+        type=str,
+        default='0.0.0.0',
+        help='Host to bind the server to (default: 0.0.0.0)'
+    )
+    parser.add_argument(
+        '--topic-backend',
+        choices=['torch', 'onnxruntime'],
+        default=topic.BACKEND,
+        help=f'Topic classifier inference backend (default: {topic.BACKEND})'
+    )
+    parser.add_argument(
+        '--offline',
+        action='store_true',
+        help='Only load models from the local cache; fail instead of downloading'
+    )
+    parser.add_argument(
+        '--no-shared-tokenization',
+        action='store_true',
+        help='Always tokenize the message separately for each guard'
+    )
+    parser.add_argument(
+        '--log-level',
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+        default=LOG_LEVEL,
+        help=f'Minimum log level (default: {LOG_LEVEL})'
+    )
+    parser.add_argument(
+        '--log-format',
+        choices=['text', 'json'],
+        default=LOG_FORMAT,
+        help=f'Log output format (default: {LOG_FORMAT})'
+    )
+
+    args = parser.parse_args()
+
+    setup_logging(args.log_level, args.log_format)
+    logger.info("Initializing Qwen3Guard combined guard API Server",
+                safety_model=stream.MODEL_PATH, topic_model=topic.MODEL_PATH)
+    if args.offline:
+        stream.OFFLINE = topic.OFFLINE = True
+    stream.load_model()
+    topic.load_model(backend=args.topic_backend)
+    if topic.STARTUP_WARMUP:
+        with topic.startup_timer.phase("warmup"):
+            topic.warmup_model()
+    # The module timers started when each server module was imported, so their
+    # "imports" phases overlap; the guard server's total covers everything
+    stream.startup_timer.report(model=stream.MODEL_PATH)
+    topic.startup_timer.report(model=topic.MODEL_PATH, backend=topic.model_backend)
+    logger.info("Startup complete", total_s=round(time.perf_counter() - _process_started, 3))
+    if SHARE_TOKENIZATION and not args.no_shared_tokenization:
+        setup_shared_tokenization()
+    logger.info("Starting server", url=f"http://{args.host}:{args.port}")
+    logger.info("API endpoints: POST /api/guard, GET /health")
+    app.run(host=args.host, port=args.port, debug=False)
@@ -0,0 +1,65 @@
+"""
+Reading the labelled fine-tuning datasets.
+
+Shared by the training, evaluation and index-building scripts, which all read
+the same JSONL files, fingerprint them by their SHA-256 and hold out the same
+rows for evaluation.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+LABEL2ID = {"not_related": 0, "related": 1}
+TRAINING_CONFIG_FILENAME = "training_config.json"  # Written by finetuning/train_domain_guard.py
+
+
+def read_dataset(path):
+    """Read (texts, label ids) from a fine-tuning JSONL file"""
+    texts = []
+    labels = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            texts.append(record["input"])
+            labels.append(LABEL2ID[record["label"]])
+    return texts, np.asarray(labels, dtype=np.int8)
+
+
+def split_rows(num_rows, test_size, seed):
+    """(train rows, held-out rows), the split datasets' train_test_split(test_size=test_size, seed=seed) makes
+
+    finetuning/train_domain_guard.py splits with train_test_split, so scripts that
+    use this helper with the trainer's test size and seed hold out the same rows.
+    """
+    order = np.random.default_rng(seed).permutation(num_rows)
+    num_held_out = int(np.ceil(test_size * num_rows))
+    return order[num_held_out:], order[:num_held_out]
+
+
+def held_out_split(dataset_path, test_size, seed):
+    """Held-out (texts, label ids) of a fine-tuning JSONL file, as split by split_rows"""
+    texts, labels = read_dataset(dataset_path)
+    _, held_out = split_rows(len(texts), test_size, seed)
+    return [texts[i] for i in held_out], labels[held_out]
+
+
+def read_training_config(model_path):
+    """The training_config.json saved next to a fine-tuned model, or {} if there is none"""
+    path = os.path.join(model_path, TRAINING_CONFIG_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,37 @@
+"""
+Scoring helpers shared by the evaluation, calibration and benchmark scripts.
+
+`predict` runs a topic classifier over held-out texts (see
+`guard_datasets.held_out_split`) and `percentile` summarises latency samples,
+so every script reports probabilities and latencies the same way.
+"""
+
+from guard_models import STAR_TREK_ID2LABEL
+
+
+def predict(classifier_tokenizer, classifier, texts):
+    """Return a (len(texts), num_labels) array of probabilities (all zero where the logits are NaN)"""
+    # Imported here so that benchmark_api_servers.py, which only needs percentile,
+    # keeps running from the standard library alone
+    import numpy as np
+    import torch
+
+    import star_trek_api_server as server
+
+    probabilities = np.zeros((len(texts), len(STAR_TREK_ID2LABEL)), dtype=np.float32)
+    with torch.no_grad():
+        for bucket, inputs in server.padded_buckets(classifier_tokenizer, texts, classifier.device):
+            logits = classifier(**inputs).logits.float()
+            probabilities[bucket] = np.nan_to_num(torch.softmax(logits, dim=-1).cpu().numpy())
+    return probabilities
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
@@ -0,0 +1,227 @@
+"""
+Structured, sampled, non-blocking logging for the API servers.
+
+Built on the standard `logging` module:
+
+- Request threads only put records on a bounded queue (`QueueHandler`); a
+  `QueueListener` thread formats and writes them. If the queue is full the
+  record is dropped and counted rather than blocking the request.
+- Every record is an event name plus key/value fields, rendered as
+  `key=value` text or one JSON object per line.
+- `logger.for_request()` decides once per request whether its DEBUG/INFO
+  records are kept (`LOG_SAMPLE_RATE`). Warnings and errors are always kept.
+- Field values wrapped in `lazy(...)` are only computed by the listener
+  thread, and only for records that are actually emitted, so expensive debug
+  fields (tensor conversions, large dicts) cost nothing when dropped. Lazy
+  callables should only capture values that are not modified afterwards.
+
+Call `setup_logging()` once at startup. Without it, records propagate to the
+standard library's default handling (warnings and errors on stderr).
+"""
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import uuid
+
+ROOT_LOGGER = "guard"
+LOG_FORMATS = ("text", "json")
+DEFAULT_QUEUE_SIZE = 10000
+# Default for for_request(); set by setup_logging()
+LOG_SAMPLE_RATE = 1.0
+
+_listener = None
+_handler = None
+
+
+class lazy:
+    """A field value computed only when the record is formatted"""
+
+    __slots__ = ("fn",)
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def resolve(self):
+        try:
+            return self.fn()
+        except Exception as e:
+            return f"<error computing field: {e}>"
+
+
+def _resolve_fields(record):
+    fields = getattr(record, "fields", None) or {}
+    return {key: value.resolve() if isinstance(value, lazy) else value for key, value in fields.items()}
+
+
+class StructuredFormatter(logging.Formatter):
+    """Render a record's event and fields as key=value text or a JSON line"""
+
+    def __init__(self, fmt="text"):
+        super().__init__()
+        if fmt not in LOG_FORMATS:
+            raise ValueError(f"Unknown log format {fmt!r}, expected one of {LOG_FORMATS}")
+        self.fmt = fmt
+
+    def format(self, record):
+        fields = _resolve_fields(record)
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = self.formatException(record.exc_info)
+        if self.fmt == "json":
+            entry = {
+                "ts": self.formatTime(record),
+                "level": record.levelname,
+                "logger": record.name,
+                "event": record.getMessage(),
+                **fields,
+            }
+            if exc_text:
+                entry["exception"] = exc_text
+            return json.dumps(entry, default=str)
+        line = f"{self.formatTime(record)} {record.levelname} {record.name}: {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{key}={value!r}" if isinstance(value, str) else f"{key}={value}"
+                                   for key, value in fields.items())
+        if exc_text:
+            line += "\n" + exc_text
+        return line
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Merge args and render the traceback on the calling thread (the
+        # traceback frames may not outlive it), but leave lazy fields alone
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class StructuredLogger:
+    """Logger taking an event name plus keyword fields
+
+    Args:
+        logger: Underlying logging.Logger
+        fields: Fields added to every record
+        sampled: If False, records below WARNING are dropped before any work is done
+    """
+
+    def __init__(self, logger, fields=None, sampled=True):
+        self.logger = logger
+        self.fields = fields or {}
+        self.sampled = sampled
+
+    def bind(self, **fields):
+        """Return a logger that adds these fields to every record"""
+        return StructuredLogger(self.logger, {**self.fields, **fields}, self.sampled)
+
+    def for_request(self, sample_rate=None, **fields):
+        """Return a logger for one request, with a request id and a sampling decision"""
+        rate = LOG_SAMPLE_RATE if sample_rate is None else sample_rate
+        sampled = rate >= 1 or random.random() < rate
+        return StructuredLogger(
+            self.logger,
+            {**self.fields, "request_id": uuid.uuid4().hex[:12], **fields},
+            self.sampled and sampled,
+        )
+
+    def is_enabled_for(self, level):
+        if level < logging.WARNING and not self.sampled:
+            return False
+        return self.logger.isEnabledFor(level)
+
+    def log(self, level, event, exc_info=False, **fields):
+        if not self.is_enabled_for(level):
+            return
+        self.logger.log(level, event, exc_info=exc_info, extra={"fields": {**self.fields, **fields}}, stacklevel=3)
+
+    def debug(self, event, **fields):
+        self.log(logging.DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(logging.WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(logging.ERROR, event, **fields)
+
+    def exception(self, event, **fields):
+        """Log an ERROR record with the traceback of the exception being handled"""
+        self.log(logging.ERROR, event, exc_info=True, **fields)
+
+
+def get_logger(name):
+    """Return a StructuredLogger under the shared "guard" logger hierarchy"""
+    if name == "__main__":
+        name = sys.argv[0].rsplit("/", 1)[-1].removesuffix(".py") or name
+    return StructuredLogger(logging.getLogger(f"{ROOT_LOGGER}.{name}"))
+
+
+def setup_logging(level="INFO", fmt="text", sample_rate=1.0, stream=None, queue_size=DEFAULT_QUEUE_SIZE):
+    """Route all guard loggers through a non-blocking queue to a background writer
+
+    Args:
+        level: Minimum level name or number ("DEBUG", "INFO", ...)
+        fmt: "text" or "json"
+        sample_rate: Fraction of requests whose DEBUG/INFO records are kept
+        stream: Output stream (default: stderr)
+        queue_size: Maximum records waiting to be written before new ones are dropped
+    """
+    global _listener, _handler, LOG_SAMPLE_RATE
+    shutdown_logging()
+    LOG_SAMPLE_RATE = sample_rate
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(StructuredFormatter(fmt))
+    log_queue = queue.Queue(maxsize=queue_size)
+    _handler = NonBlockingQueueHandler(log_queue)
+    _listener = logging.handlers.QueueListener(log_queue, output)
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    root.addHandler(_handler)
+    root.propagate = False
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """Flush queued records and detach the queue handler"""
+    global _listener, _handler
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _handler is not None:
+        logging.getLogger(ROOT_LOGGER).removeHandler(_handler)
+        _handler = None
+
+
+def dropped_records():
+    """Number of records dropped because the queue was full"""
+    return _handler.dropped if _handler is not None else 0
+
+
+atexit.register(shutdown_logging)
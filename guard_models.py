@@ -0,0 +1,18 @@
+"""
+Model ids and label names shared by the servers and the offline tools.
+
+Kept apart from the Flask servers so that scripts such as `export_onnx.py`
+can use them without importing (and configuring) a whole server.
+"""
+
+# Topic classifier served by star_trek_api_server.py
+STAR_TREK_MODEL_PATH = "geoffmunn/Qwen3Guard-StarTrek-Classification-0.6B"
+STAR_TREK_MAX_LENGTH = 512
+STAR_TREK_ID2LABEL = {0: "not_related", 1: "related"}
+
+# Safety models served by qwen_stream_api_server.py, by size
+STREAM_MODEL_PATHS = {
+    "0.6B": "Qwen/Qwen3Guard-Stream-0.6B",
+    "4B": "Qwen/Qwen3Guard-Stream-4B",
+    "8B": "Qwen/Qwen3Guard-Stream-8B"
+}
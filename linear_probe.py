@@ -0,0 +1,187 @@
+"""
+Linear-probe training on a frozen base model for the topic guards.
+
+Runs the base Qwen3 model once over a labelled dataset and caches each
+question's pooled hidden state in a memory-mapped NumPy file. The pooled
+state is the final-norm output at the question's last token, which is what
+the sequence classification head sees. A bias-free linear head with the shape
+of the model's `score` layer is then trained on the cached features, on CPU,
+in seconds. Later runs with the same model and dataset reuse the cache.
+`star_trek_api_server.py --probe DIR` serves the base model with the probe
+as its classification head, so a new domain can be tried without a GPU
+fine-tuning run.
+
+Examples:
+  python linear_probe.py train --dataset finetuning/new_zealand/new_zealand_guard_dataset.jsonl \\
+      --domain new_zealand --output probes/new_zealand
+  python star_trek_api_server.py --probe probes/new_zealand
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import torch
+
+from early_exit import pool_last_token
+from guard_datasets import file_sha256, read_dataset, split_rows
+
+WEIGHTS_FILENAME = "linear_probe.npz"
+METADATA_FILENAME = "linear_probe.json"
+FEATURES_FILENAME = "features.npy"
+LABELS_FILENAME = "labels.npy"
+CACHE_METADATA = "features.json"
+DEFAULT_BASE_MODEL = "Qwen/Qwen3-0.6B"
+
+
+class LinearProbe:
+    """Bias-free linear classification head over pooled hidden states (same layout as the model's score.weight)"""
+
+    def __init__(self, weight, metadata=None):
+        self.weight = weight
+        self.metadata = metadata or {}
+
+    def predict_proba(self, features):
+        logits = np.asarray(features, dtype=np.float32) @ self.weight.T
+        logits -= logits.max(axis=-1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=-1, keepdims=True)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.savez(os.path.join(directory, WEIGHTS_FILENAME), weight=self.weight)
+        with open(os.path.join(directory, METADATA_FILENAME), "w") as f:
+            json.dump(self.metadata, f, indent=2)
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, METADATA_FILENAME)) as f:
+            metadata = json.load(f)
+        return cls(np.load(os.path.join(directory, WEIGHTS_FILENAME))["weight"], metadata)
+
+
+def cache_features(model_path, dataset_path, cache_dir):
+    """Pooled hidden states of every question, memory-mapped from cache_dir (extracted on the first run)
+
+    Returns:
+        ((n, hidden_size) float32 memmap, (n,) label ids)
+    """
+    import star_trek_api_server as server
+    texts, labels = read_dataset(dataset_path)
+    key = {
+        "model": model_path,
+        "dataset": os.path.basename(dataset_path),
+        "dataset_sha256": file_sha256(dataset_path),
+        "max_length": server.MAX_LENGTH,
+        "pooling": "last_token",
+    }
+    features_path = os.path.join(cache_dir, FEATURES_FILENAME)
+    metadata_path = os.path.join(cache_dir, CACHE_METADATA)
+    if os.path.exists(metadata_path):
+        with open(metadata_path) as f:
+            if json.load(f) == key:
+                print(f"♻️  Reusing cached features from {cache_dir}", file=sys.stderr)
+                return np.load(features_path, mmap_mode="r"), np.load(os.path.join(cache_dir, LABELS_FILENAME))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # The metadata marks a complete cache, so drop it until the new features are written
+    if os.path.exists(metadata_path):
+        os.remove(metadata_path)
+    classifier_tokenizer, classifier = server.load_sequence_classifier(model_path)
+    backbone = getattr(classifier, classifier.base_model_prefix)
+    features = np.lib.format.open_memmap(features_path, mode="w+", dtype=np.float32,
+                                         shape=(len(texts), classifier.config.hidden_size))
+    done = 0
+    with torch.no_grad():
+        for bucket, inputs in server.padded_buckets(classifier_tokenizer, texts, classifier.device):
+            hidden = backbone(**inputs).last_hidden_state
+            features[bucket] = pool_last_token(hidden, inputs["attention_mask"]).float().cpu().numpy()
+            done += len(bucket)
+            print(f"Features: {done}/{len(texts)}", file=sys.stderr)
+    features.flush()
+    np.save(os.path.join(cache_dir, LABELS_FILENAME), labels)
+    with open(metadata_path, "w") as f:
+        json.dump(key, f, indent=2)
+    return np.load(features_path, mmap_mode="r"), labels
+
+
+def fit_probe(features, labels, num_labels, max_iter=200, l2=1e-4):
+    """Bias-free softmax regression, trained full-batch with L-BFGS
+
+    Returns:
+        (num_labels, dim) float32 weight
+    """
+    x = torch.from_numpy(np.asarray(features, dtype=np.float32))
+    y = torch.from_numpy(np.asarray(labels, dtype=np.int64))
+    weight = torch.zeros((num_labels, x.shape[1]), requires_grad=True)
+    optimizer = torch.optim.LBFGS([weight], max_iter=max_iter, line_search_fn="strong_wolfe")
+
+    def closure():
+        optimizer.zero_grad()
+        loss = torch.nn.functional.cross_entropy(x @ weight.T, y) + l2 * weight.pow(2).sum()
+        loss.backward()
+        return loss
+
+    optimizer.step(closure)
+    return weight.detach().numpy()
+
+
+def train(args):
+    cache_dir = args.cache_dir or os.path.join(args.output, "features")
+    features, labels = cache_features(args.model, args.dataset, cache_dir)
+    num_labels = int(labels.max()) + 1
+
+    train_rows, held_out = (np.sort(rows) for rows in split_rows(len(labels), args.test_size, args.seed))
+
+    weight = fit_probe(features[train_rows], labels[train_rows], num_labels, max_iter=args.max_iter, l2=args.l2)
+    probe = LinearProbe(weight)
+    report = {
+        "held_out": len(held_out),
+        "train_accuracy": float((probe.predict_proba(features[train_rows]).argmax(1) == labels[train_rows]).mean()),
+        "held_out_accuracy": float((probe.predict_proba(features[held_out]).argmax(1) == labels[held_out]).mean())
+        if len(held_out) else None,
+    }
+    probe.metadata = {
+        "model": args.model,
+        "domain": args.domain,
+        "display_name": args.display_name or args.domain.replace("_", " ").title(),
+        "dataset": os.path.basename(args.dataset),
+        "num_labels": num_labels,
+        "hidden_size": int(weight.shape[1]),
+        "evaluation": report,
+    }
+    probe.save(args.output)
+    print(f"✅ Linear probe saved to {args.output}", file=sys.stderr)
+    print(json.dumps(report, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Train a linear classification head on a frozen base model',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    train_parser = subparsers.add_parser('train', help='Cache features and train a probe on a labelled dataset')
+    train_parser.add_argument('--dataset', required=True, help='Fine-tuning JSONL file ({"input", "label"} lines)')
+    train_parser.add_argument('--domain', required=True, help='Domain name the probe is served under')
+    train_parser.add_argument('--output', required=True, help='Directory to write the probe to')
+    train_parser.add_argument('--display-name', type=str, default=None,
+                              help='Name used in verdict categories (default: from --domain)')
+    train_parser.add_argument('--model', type=str, default=DEFAULT_BASE_MODEL,
+                              help=f'Frozen base model (default: {DEFAULT_BASE_MODEL})')
+    train_parser.add_argument('--cache-dir', type=str, default=None,
+                              help='Feature cache directory (default: OUTPUT/features)')
+    train_parser.add_argument('--max-iter', type=int, default=200, help='L-BFGS iterations (default: 200)')
+    train_parser.add_argument('--l2', type=float, default=1e-4, help='L2 penalty on the weights (default: 1e-4)')
+    train_parser.add_argument('--test-size', type=float, default=0.1, help='Held-out fraction (default: 0.1)')
+    train_parser.add_argument('--seed', type=int, default=42, help='Split seed (default: 42)')
+    args = parser.parse_args()
+
+    if args.command == 'train':
+        train(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Fast, offline-first model loading for the API servers.
+
+`from_pretrained` with a Hub id checks the Hub for updates on every start,
+and autoscaled workers pay for that round trip on each cold start.
+`resolve_snapshot` turns a Hub id into the local snapshot directory in the
+Hugging Face cache without any network request. The snapshot is pinned to a
+revision when one is given, and is only downloaded when it is not cached
+(unless offline). `resolve_file` does the same for a single file outside the
+snapshot patterns. `fast_load_kwargs` make `from_pretrained` memory-map the
+safetensors weights instead of building a randomly initialised model and
+copying the checkpoint into it, which keeps peak RSS close to the model size.
+Repos that only ship PyTorch `.bin` weights still load, from the `.bin` files
+and without the memory-mapping.
+`StartupTimer` logs how long each startup phase took.
+"""
+
+import contextlib
+import os
+import time
+
+from guard_logging import get_logger
+
+# Everything from_pretrained needs (config, tokenizer, safetensors weights and
+# remote code), without the duplicate .bin/.gguf weights some repos also ship
+SNAPSHOT_PATTERNS = ["*.json", "*.safetensors", "*.py", "*.txt", "*.model", "*.tiktoken", "*.jinja"]
+# Fetched instead when a repo has no safetensors weights at all
+BIN_SNAPSHOT_PATTERNS = [pattern for pattern in SNAPSHOT_PATTERNS if pattern != "*.safetensors"] + ["*.bin"]
+
+FAST_LOAD_KWARGS = {"use_safetensors": True, "low_cpu_mem_usage": True}
+
+logger = get_logger(__name__)
+
+
+def resolve_snapshot(model_path, revision=None, offline=False, force_download=False):
+    """Return a local directory holding the model, downloading only if it is not cached
+
+    Args:
+        model_path: Local directory or Hugging Face Hub repo id
+        revision: Commit hash (or branch/tag) to pin to; None uses the cached "main"
+        offline: Raise instead of downloading a snapshot that is not cached
+        force_download: Download the snapshot again even if it is cached
+    """
+    if os.path.isdir(model_path):
+        return model_path
+    model_dir = _download_snapshot(model_path, revision, SNAPSHOT_PATTERNS, offline, force_download)
+    if not has_safetensors(model_dir):
+        logger.warning("Model has no safetensors weights, using .bin", model=model_path, revision=revision)
+        model_dir = _download_snapshot(model_path, revision, BIN_SNAPSHOT_PATTERNS, offline, force_download)
+    return model_dir
+
+
+def _download_snapshot(model_path, revision, patterns, offline, force_download):
+    from huggingface_hub import snapshot_download
+    from huggingface_hub.utils import LocalEntryNotFoundError
+
+    if not force_download:
+        try:
+            model_dir = snapshot_download(model_path, revision=revision, allow_patterns=patterns,
+                                          local_files_only=True)
+        except LocalEntryNotFoundError:
+            if offline:
+                raise
+            model_dir = None
+        # The cached snapshot directory exists once any file of it is cached, so
+        # for the .bin fallback also check that the .bin weights are there
+        if model_dir is not None and (patterns is SNAPSHOT_PATTERNS or _has_weights(model_dir, ".bin")):
+            return model_dir
+        if offline:
+            raise FileNotFoundError(f"No cached .bin weights for {model_path} and OFFLINE is set")
+        logger.warning("Model snapshot not cached, downloading", model=model_path, revision=revision)
+    return snapshot_download(model_path, revision=revision, allow_patterns=patterns,
+                             force_download=force_download)
+
+
+def _has_weights(model_dir, extension):
+    return any(name.endswith(extension) for name in os.listdir(model_dir))
+
+
+def has_safetensors(model_dir):
+    """Whether a model directory holds safetensors weights (full model or adapter)"""
+    return _has_weights(model_dir, ".safetensors")
+
+
+def fast_load_kwargs(model_dir):
+    """from_pretrained arguments for a model directory: FAST_LOAD_KWARGS, minus use_safetensors for .bin-only models"""
+    if has_safetensors(model_dir):
+        return dict(FAST_LOAD_KWARGS)
+    return {key: value for key, value in FAST_LOAD_KWARGS.items() if key != "use_safetensors"}
+
+
+def resolve_file(model_path, filename, revision=None, offline=False):
+    """Return a local path to one file of a model, downloading only if it is not cached
+
+    For files that are not part of the snapshot (e.g. early-exit heads). Arguments
+    are as for resolve_snapshot.
+    """
+    if os.path.isdir(model_path):
+        return os.path.join(model_path, filename)
+    from huggingface_hub import hf_hub_download
+    from huggingface_hub.utils import LocalEntryNotFoundError
+
+    try:
+        return hf_hub_download(model_path, filename, revision=revision, local_files_only=True)
+    except LocalEntryNotFoundError:
+        if offline:
+            raise
+        logger.warning("Model file not cached, downloading", model=model_path, file=filename, revision=revision)
+    return hf_hub_download(model_path, filename, revision=revision)
+
+
+class StartupTimer:
+    """Wall-clock time of each startup phase, reported as one log record
+
+    Args:
+        started: perf_counter() value when the process started importing
+    """
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.phases = {}
+
+    def record(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Add the time spent in the block to a phase (repeated phases add up)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def report(self, **fields):
+        """Log and return the seconds spent in each phase plus the total so far"""
+        timings = {f"{name}_s": round(seconds, 3) for name, seconds in self.phases.items()}
+        timings["total_s"] = round(time.perf_counter() - self.started, 3)
+        logger.info("Startup timing", **timings, **fields)
+        return timings
@@ -0,0 +1,199 @@
+"""
+Nearest-neighbour fast path for the topic classifiers.
+
+Most questions sent to the topic classifier are close paraphrases of
+questions in the labelled fine-tuning datasets. This module embeds a dataset
+once into an on-disk index. `star_trek_api_server.py` can then answer a
+query straight from its closest labelled neighbour when the two are similar
+enough, and only run the transformer for the rest.
+
+Embeddings are hashed bag-of-n-grams vectors (word uni/bigrams plus character
+n-grams), L2-normalised so a dot product is the cosine similarity. They need
+no model, cost microseconds per query, and are good at exactly the thing the
+fast path is for: spotting rewordings of a known question. Search is exact
+(one matrix product), which is fast enough for indexes of this size.
+
+Examples:
+  python neighbour_index.py build --dataset finetuning/star_trek/star_trek_guard_dataset.jsonl --output indexes/star_trek
+  python neighbour_index.py evaluate --index indexes/star_trek --dataset finetuning/star_trek/star_trek_guard_dataset.jsonl
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import zlib
+
+import numpy as np
+
+from guard_datasets import file_sha256, read_dataset
+
+INDEX_METADATA = "index.json"
+VECTORS_FILENAME = "vectors.npy"
+LABELS_FILENAME = "labels.npy"
+TEXTS_FILENAME = "texts.json"
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class HashedNgramEmbedder:
+    """Map text to a fixed-size, L2-normalised vector of hashed n-gram counts
+
+    Args:
+        dim: Number of hash buckets
+        word_ngrams: (min, max) word n-gram sizes
+        char_ngrams: (min, max) character n-gram sizes, taken within words
+    """
+
+    def __init__(self, dim=1024, word_ngrams=(1, 2), char_ngrams=(3, 5)):
+        self.dim = dim
+        self.word_ngrams = tuple(word_ngrams)
+        self.char_ngrams = tuple(char_ngrams)
+
+    def config(self):
+        return {"dim": self.dim, "word_ngrams": list(self.word_ngrams), "char_ngrams": list(self.char_ngrams)}
+
+    @staticmethod
+    def normalize(text):
+        return _WHITESPACE.sub(" ", _PUNCTUATION.sub(" ", text.lower())).strip()
+
+    def features(self, text):
+        """The n-gram strings hashed for one text"""
+        words = self.normalize(text).split()
+        features = []
+        for n in range(self.word_ngrams[0], self.word_ngrams[1] + 1):
+            features.extend("w:" + " ".join(words[i:i + n]) for i in range(len(words) - n + 1))
+        for word in words:
+            padded = f"<{word}>"
+            for n in range(self.char_ngrams[0], self.char_ngrams[1] + 1):
+                features.extend("c:" + padded[i:i + n] for i in range(len(padded) - n + 1))
+        return features
+
+    def embed(self, texts):
+        """Embed a list of texts as a (len(texts), dim) float32 array"""
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self.features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                # Signed hashing keeps collisions from only ever adding up
+                vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+
+class NeighbourIndex:
+    """Labelled vectors with exact cosine nearest-neighbour search"""
+
+    def __init__(self, embedder, vectors, labels, texts, metadata=None):
+        self.embedder = embedder
+        self.vectors = vectors
+        self.labels = labels
+        self.texts = texts
+        self.metadata = metadata or {}
+
+    @classmethod
+    def build(cls, dataset_path, embedder=None):
+        """Embed every question in a fine-tuning dataset"""
+        embedder = embedder or HashedNgramEmbedder()
+        texts, labels = read_dataset(dataset_path)
+        metadata = {
+            "dataset": os.path.basename(dataset_path),
+            "dataset_sha256": file_sha256(dataset_path),
+            "size": len(texts),
+        }
+        return cls(embedder, embedder.embed(texts), labels, texts, metadata)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, VECTORS_FILENAME), self.vectors)
+        np.save(os.path.join(directory, LABELS_FILENAME), self.labels)
+        with open(os.path.join(directory, TEXTS_FILENAME), "w") as f:
+            json.dump(self.texts, f)
+        with open(os.path.join(directory, INDEX_METADATA), "w") as f:
+            json.dump({**self.metadata, "embedder": self.embedder.config()}, f, indent=2)
+
+    @classmethod
+    def load(cls, directory):
+        """Load an index; the vectors are memory-mapped rather than read into memory"""
+        with open(os.path.join(directory, INDEX_METADATA)) as f:
+            metadata = json.load(f)
+        with open(os.path.join(directory, TEXTS_FILENAME)) as f:
+            texts = json.load(f)
+        embedder = HashedNgramEmbedder(**metadata.pop("embedder"))
+        vectors = np.load(os.path.join(directory, VECTORS_FILENAME), mmap_mode="r")
+        labels = np.load(os.path.join(directory, LABELS_FILENAME))
+        return cls(embedder, vectors, labels, texts, metadata)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def search(self, queries, exclude_self=False):
+        """Find the nearest labelled neighbour of each query vector
+
+        Args:
+            queries: (n, dim) array from the index's embedder
+            exclude_self: Ignore neighbours identical to the query (for leave-one-out evaluation)
+
+        Returns:
+            (similarities, neighbour indices), each of length n
+        """
+        similarities = queries @ np.asarray(self.vectors).T
+        if exclude_self:
+            similarities[similarities > 1 - 1e-6] = -1.0
+        nearest = similarities.argmax(axis=1)
+        return similarities[np.arange(len(queries)), nearest], nearest
+
+    def lookup(self, texts):
+        """Embed texts and return (similarities, neighbour label ids, neighbour texts)"""
+        similarities, nearest = self.search(self.embedder.embed(texts))
+        return similarities, self.labels[nearest], [self.texts[i] for i in nearest]
+
+
+def evaluate(index, dataset_path, thresholds):
+    """Leave-one-out hit rate and label agreement of the fast path at each threshold"""
+    texts, labels = read_dataset(dataset_path)
+    similarities, nearest = index.search(index.embedder.embed(texts), exclude_self=True)
+    agree = index.labels[nearest] == labels
+    report = []
+    for threshold in thresholds:
+        hits = similarities >= threshold
+        report.append({
+            "threshold": threshold,
+            "hit_rate": float(hits.mean()),
+            "agreement": float(agree[hits].mean()) if hits.any() else None,
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Build or evaluate a nearest-neighbour index over a fine-tuning dataset',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='Embed a dataset into an index directory')
+    build_parser.add_argument('--dataset', required=True, help='Fine-tuning JSONL file ({"input", "label"} lines)')
+    build_parser.add_argument('--output', required=True, help='Index directory to write')
+    build_parser.add_argument('--dim', type=int, default=1024, help='Embedding dimension (default: 1024)')
+    evaluate_parser = subparsers.add_parser('evaluate', help='Report leave-one-out hit rate and agreement')
+    evaluate_parser.add_argument('--index', required=True, help='Index directory')
+    evaluate_parser.add_argument('--dataset', required=True, help='Labelled JSONL file to query with')
+    evaluate_parser.add_argument('--thresholds', type=str, default='0.7,0.8,0.85,0.9,0.95',
+                                 help='Comma-separated similarity thresholds (default: 0.7,0.8,0.85,0.9,0.95)')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        index = NeighbourIndex.build(args.dataset, HashedNgramEmbedder(dim=args.dim))
+        index.save(args.output)
+        print(f"✅ Indexed {len(index)} questions from {args.dataset} into {args.output}", file=sys.stderr)
+    else:
+        thresholds = [float(t) for t in args.thresholds.split(',') if t.strip()]
+        report = evaluate(NeighbourIndex.load(args.index), args.dataset, thresholds)
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
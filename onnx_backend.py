@@ -0,0 +1,67 @@
+"""
+ONNX Runtime backend for the topic classification model.
+
+`OrtSequenceClassifier` wraps a graph exported by `export_onnx.py` so it can
+stand in for `AutoModelForSequenceClassification` in `star_trek_api_server.py`:
+it is called with tokenizer outputs and returns an object with `.logits`.
+"""
+
+import json
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+
+ONNX_FILENAME = "model.onnx"
+METADATA_FILENAME = "guard_onnx.json"
+
+
+def create_session(path, num_threads=None):
+    """ONNX Runtime CPU session for a graph, with all graph optimisations enabled"""
+    try:
+        import onnxruntime as ort
+    except ImportError as e:
+        raise ImportError("The onnxruntime backend needs: pip install onnxruntime") from e
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+    return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+
+class OrtSequenceClassifier:
+    """Sequence classifier running on the ONNX Runtime CPU execution provider
+
+    Args:
+        model_dir: Directory written by export_onnx.py (model.onnx, guard_onnx.json, tokenizer files)
+        num_threads: Intra-op thread count (None lets ONNX Runtime decide)
+    """
+
+    def __init__(self, model_dir, num_threads=None):
+        with open(os.path.join(model_dir, METADATA_FILENAME)) as f:
+            metadata = json.load(f)
+
+        self.session = create_session(os.path.join(model_dir, ONNX_FILENAME), num_threads)
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.device = torch.device("cpu")
+        self.config = SimpleNamespace(
+            id2label={int(k): v for k, v in metadata["id2label"].items()},
+            name_or_path=metadata["source_model"],
+            num_labels=len(metadata["id2label"]),
+        )
+
+    def eval(self):
+        return self
+
+    def __call__(self, input_ids, attention_mask=None, **kwargs):
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        feeds = {
+            "input_ids": input_ids.cpu().numpy().astype(np.int64),
+            "attention_mask": attention_mask.cpu().numpy().astype(np.int64),
+        }
+        feeds = {name: value for name, value in feeds.items() if name in self.input_names}
+        logits = self.session.run(["logits"], feeds)[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
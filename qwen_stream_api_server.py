@@ -1,9 +1,21 @@
+import time
+_process_started = time.perf_counter()
+
 import torch
 from transformers import AutoModel, AutoTokenizer
 from flask import Flask, request, Response, jsonify
 from flask_cors import CORS
+import atexit
 import json
-import sys
+import threading
+from guard_logging import get_logger, setup_logging
+from guard_models import STREAM_MODEL_PATHS
+from model_loading import StartupTimer, fast_load_kwargs, resolve_snapshot
+from stream_sessions import StreamStateRegistry, StreamCapacityError, compile_stream_model
+from stream_state_store import StreamStateStore
+
+startup_timer = StartupTimer(_process_started)
+startup_timer.record("imports", time.perf_counter() - _process_started)
 
 # ============================================================================
 # CONFIGURATION - Model Selection
@@ -14,16 +26,54 @@ import sys
 #   - "8B"   for Qwen/Qwen3Guard-Stream-8B (largest, most accurate)
 MODEL_SIZE = "0.6B"
 
-# Model path mapping
-MODEL_PATHS = {
-    "0.6B": "Qwen/Qwen3Guard-Stream-0.6B",
-    "4B": "Qwen/Qwen3Guard-Stream-4B",
-    "8B": "Qwen/Qwen3Guard-Stream-8B"
-}
+# Model path mapping (see guard_models.py)
+MODEL_PATHS = STREAM_MODEL_PATHS
 
 # Get the model path based on configuration
 MODEL_PATH = MODEL_PATHS.get(MODEL_SIZE, MODEL_PATHS["0.6B"])
 
+# Startup (see model_loading.py): the model loads from the local Hugging Face
+# cache without contacting the Hub, pinned to MODEL_REVISION (a commit hash)
+# when set. A model that is not cached yet is downloaded, unless OFFLINE is set.
+# STARTUP_WARMUP runs a short conversation through the model before serving.
+MODEL_REVISION = None
+OFFLINE = False
+STARTUP_WARMUP = True
+
+# Stream-state limits. New streams are refused with HTTP 503 once either cap is
+# reached, instead of letting KV caches grow until the process runs out of memory.
+MAX_OPEN_STREAMS = 64
+MAX_STREAM_MEMORY_MB = 4096
+
+# How the per-token assistant step runs:
+#   - "eager"     exactly as the model's own code does it
+#   - "inference" under torch.inference_mode() (no autograd bookkeeping)
+#   - "compiled"  as "inference", plus torch.compile of the model forward
+#                 (slower startup, compiled during warmup in load_model)
+# The KV cache is still the model's own growing cache: "compiled" uses dynamic
+# shapes, not a StaticCache with CUDA graphs, which stream_moderate_from_ids
+# (remote code) does not support (see compile_stream_model). Measure the modes
+# with benchmark_stream_step.py before switching from "eager".
+STREAM_STEP_MODE = "eager"
+
+# Bounded context for long assistant responses. None keeps the full conversation
+# in the stream state. With a number, only the user turn plus the last that many
+# assistant tokens are kept, so per-token latency and memory stop growing with
+# the response length (at some cost in accuracy - see benchmark_stream_step.py).
+STREAM_WINDOW_TOKENS = None
+STREAM_WINDOW_SLACK = 64
+
+# Session-based streaming (/api/stream/*). Snapshots of stream states are kept in
+# this directory; point every worker at the same (shared) directory to move
+# sessions between workers or keep them across restarts. Sessions idle for
+# longer than STREAM_SESSION_IDLE_SECONDS are snapshotted and released from memory.
+STREAM_STATE_DIR = "./stream_states"
+STREAM_SESSION_IDLE_SECONDS = 300
+
+# Logging (see guard_logging.py)
+LOG_LEVEL = "INFO"
+LOG_FORMAT = "text"
+
 # ============================================================================
 
 app = Flask(__name__)
@@ -32,20 +82,96 @@ CORS(app, origins="*", allow_headers=["Content-Type", "Authorization"], methods=
 # Global variables for model and tokenizer
 model = None
 tokenizer = None
+stream_registry = StreamStateRegistry(
+    max_streams=MAX_OPEN_STREAMS,
+    max_bytes=MAX_STREAM_MEMORY_MB * 1024 * 1024,
+    step_mode=STREAM_STEP_MODE,
+    window_tokens=STREAM_WINDOW_TOKENS,
+    window_slack=STREAM_WINDOW_SLACK
+)
+state_store = None
+
+# Open /api/stream sessions held in this worker: session_id -> {'session', 'lock', 'assistant_started'}
+live_sessions = {}
+live_sessions_lock = threading.Lock()
+assistant_prefix_ids = None
+
+logger = get_logger(__name__)
+
+def stream_capacity_response(e):
+    """Build the 503 response returned when the stream registry is full"""
+    response = jsonify({'error': str(e)})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
 
 def load_model():
     """Load the Qwen3Guard-Stream model and tokenizer based on configuration"""
     global model, tokenizer
     if model is None or tokenizer is None:
-        print(f"Loading {MODEL_PATH} model...")
-        tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH, trust_remote_code=True)
-        model = AutoModel.from_pretrained(
-            MODEL_PATH,
-            device_map="auto",
-            torch_dtype=torch.bfloat16,
-            trust_remote_code=True,
-        ).eval()
-        print(f"Model {MODEL_PATH} loaded successfully!")
+        logger.info("Loading model", model=MODEL_PATH, revision=MODEL_REVISION)
+        with startup_timer.phase("snapshot"):
+            model_dir = resolve_snapshot(MODEL_PATH, MODEL_REVISION, offline=OFFLINE)
+        with startup_timer.phase("tokenizer"):
+            tokenizer = AutoTokenizer.from_pretrained(model_dir, trust_remote_code=True)
+            stream_registry.assistant_header_ids = get_assistant_prefix_ids()
+        with startup_timer.phase("weights"):
+            model = AutoModel.from_pretrained(
+                model_dir,
+                device_map="auto",
+                torch_dtype=torch.bfloat16,
+                trust_remote_code=True,
+                **fast_load_kwargs(model_dir),
+            ).eval()
+        if STREAM_STEP_MODE == "compiled":
+            logger.info("Compiling the incremental step (this takes a while on first start)")
+            compile_stream_model(model)
+        if STARTUP_WARMUP or STREAM_STEP_MODE == "compiled":
+            with startup_timer.phase("warmup"):
+                warmup_stream_step()
+        logger.info("Model loaded", model=MODEL_PATH)
+
+def warmup_stream_step(num_tokens=16):
+    """Run a short conversation through the model so compilation happens before serving"""
+    text = tokenizer.apply_chat_template(
+        [{"role": "user", "content": "Hello"}, {"role": "assistant", "content": "Hello! " * num_tokens}],
+        tokenize=False,
+        add_generation_prompt=False,
+        enable_thinking=False
+    )
+    token_ids = tokenizer(text, return_tensors="pt").input_ids[0].to(model.device)
+    user_end_index = find_user_message_end(token_ids, tokenizer)
+    with stream_registry.open(model) as session:
+        session.moderate(token_ids[:user_end_index+1], role="user")
+        for i in range(user_end_index + 1, len(token_ids)):
+            session.moderate(token_ids[i], role="assistant")
+
+def user_message_token_ids(message):
+    """Token ids of a single-user-message conversation, as a 1-D tensor"""
+    text = tokenizer.apply_chat_template(
+        [{"role": "user", "content": message}],
+        tokenize=False,
+        add_generation_prompt=False,
+        enable_thinking=False
+    )
+    return tokenizer(text, return_tensors="pt").input_ids[0]
+
+def moderate_user_message(token_ids):
+    """Moderate the user turn of a tokenized conversation
+    
+    Returns:
+        (risk_level, category) at the end of the user message
+    
+    Raises:
+        StopIteration: If the end of the user message can't be found
+    """
+    user_end_index = find_user_message_end(token_ids, tokenizer)
+    with stream_registry.open(model) as session:
+        result = session.moderate(token_ids[:user_end_index+1], role="user")
+    
+    risk_level = result['risk_level'][-1]
+    category = result.get('category', [None])[-1] if 'category' in result and result['category'] else None
+    return risk_level, category
 
 def find_user_message_end(token_ids, tokenizer):
     """Find the end index of the user message in tokenized input"""
@@ -72,6 +198,30 @@ def find_user_message_end(token_ids, tokenizer):
     
     return user_end_index
 
+def assistant_token_offsets(text, offset_mapping, assistant_message, first_index):
+    """Map assistant token offsets in the templated text to the original assistant message
+    
+    Uses the tokenizer's offset mapping so no per-token decode is needed. Returns a
+    list of (token_text, start, end) for every token from first_index onwards, where
+    start/end are character offsets into assistant_message. Template tokens around
+    the message (role header, <|im_end|>) are clamped to the message boundaries.
+    """
+    content_start = text.rfind(assistant_message) if assistant_message else -1
+    if content_start < 0:
+        # The template rewrote the message (e.g. stripped whitespace); fall back to
+        # offsets relative to the start of the assistant turn
+        content_start = offset_mapping[first_index][0]
+        content_length = len(text) - content_start
+    else:
+        content_length = len(assistant_message)
+    
+    labels = []
+    for token_start, token_end in offset_mapping[first_index:]:
+        start = min(max(token_start - content_start, 0), content_length)
+        end = min(max(token_end - content_start, 0), content_length)
+        labels.append((text[token_start:token_end], start, end))
+    return labels
+
 @app.route('/api/moderate', methods=['POST', 'OPTIONS'])
 def moderate():
     """Moderate a single user message"""
@@ -89,47 +239,21 @@ def moderate():
                 'message': ''
             }), 200
         
-        # Prepare messages for moderation
-        moderation_messages = [{"role": "user", "content": message}]
-        
-        # Apply chat template
-        text = tokenizer.apply_chat_template(
-            moderation_messages,
-            tokenize=False,
-            add_generation_prompt=False,
-            enable_thinking=False
-        )
-        model_inputs = tokenizer(text, return_tensors="pt")
-        token_ids = model_inputs.input_ids[0]
-        
-        # Find user message end
         try:
-            user_end_index = find_user_message_end(token_ids, tokenizer)
+            risk_level, category = moderate_user_message(user_message_token_ids(message))
         except StopIteration:
             return jsonify({'error': 'Failed to parse user message'}), 400
         
-        # Moderate the user message
-        stream_state = None
-        result, stream_state = model.stream_moderate_from_ids(
-            token_ids[:user_end_index+1],
-            role="user",
-            stream_state=None
-        )
-        model.close_stream(stream_state)
-        
-        risk_level = result['risk_level'][-1]
-        category = result.get('category', [None])[-1] if 'category' in result and result['category'] else None
-        
         return jsonify({
             'risk_level': risk_level,
             'category': category,
             'message': message
         })
     
+    except StreamCapacityError as e:
+        return stream_capacity_response(e)
     except Exception as e:
-        print(f"Error in moderate endpoint: {e}", file=sys.stderr)
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in moderate endpoint")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/moderate_conversation', methods=['POST', 'OPTIONS'])
@@ -142,10 +266,14 @@ def moderate_conversation():
         data = request.json or {}
         messages = data.get('messages', [])
         stream = data.get('stream', False)
+        response_format = data.get('format', 'tokens')
         
         if not messages:
             return jsonify({'error': 'No messages provided'}), 400
         
+        if response_format not in ('tokens', 'spans'):
+            return jsonify({'error': "format must be 'tokens' or 'spans'"}), 400
+        
         # Extract user and assistant messages
         user_message = None
         assistant_message = None
@@ -175,7 +303,7 @@ def moderate_conversation():
             add_generation_prompt=False,
             enable_thinking=False
         )
-        model_inputs = tokenizer(text, return_tensors="pt")
+        model_inputs = tokenizer(text, return_tensors="pt", return_offsets_mapping=True)
         token_ids = model_inputs.input_ids[0]
         
         # Find user message end
@@ -184,32 +312,72 @@ def moderate_conversation():
         except StopIteration:
             return jsonify({'error': 'Failed to parse user message'}), 400
         
+        # Label assistant tokens with exact character ranges of the original message
+        token_labels = assistant_token_offsets(
+            text, model_inputs.offset_mapping[0].tolist(), assistant_message, user_end_index + 1
+        )
+        
+        # Copy the ids to the model's device once, rather than one token per step
+        token_ids = token_ids.to(model.device)
+        
+        # Open the stream state up front so a full registry is reported as a 503
+        # rather than as an error frame inside a 200 streaming response
+        session = stream_registry.open(model)
+        
         if stream:
-            return Response(
-                stream_moderation_results(token_ids, user_end_index, assistant_message is not None),
+            response = Response(
+                stream_moderation_results(session, token_ids, token_labels, user_end_index, assistant_message is not None),
                 mimetype='application/json',
                 headers={'Content-Type': 'application/json'}
             )
+            # Runs when the WSGI server closes the response, including when the
+            # client disconnects before the generator finishes (or even starts)
+            response.call_on_close(session.close)
+            return response
         else:
-            return moderate_conversation_non_streaming(token_ids, user_end_index, assistant_message is not None)
+            with session:
+                return moderate_conversation_non_streaming(
+                    session, token_ids, token_labels, user_end_index, assistant_message is not None, response_format
+                )
     
+    except StreamCapacityError as e:
+        return stream_capacity_response(e)
     except Exception as e:
-        print(f"Error in moderate_conversation endpoint: {e}", file=sys.stderr)
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in moderate_conversation endpoint")
         return jsonify({'error': str(e)}), 500
 
-def moderate_conversation_non_streaming(token_ids, user_end_index, has_assistant_message):
-    """Non-streaming moderation of conversation"""
+def append_verdict_span(spans, start, end, risk_level, category):
+    """Extend the last span if it has the same verdict, otherwise start a new one
+    
+    Categories are only meaningful for non-Safe verdicts, so Safe tokens always
+    merge regardless of the category the model reports for them.
+    """
+    if risk_level == 'Safe':
+        category = None
+    if spans and spans[-1]['risk_level'] == risk_level and spans[-1]['category'] == category:
+        spans[-1]['end'] = end
+        spans[-1]['token_count'] += 1
+    else:
+        spans.append({
+            'start': start,
+            'end': end,
+            'risk_level': risk_level,
+            'category': category,
+            'token_count': 1
+        })
+
+def moderate_conversation_non_streaming(session, token_ids, token_labels, user_end_index, has_assistant_message, response_format='tokens'):
+    """Non-streaming moderation of conversation
+    
+    token_labels holds (token_text, start, end) for each assistant token, as built
+    by assistant_token_offsets. With response_format='tokens' the assistant result
+    lists every token with its character range. With 'spans' consecutive tokens sharing a verdict are merged into character-offset
+    spans, and the offset of the first non-Safe token is reported.
+    """
     results = {}
     
     # 1. Moderate user message
-    stream_state = None
-    user_result, stream_state = model.stream_moderate_from_ids(
-        token_ids[:user_end_index+1],
-        role="user",
-        stream_state=None
-    )
+    user_result = session.moderate(token_ids[:user_end_index+1], role="user")
     
     user_risk = user_result['risk_level'][-1]
     user_category = user_result.get('category', [None])[-1] if 'category' in user_result and user_result['category'] else None
@@ -222,27 +390,41 @@ def moderate_conversation_non_streaming(token_ids, user_end_index, has_assistant
     # 2. If assistant message exists, moderate it token-by-token
     if has_assistant_message and len(token_ids) > user_end_index + 1:
         assistant_results = []
+        spans = []
+        first_unsafe_offset = None
+        risk_level, category = 'Safe', None
         
         for i in range(user_end_index + 1, len(token_ids)):
             current_token = token_ids[i]
-            result, stream_state = model.stream_moderate_from_ids(
-                current_token,
-                role="assistant",
-                stream_state=stream_state
-            )
+            result = session.moderate(current_token, role="assistant")
             
-            token_str = tokenizer.decode([current_token])
+            token_str, start, end = token_labels[i - user_end_index - 1]
             risk_level = result['risk_level'][-1]
             category = result.get('category', [None])[-1] if 'category' in result and result['category'] else None
             
-            assistant_results.append({
-                'token': token_str,
-                'risk_level': risk_level,
-                'category': category
-            })
+            if response_format == 'spans':
+                append_verdict_span(spans, start, end, risk_level, category)
+                if first_unsafe_offset is None and risk_level != 'Safe':
+                    first_unsafe_offset = start
+            else:
+                assistant_results.append({
+                    'token': token_str,
+                    'start': start,
+                    'end': end,
+                    'risk_level': risk_level,
+                    'category': category
+                })
         
         # Get the overall risk level from the last token
-        if assistant_results:
+        if response_format == 'spans':
+            results['assistant'] = {
+                'risk_level': risk_level,
+                'category': category,
+                'token_count': len(token_ids) - user_end_index - 1,
+                'first_unsafe_offset': first_unsafe_offset,
+                'spans': spans
+            }
+        elif assistant_results:
             results['assistant'] = {
                 'risk_level': assistant_results[-1]['risk_level'],
                 'category': assistant_results[-1]['category'],
@@ -254,24 +436,14 @@ def moderate_conversation_non_streaming(token_ids, user_end_index, has_assistant
                 'category': None,
                 'tokens': []
             }
-        
-        model.close_stream(stream_state)
-    else:
-        model.close_stream(stream_state)
     
     return jsonify(results)
 
-def stream_moderation_results(token_ids, user_end_index, has_assistant_message):
+def stream_moderation_results(session, token_ids, token_labels, user_end_index, has_assistant_message):
     """Stream moderation results matching chat_Stream_8B.py logic"""
     try:
-        stream_state = None
-        
         # 1. Moderate user message
-        result, stream_state = model.stream_moderate_from_ids(
-            token_ids[:user_end_index+1],
-            role="user",
-            stream_state=None
-        )
+        result = session.moderate(token_ids[:user_end_index+1], role="user")
         
         risk_level = result['risk_level'][-1]
         category = result.get('category', [None])[-1] if 'category' in result and result['category'] else None
@@ -305,13 +477,9 @@ def stream_moderation_results(token_ids, user_end_index, has_assistant_message):
             for i in range(user_end_index + 1, len(token_ids)):
                 current_token = token_ids[i]
                 
-                result, stream_state = model.stream_moderate_from_ids(
-                    current_token,
-                    role="assistant",
-                    stream_state=stream_state
-                )
+                result = session.moderate(current_token, role="assistant")
                 
-                token_str = tokenizer.decode([current_token])
+                token_str, start, end = token_labels[i - user_end_index - 1]
                 risk_level = result['risk_level'][-1]
                 category = result.get('category', [None])[-1] if 'category' in result and result['category'] else None
                 
@@ -326,14 +494,15 @@ def stream_moderation_results(token_ids, user_end_index, has_assistant_message):
                         'type': 'token_moderation',
                         'content': char,
                         'token': token_str,
+                        'start': start,
+                        'end': end,
                         'risk_level': risk_level,
                         'category': category,
                         'done': False
                     }) + '\n'
         
         # Clean up
-        if stream_state:
-            model.close_stream(stream_state)
+        session.close()
         
         # Send final message
         yield json.dumps({
@@ -343,14 +512,297 @@ def stream_moderation_results(token_ids, user_end_index, has_assistant_message):
         }) + '\n'
     
     except Exception as e:
-        print(f"Error in stream_moderation_results: {e}", file=sys.stderr)
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in stream_moderation_results")
         yield json.dumps({
             'type': 'error',
             'content': f'Error: {str(e)}',
             'done': True
         }) + '\n'
+    finally:
+        # Also reached via GeneratorExit when the client disconnects mid-stream
+        session.close()
+
+def get_state_store():
+    """Return the snapshot store, creating its directory on first use"""
+    global state_store
+    if state_store is None:
+        state_store = StreamStateStore(STREAM_STATE_DIR)
+    return state_store
+
+def get_assistant_prefix_ids():
+    """Token ids the chat template puts between the user's <|im_end|> and the assistant text"""
+    global assistant_prefix_ids
+    if assistant_prefix_ids is None:
+        sentinel = "\u2063ASSISTANT\u2063"
+        text = tokenizer.apply_chat_template(
+            [{"role": "user", "content": "x"}, {"role": "assistant", "content": sentinel}],
+            tokenize=False,
+            add_generation_prompt=False,
+            enable_thinking=False
+        )
+        user_end = text.index('<|im_end|>') + len('<|im_end|>')
+        prefix_text = text[user_end:text.index(sentinel)]
+        assistant_prefix_ids = tokenizer(prefix_text, add_special_tokens=False).input_ids
+    return assistant_prefix_ids
+
+def snapshot_session(session_id, release):
+    """Write a live session's state to the store, optionally releasing it from memory
+    
+    A snapshot that keeps the session live is deleted again as soon as the
+    session moves on, so no other worker can restore a stale copy and fork it.
+    """
+    with live_sessions_lock:
+        live = live_sessions.get(session_id)
+    if live is None:
+        return None
+    with live['lock']:
+        session = live['session']
+        if session.closed:
+            return None
+        prefix_ids, header_ids, assistant_ids = session.window_ids()
+        size = get_state_store().save(session_id, session.state, {
+            'assistant_started': live['assistant_started'],
+            'prefix_ids': prefix_ids,
+            'header_ids': header_ids,
+            'assistant_ids': assistant_ids,
+            'model': MODEL_PATH
+        })
+        if release:
+            # Only dropped once the snapshot is written: a concurrent append either
+            # finds the live session or, once it is closed, restores the snapshot
+            with live_sessions_lock:
+                if live_sessions.get(session_id) is live:
+                    del live_sessions[session_id]
+            session.close()
+        else:
+            live['snapshot_pending'] = True
+    return size
+
+def snapshot_idle_sessions():
+    """Snapshot and release sessions that have been idle for too long"""
+    with live_sessions_lock:
+        idle = [sid for sid, live in live_sessions.items()
+                if live['session'].idle_seconds > STREAM_SESSION_IDLE_SECONDS]
+    for session_id in idle:
+        snapshot_session(session_id, release=True)
+
+def snapshot_live_sessions():
+    """Snapshot every live session, e.g. before a restart"""
+    for session_id in list(live_sessions):
+        try:
+            snapshot_session(session_id, release=True)
+        except Exception:
+            logger.exception("Error snapshotting stream session", session_id=session_id)
+
+def get_live_session(session_id):
+    """Return a live session, restoring it from the store if another worker left it there
+    
+    Raises KeyError if the session is unknown.
+    """
+    with live_sessions_lock:
+        live = live_sessions.get(session_id)
+        if live is not None:
+            return live
+    state, metadata = get_state_store().load(session_id, device=model.device)
+    if metadata.get('model') != MODEL_PATH:
+        raise KeyError(session_id)
+    with live_sessions_lock:
+        live = live_sessions.get(session_id)
+        if live is None:
+            session = stream_registry.open(
+                model,
+                session_id=session_id,
+                state=state,
+                window_ids=(metadata['prefix_ids'], metadata.get('header_ids', []), metadata['assistant_ids'])
+            )
+            live = {
+                'session': session,
+                'lock': threading.Lock(),
+                'assistant_started': metadata['assistant_started']
+            }
+            live_sessions[session_id] = live
+    get_state_store().delete(session_id)
+    return live
+
+@app.route('/api/stream/start', methods=['POST', 'OPTIONS'])
+def stream_start():
+    """Start a moderation session with the user message and return its id"""
+    if request.method == 'OPTIONS':
+        return Response(status=200)
+    
+    try:
+        data = request.json or {}
+        message = data.get('message', '').strip()
+        if not message:
+            return jsonify({'error': 'No user message provided'}), 400
+        
+        snapshot_idle_sessions()
+        
+        text = tokenizer.apply_chat_template(
+            [{"role": "user", "content": message}],
+            tokenize=False,
+            add_generation_prompt=False,
+            enable_thinking=False
+        )
+        token_ids = tokenizer(text, return_tensors="pt").input_ids[0]
+        try:
+            user_end_index = find_user_message_end(token_ids, tokenizer)
+        except StopIteration:
+            return jsonify({'error': 'Failed to parse user message'}), 400
+        
+        session = stream_registry.open(model)
+        try:
+            result = session.moderate(token_ids[:user_end_index+1], role="user")
+        except Exception:
+            session.close()
+            raise
+        with live_sessions_lock:
+            live_sessions[session.session_id] = {
+                'session': session,
+                'lock': threading.Lock(),
+                'assistant_started': False
+            }
+        
+        return jsonify({
+            'session_id': session.session_id,
+            'risk_level': result['risk_level'][-1],
+            'category': result.get('category', [None])[-1] if 'category' in result and result['category'] else None
+        })
+    
+    except StreamCapacityError as e:
+        return stream_capacity_response(e)
+    except Exception as e:
+        logger.exception("Error in stream_start endpoint")
+        return jsonify({'error': str(e)}), 500
+
+def append_to_session(session_id, live, chunk_ids, labels):
+    """Moderate assistant tokens in a live session
+    
+    Returns:
+        Per-token verdicts, or None if the session was closed or released meanwhile
+    """
+    tokens = []
+    with live['lock']:
+        session = live['session']
+        if session.closed:
+            return None
+        if live.pop('snapshot_pending', False):
+            # The session moves past its snapshot, so the snapshot must not be restored anymore
+            get_state_store().delete(session_id)
+        if not live['assistant_started']:
+            # The assistant turn header is moderated silently, as in moderate_conversation
+            for token_id in get_assistant_prefix_ids():
+                session.moderate(torch.tensor(token_id, device=model.device), role="assistant")
+            live['assistant_started'] = True
+        ids = torch.tensor(chunk_ids, dtype=torch.long, device=model.device)
+        for i in range(len(chunk_ids)):
+            result = session.moderate(ids[i], role="assistant")
+            token_str, start, end = labels[i]
+            tokens.append({
+                'token_id': chunk_ids[i],
+                'token': token_str,
+                'start': start,
+                'end': end,
+                'risk_level': result['risk_level'][-1],
+                'category': result.get('category', [None])[-1] if 'category' in result and result['category'] else None
+            })
+    return tokens
+
+@app.route('/api/stream/append', methods=['POST', 'OPTIONS'])
+def stream_append():
+    """Moderate the next chunk of assistant output in a session
+    
+    Accepts either "text" (a chunk of assistant text) or "token_ids" (the
+    generator's own token ids, which avoids re-tokenizing chunk boundaries).
+    If the session is not held by this worker it is restored from the store.
+    """
+    if request.method == 'OPTIONS':
+        return Response(status=200)
+    
+    try:
+        data = request.json or {}
+        session_id = data.get('session_id', '')
+        try:
+            live = get_live_session(session_id)
+        except (KeyError, ValueError):
+            return jsonify({'error': f'Unknown session: {session_id}'}), 404
+        
+        if 'token_ids' in data:
+            chunk_ids = [int(i) for i in data['token_ids']]
+            labels = [(None, None, None)] * len(chunk_ids)
+        else:
+            chunk = data.get('text', '')
+            encoded = tokenizer(chunk, add_special_tokens=False, return_offsets_mapping=True)
+            chunk_ids = encoded.input_ids
+            labels = [(chunk[start:end], start, end) for start, end in encoded.offset_mapping]
+        
+        # A concurrent snapshot may release the session after the lookup; it is then in the store
+        for _ in range(2):
+            tokens = append_to_session(session_id, live, chunk_ids, labels)
+            if tokens is not None:
+                break
+            try:
+                live = get_live_session(session_id)
+            except (KeyError, ValueError):
+                break
+        if tokens is None:
+            return jsonify({'error': f'Unknown session: {session_id}'}), 404
+        
+        return jsonify({
+            'session_id': session_id,
+            'risk_level': tokens[-1]['risk_level'] if tokens else None,
+            'category': tokens[-1]['category'] if tokens else None,
+            'tokens': tokens
+        })
+    
+    except StreamCapacityError as e:
+        return stream_capacity_response(e)
+    except Exception as e:
+        logger.exception("Error in stream_append endpoint")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/stream/snapshot', methods=['POST', 'OPTIONS'])
+def stream_snapshot():
+    """Persist a session's stream state so any worker can continue it"""
+    if request.method == 'OPTIONS':
+        return Response(status=200)
+    
+    try:
+        data = request.json or {}
+        session_id = data.get('session_id', '')
+        release = data.get('release', True)
+        size = snapshot_session(session_id, release)
+        if size is None:
+            return jsonify({'error': f'Unknown session: {session_id}'}), 404
+        return jsonify({'session_id': session_id, 'bytes': size, 'released': release})
+    
+    except Exception as e:
+        logger.exception("Error in stream_snapshot endpoint")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/stream/close', methods=['POST', 'OPTIONS'])
+def stream_close():
+    """End a session and discard its state, in memory and in the store"""
+    if request.method == 'OPTIONS':
+        return Response(status=200)
+    
+    try:
+        data = request.json or {}
+        session_id = data.get('session_id', '')
+        with live_sessions_lock:
+            live = live_sessions.pop(session_id, None)
+        if live is not None:
+            with live['lock']:
+                live['session'].close()
+        try:
+            get_state_store().delete(session_id)
+        except ValueError:
+            return jsonify({'error': f'Unknown session: {session_id}'}), 404
+        return jsonify({'session_id': session_id, 'closed': True})
+    
+    except Exception as e:
+        logger.exception("Error in stream_close endpoint")
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -359,7 +811,9 @@ def health():
         'status': 'healthy',
         'model_loaded': model is not None,
         'model_name': MODEL_PATH if model is not None else None,
-        'model_size': MODEL_SIZE
+        'model_size': MODEL_SIZE,
+        'streams': stream_registry.stats(),
+        'live_sessions': len(live_sessions)
     })
 
 @app.route('/', methods=['GET'])
@@ -371,6 +825,10 @@ def index():
         'endpoints': {
             '/api/moderate': 'POST - Moderate a single user message',
             '/api/moderate_conversation': 'POST - Moderate a conversation (user + assistant)',
+            '/api/stream/start': 'POST - Start a streaming moderation session with a user message',
+            '/api/stream/append': 'POST - Moderate the next chunk of assistant output in a session',
+            '/api/stream/snapshot': 'POST - Persist a session so another worker can continue it',
+            '/api/stream/close': 'POST - End a streaming moderation session',
             '/health': 'GET - Health check'
         },
         'model': MODEL_PATH,
@@ -378,12 +836,14 @@ def index():
     })
 
 if __name__ == '__main__':
-    print(f"Initializing Qwen3Guard-Stream API Server (Model: {MODEL_PATH})...")
+    setup_logging(LOG_LEVEL, LOG_FORMAT)
+    logger.info("Initializing Qwen3Guard-Stream API Server", model=MODEL_PATH)
     load_model()
-    print("Starting server on http://localhost:5000")
-    print("API endpoints:")
-    print("  - POST /api/moderate - Moderate a single message")
-    print("  - POST /api/moderate_conversation - Moderate a conversation")
-    print("  - GET /health - Health check")
+    startup_timer.report(model=MODEL_PATH, offline=OFFLINE)
+    # Keep open sessions across restarts instead of re-prefilling them
+    atexit.register(snapshot_live_sessions)
+    logger.info("Starting server", url="http://localhost:5000")
+    logger.info("API endpoints: POST /api/moderate, POST /api/moderate_conversation, "
+                "POST /api/stream/{start,append,snapshot,close}, GET /health")
     app.run(host='0.0.0.0', port=5000, debug=False)
 
@@ -0,0 +1,192 @@
+"""
+Sequence packing for fine-tuning the topic classifiers.
+
+The guard datasets are short questions, so even dynamically padded batches
+are only a few dozen tokens wide and each forward pass does little work.
+`pack_examples` concatenates tokenized questions into sequences of up to
+`max_length` tokens. `PackedCollator` gives each packed row a block-diagonal
+causal attention mask (a 4D additive float mask) and restarts the position
+ids at every question, so a question never attends to its neighbours and is
+encoded as it would be on its own. `packed_logits` pools the last token of
+every question and applies the classification head, so each question still
+gets its own related/not_related loss in `PackedTrainer`.
+"""
+
+import time
+
+import torch
+from transformers import Trainer
+
+
+def pack_examples(input_ids, labels, max_length):
+    """Pack tokenized examples into sequences of at most max_length tokens (first fit, longest first)
+
+    Returns:
+        {"input_ids", "segment_lengths", "labels"} columns with one row per packed sequence
+    """
+    order = sorted(range(len(input_ids)), key=lambda i: len(input_ids[i]), reverse=True)
+    packs = []  # [free tokens, example indices]
+    for i in order:
+        length = min(len(input_ids[i]), max_length)
+        for pack in packs:
+            if pack[0] >= length:
+                pack[0] -= length
+                pack[1].append(i)
+                break
+        else:
+            packs.append([max_length - length, [i]])
+
+    columns = {"input_ids": [], "segment_lengths": [], "labels": []}
+    for _, members in packs:
+        segments = [list(input_ids[i][:max_length]) for i in members]
+        columns["input_ids"].append([token for segment in segments for token in segment])
+        columns["segment_lengths"].append([len(segment) for segment in segments])
+        columns["labels"].append([int(labels[i]) for i in members])
+    return columns
+
+
+class PackedCollator:
+    """Collate packed sequences into input ids, position ids, a block-diagonal mask and per-question labels
+
+    Args:
+        pad_token_id: Token used to fill rows shorter than the batch
+        dtype: dtype of the additive attention mask (the model's dtype)
+        pad_to_multiple_of: Round the batch width up to a multiple of this
+    """
+
+    def __init__(self, pad_token_id, dtype=torch.float32, pad_to_multiple_of=8):
+        self.pad_token_id = pad_token_id
+        self.dtype = dtype
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features):
+        width = max(sum(feature["segment_lengths"]) for feature in features)
+        width = -(-width // self.pad_to_multiple_of) * self.pad_to_multiple_of
+        input_ids = torch.full((len(features), width), self.pad_token_id, dtype=torch.long)
+        position_ids = torch.zeros((len(features), width), dtype=torch.long)
+        # Padding is segment -1, which only attends to (causally earlier) padding
+        segment_ids = torch.full((len(features), width), -1, dtype=torch.long)
+        segment_ends = []
+        labels = []
+        for row, feature in enumerate(features):
+            start = 0
+            for segment, (length, label) in enumerate(zip(feature["segment_lengths"], feature["labels"])):
+                end = start + length
+                input_ids[row, start:end] = torch.as_tensor(feature["input_ids"][start:end])
+                position_ids[row, start:end] = torch.arange(length)
+                segment_ids[row, start:end] = segment
+                segment_ends.append((row, end - 1))
+                labels.append(label)
+                start = end
+
+        same_segment = segment_ids[:, :, None] == segment_ids[:, None, :]
+        causal = torch.ones((width, width), dtype=torch.bool).tril()
+        attention_mask = torch.zeros((len(features), 1, width, width), dtype=self.dtype)
+        attention_mask.masked_fill_(~(same_segment & causal)[:, None], torch.finfo(self.dtype).min)
+        return {
+            "input_ids": input_ids,
+            "position_ids": position_ids,
+            "attention_mask": attention_mask,
+            "segment_ends": torch.tensor(segment_ends, dtype=torch.long),
+            "labels": torch.tensor(labels, dtype=torch.long),
+        }
+
+
+def classifier_parts(model):
+    """(decoder backbone, classification head) of a possibly PEFT- or DDP-wrapped sequence classifier"""
+    model = getattr(model, "module", model)
+    classifier = model.get_base_model() if hasattr(model, "get_base_model") else model
+    return getattr(classifier, classifier.base_model_prefix), classifier.score
+
+
+def packed_logits(model, batch):
+    """Classification logits of every packed question, as a (num questions, num_labels) tensor"""
+    backbone, head = classifier_parts(model)
+    hidden = backbone(
+        input_ids=batch["input_ids"],
+        attention_mask=batch["attention_mask"],
+        position_ids=batch["position_ids"],
+        use_cache=False,
+    ).last_hidden_state
+    ends = batch["segment_ends"]
+    return head(hidden[ends[:, 0], ends[:, 1]])
+
+
+class PackedTrainer(Trainer):
+    """Trainer for PackedCollator batches, with one cross-entropy term per packed question"""
+
+    def compute_loss(self, model, inputs, return_outputs=False, num_items_in_batch=None):
+        logits = packed_logits(model, inputs)
+        loss = torch.nn.functional.cross_entropy(logits.float(), inputs["labels"])
+        return (loss, {"logits": logits}) if return_outputs else loss
+
+
+def _to_device(batch, device):
+    return {key: value.to(device) for key, value in batch.items()}
+
+
+def _time_batches(model, batches, loss_fn):
+    """Seconds spent on forward and backward passes over batches (the first one is a warmup)"""
+    device = next(model.parameters()).device
+    model.train()
+    elapsed = 0.0
+    for step, batch in enumerate(batches):
+        batch = _to_device(batch, device)
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        started = time.perf_counter()
+        loss_fn(batch).backward()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        if step > 0:
+            elapsed += time.perf_counter() - started
+        model.zero_grad(set_to_none=True)
+    return elapsed
+
+
+def compare_throughput(model, examples, unpacked_collator, packed_collator, batch_size, packed_length,
+                       packed_batch_size, num_samples=512):
+    """Training throughput on the same questions, unpacked (dynamic padding, length-grouped) vs packed
+
+    Times forward and backward passes without optimizer steps, so the model is unchanged.
+
+    Args:
+        examples: Tokenized dataset with "input_ids", "attention_mask" and "labels"
+        unpacked_collator: Collator of the regular training path (e.g. DataCollatorWithPadding)
+        packed_collator: PackedCollator
+
+    Returns:
+        {"unpacked": {...}, "packed": {...}, "speedup"}, each layout with questions per second
+        and the share of padding tokens
+    """
+    features = [examples[i] for i in range(min(num_samples, len(examples)))]
+    features = [{key: feature[key] for key in ("input_ids", "attention_mask", "labels")} for feature in features]
+
+    # Length grouping, as in training: similar lengths end up in the same batch
+    by_length = sorted(features, key=lambda feature: len(feature["input_ids"]))
+    unpacked = [unpacked_collator(by_length[i:i + batch_size]) for i in range(0, len(by_length), batch_size)]
+    columns = pack_examples([f["input_ids"] for f in features], [f["labels"] for f in features], packed_length)
+    rows = [dict(zip(columns, values)) for values in zip(*columns.values())]
+    packed = [packed_collator(rows[i:i + packed_batch_size]) for i in range(0, len(rows), packed_batch_size)]
+
+    def unpacked_loss(batch):
+        return model(**batch).loss
+
+    def packed_loss(batch):
+        return torch.nn.functional.cross_entropy(packed_logits(model, batch).float(), batch["labels"])
+
+    report = {}
+    for name, batches, loss_fn in (("unpacked", unpacked, unpacked_loss), ("packed", packed, packed_loss)):
+        seconds = _time_batches(model, batches, loss_fn)
+        # The first batch is a warmup and not timed
+        questions = sum(len(batch["labels"]) for batch in batches[1:])
+        slots = sum(batch["input_ids"].numel() for batch in batches)
+        tokens = sum(len(feature["input_ids"]) for feature in features)
+        report[name] = {
+            "batches": len(batches),
+            "questions_per_second": questions / seconds if seconds else None,
+            "padding_fraction": 1 - tokens / slots,
+        }
+    if report["unpacked"]["questions_per_second"] and report["packed"]["questions_per_second"]:
+        report["speedup"] = report["packed"]["questions_per_second"] / report["unpacked"]["questions_per_second"]
+    return report
@@ -1,16 +1,141 @@
+import time
+_process_started = time.perf_counter()
+
 import torch
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import sys
 import argparse
+import json
+import logging
+import os
+import random
+import threading
+import uuid
+from collections import OrderedDict
+
+from guard_logging import get_logger, lazy, setup_logging
+from guard_models import STAR_TREK_ID2LABEL, STAR_TREK_MAX_LENGTH, STAR_TREK_MODEL_PATH
+from model_loading import StartupTimer, fast_load_kwargs, resolve_file, resolve_snapshot
+
+startup_timer = StartupTimer(_process_started)
+startup_timer.record("imports", time.perf_counter() - _process_started)
 
 # ============================================================================
 # CONFIGURATION
 # ============================================================================
-MODEL_PATH = "geoffmunn/Qwen3Guard-StarTrek-Classification-0.6B"
-MAX_LENGTH = 512
-ID2LABEL = {0: "not_related", 1: "related"}
+MODEL_PATH = STAR_TREK_MODEL_PATH
+MAX_LENGTH = STAR_TREK_MAX_LENGTH
+ID2LABEL = STAR_TREK_ID2LABEL
+
+# Startup (see model_loading.py): models load from the local Hugging Face cache
+# without contacting the Hub, pinned to MODEL_REVISION (a commit hash) when set.
+# A model that is not cached yet is downloaded, unless OFFLINE is set.
+# STARTUP_WARMUP runs one message through the model before serving. The
+# startup log breaks the cold start down into imports, tokenizer, weights and warmup.
+MODEL_REVISION = None
+OFFLINE = False
+STARTUP_WARMUP = True
+
+# Inference backend:
+#   - "torch"        eager PyTorch via AutoModelForSequenceClassification
+#   - "onnxruntime"  ONNX Runtime CPU execution provider, using the graph that
+#                    export_onnx.py writes to ONNX_MODEL_DIR
+BACKEND = "torch"
+ONNX_MODEL_DIR = "./onnx/star_trek"
+
+# Multi-adapter serving: instead of a merged MODEL_PATH, load one base model
+# plus the LoRA adapter and classification head saved by each domain's
+# fine-tuning script. Requests pick a domain with a "domain" field, and
+# requests for different domains can share a batch. Enable by setting
+# ADAPTER_BASE_MODEL (or --base-model) to the model the adapters were trained from.
+ADAPTER_BASE_MODEL = None
+DOMAINS = {
+    "star_trek": {
+        "display_name": "Star Trek",
+        "adapter": "./finetuning/star_trek/star_trek_guard_finetuned",
+    },
+    "new_zealand": {
+        "display_name": "New Zealand",
+        "adapter": "./finetuning/new_zealand/new_zealand_guard_finetuned",
+    },
+}
+DEFAULT_DOMAIN = "star_trek"
+
+# Linear probe (see linear_probe.py): serve a frozen base model with a
+# classification head trained on its cached hidden states, instead of a
+# fine-tuned MODEL_PATH. The probe's domain becomes DEFAULT_DOMAIN.
+PROBE_DIR = None
+
+# Nearest-neighbour fast path (see neighbour_index.py): a message whose closest
+# question in the domain's labelled dataset has cosine similarity of at least
+# NEIGHBOUR_THRESHOLD gets that question's label without a model forward.
+# NEIGHBOUR_SHADOW_RATE of the hits still run through the model, to measure
+# how often the fast path agrees with it.
+NEIGHBOUR_INDEXES = {}  # {domain: index directory}, e.g. {"star_trek": "./indexes/star_trek"}
+NEIGHBOUR_THRESHOLD = 0.85
+NEIGHBOUR_SHADOW_RATE = 0.05
+
+# Distilled classifier tier (see distilled_classifier.py): a linear model over
+# hashed n-grams runs before the transformer, and its prediction is returned
+# when its confidence is at least DISTILLED_THRESHOLD. Less confident messages
+# are deferred to the transformer.
+DISTILLED_CLASSIFIERS = {}  # {domain: directory}, e.g. {"star_trek": "./distilled/star_trek"}
+DISTILLED_THRESHOLD = 0.9
+
+# Early exit (see early_exit.py): the fine-tuning scripts train extra heads on
+# intermediate layers. With early exit enabled, a forward pass stops at the
+# first of those layers where every row's confidence reaches
+# EARLY_EXIT_THRESHOLD. EARLY_EXIT_HEADS = None looks for the heads file next
+# to MODEL_PATH (local directory or Hugging Face Hub repo). Only models trained
+# locally with the fine-tuning scripts have heads: the published Hub model
+# ships no early_exit_heads.pt.
+EARLY_EXIT = False
+EARLY_EXIT_HEADS = None
+EARLY_EXIT_THRESHOLD = 0.95
+
+# Escalation: messages the served model classifies with a confidence below
+# ESCALATION_THRESHOLD are classified again by the larger ESCALATION_MODEL_PATH.
+# calibrate_escalation.py fits the threshold to a target accuracy on a held-out
+# split and writes ESCALATION_CALIBRATION, which overrides ESCALATION_THRESHOLD.
+# Only messages for ESCALATION_DOMAIN, the domain the escalation model was
+# trained on, are escalated (the calibration file's "domain" overrides it).
+ESCALATION = False
+ESCALATION_MODEL_PATH = "geoffmunn/Qwen3Guard-StarTrek-Classification-4B"
+ESCALATION_DOMAIN = "star_trek"
+ESCALATION_THRESHOLD = 0.9
+ESCALATION_CALIBRATION = "./escalation_calibration.json"
+
+# As-you-type classification (/api/moderate_incremental): a session keeps the
+# token ids and KV cache of the text it last classified. Each update re-tokenizes
+# the text, keeps the cache for the longest unchanged token prefix and only runs
+# the model over the tokens after it. Sessions idle for longer than
+# INCREMENTAL_SESSION_TTL_SECONDS are dropped, as are the least recently used
+# ones beyond INCREMENTAL_MAX_SESSIONS (each holds the KV cache of its text).
+INCREMENTAL_MAX_SESSIONS = 64
+INCREMENTAL_SESSION_TTL_SECONDS = 300
+
+# /api/moderate_batch: messages are sorted by token length and split into
+# buckets of at most BATCH_MAX_SIZE messages and BATCH_MAX_TOKENS padded tokens,
+# so each forward pass only pads to the longest message in its bucket.
+BATCH_MAX_SIZE = 64
+BATCH_MAX_TOKENS = 16384
+MAX_BATCH_MESSAGES = 10000
+
+# Dynamic batching for /api/moderate: concurrent single-message requests are
+# queued and run together. The wait window and batch size adapt so request
+# latency stays near DYNAMIC_BATCH_LATENCY_TARGET_MS (see dynamic_batching.py).
+DYNAMIC_BATCHING = False
+DYNAMIC_BATCH_LATENCY_TARGET_MS = 50
+DYNAMIC_BATCH_MAX_SIZE = 32
+DYNAMIC_BATCH_MAX_WAIT_MS = 10
+
+# Logging (see guard_logging.py). Per-request debug records (logits,
+# probabilities, label mapping) are only built for the sampled fraction of
+# requests, and only when LOG_LEVEL is DEBUG.
+LOG_LEVEL = "INFO"
+LOG_FORMAT = "text"
+LOG_SAMPLE_RATE = 0.01
 
 # ============================================================================
 
@@ -20,58 +145,226 @@ CORS(app, origins="*", allow_headers=["Content-Type", "Authorization"], methods=
 # Global variables for model and tokenizer
 model = None
 tokenizer = None
+model_backend = None
+batcher = None
+adapter_domains = None
+neighbour_indexes = {}
+neighbour_stats = {'queries': 0, 'hits': 0, 'shadow_checked': 0, 'shadow_agreed': 0}
+tier_stats_lock = threading.Lock()
+distilled_classifiers = {}
+distilled_stats = {'queries': 0, 'answered': 0}
+early_exit_runner = None
+escalation_model = None
+escalation_tokenizer = None
+escalation_stats = {'queries': 0, 'escalated': 0}
+incremental_sessions = OrderedDict()
+incremental_lock = threading.Lock()
+incremental_stats = {'requests': 0, 'reused_tokens': 0, 'encoded_tokens': 0}
 
-def load_model(force_download=False):
-    """Load the Qwen3Guard-StarTrek model and tokenizer
+logger = get_logger(__name__)
+
+def load_sequence_classifier(model_path, force_download=False, revision=None, **model_kwargs):
+    """Load a sequence classification model and its tokenizer for the available device
    
     Args:
-        force_download: If True, force re-download the model from Hugging Face Hub
+        model_kwargs: Extra from_pretrained arguments (e.g. num_labels for a base model)
+   
+    Returns:
+        (tokenizer, model)
     """
-    global model, tokenizer
-    if model is None or tokenizer is None:
-        if force_download:
-            print(f"⚠️  Force download enabled - refreshing {MODEL_PATH} from source...")
-        else:
-            print(f"Loading {MODEL_PATH} model...")
-       
-        tokenizer = AutoTokenizer.from_pretrained(
-            MODEL_PATH,
-            trust_remote_code=True,
-            force_download=force_download
-        )
-        if tokenizer.pad_token is None:
-            tokenizer.pad_token = tokenizer.eos_token
+    with startup_timer.phase("snapshot"):
+        model_dir = resolve_snapshot(model_path, revision, offline=OFFLINE, force_download=force_download)
+    with startup_timer.phase("tokenizer"):
+        classifier_tokenizer = AutoTokenizer.from_pretrained(model_dir, trust_remote_code=True)
+        if classifier_tokenizer.pad_token is None:
+            classifier_tokenizer.pad_token = classifier_tokenizer.eos_token
        
-        # Determine appropriate dtype based on device support
-        # Use float16 for GPU, float32 for CPU (more compatible than bfloat16)
+    # Determine appropriate dtype based on device support
+    # Use float16 for GPU, float32 for CPU (more compatible than bfloat16)
+    with startup_timer.phase("weights"):
         if torch.cuda.is_available():
             dtype = torch.float16
-            print("Using float16 precision (GPU)")
+            logger.info("Using float16 precision (GPU)")
             # Use auto device mapping for GPU
-            model = AutoModelForSequenceClassification.from_pretrained(
-                MODEL_PATH,
+            classifier = AutoModelForSequenceClassification.from_pretrained(
+                model_dir,
                 device_map="auto",
                 dtype=dtype,
                 trust_remote_code=True,
-                force_download=force_download,
+                **fast_load_kwargs(model_dir),
+                **model_kwargs,
             ).eval()
         else:
             dtype = torch.float32
-            print("Using float32 precision (CPU)")
-            # For CPU, avoid device_map="auto" to prevent offload issues
-            # Load on CPU directly
-            model = AutoModelForSequenceClassification.from_pretrained(
-                MODEL_PATH,
+            logger.info("Using float32 precision (CPU)")
+            # For CPU, avoid device_map="auto" to prevent offload issues.
+            # The weights are read straight from the memory-mapped checkpoint
+            # on the CPU, so there is no extra copy to move afterwards
+            classifier = AutoModelForSequenceClassification.from_pretrained(
+                model_dir,
                 dtype=dtype,
                 trust_remote_code=True,
-                force_download=force_download,
-            ).to('cpu').eval()
+                **fast_load_kwargs(model_dir),
+                **model_kwargs,
+            ).eval()
+    return classifier_tokenizer, classifier
+
+def load_model(force_download=False, backend=None):
+    """Load the Qwen3Guard-StarTrek model and tokenizer
+   
+    Args:
+        force_download: If True, force re-download the model from Hugging Face Hub
+        backend: "torch" or "onnxruntime" (defaults to BACKEND)
+    """
+    global model, tokenizer, model_backend
+    backend = backend or BACKEND
+    if (model is None or tokenizer is None) and backend == "onnxruntime":
+        from onnx_backend import OrtSequenceClassifier
+        logger.info("Loading ONNX Runtime model", model_dir=ONNX_MODEL_DIR)
+        with startup_timer.phase("tokenizer"):
+            tokenizer = AutoTokenizer.from_pretrained(ONNX_MODEL_DIR, trust_remote_code=True)
+            if tokenizer.pad_token is None:
+                tokenizer.pad_token = tokenizer.eos_token
+        with startup_timer.phase("weights"):
+            model = OrtSequenceClassifier(ONNX_MODEL_DIR)
+        model_backend = backend
+        logger.info("ONNX Runtime model loaded", source_model=model.config.name_or_path)
+    elif model is None or tokenizer is None:
+        if force_download:
+            logger.warning("Force download enabled - refreshing model from source", model=MODEL_PATH)
+        else:
+            logger.info("Loading model", model=MODEL_PATH, revision=MODEL_REVISION)
+       
+        tokenizer, model = load_sequence_classifier(MODEL_PATH, force_download, MODEL_REVISION)
+        model_backend = backend
        
-        print(f"Model {MODEL_PATH} loaded successfully!")
+        logger.info("Model loaded", model=MODEL_PATH, labels=getattr(model.config, 'id2label', None))
+
+def load_adapter_model(base_model=None, adapters=None):
+    """Load one base model plus a LoRA adapter and classification head per domain
+   
+    Args:
+        base_model: Model the adapters were fine-tuned from (defaults to ADAPTER_BASE_MODEL)
+        adapters: {domain: adapter directory or Hub id} (defaults to the DOMAINS adapters)
+    """
+    global model, tokenizer, model_backend, adapter_domains
+    base_model = base_model or ADAPTER_BASE_MODEL
+    adapters = adapters or {domain: spec['adapter'] for domain, spec in DOMAINS.items()}
+    tokenizer, model = load_adapter_classifier(base_model, adapters)
+    model_backend = "torch"
+    adapter_domains = list(adapters)
+
+def load_adapter_classifier(base_model, adapters):
+    """Load a base model with one LoRA adapter and classification head per domain
+   
+    Args:
+        base_model: Model the adapters were fine-tuned from
+        adapters: {adapter name: adapter directory or Hub id}
+   
+    Returns:
+        (tokenizer, PeftModel with every adapter loaded)
+    """
+    from peft import PeftModel
+    logger.info("Loading base model for adapters", model=base_model, domains=list(adapters))
+   
+    with startup_timer.phase("snapshot"):
+        base_dir = resolve_snapshot(base_model, offline=OFFLINE)
+        adapter_dirs = {domain: resolve_snapshot(path, offline=OFFLINE) for domain, path in adapters.items()}
+   
+    # Match the fine-tuning scripts, which pad with EOS
+    with startup_timer.phase("tokenizer"):
+        classifier_tokenizer = AutoTokenizer.from_pretrained(base_dir, trust_remote_code=True)
+        classifier_tokenizer.pad_token = classifier_tokenizer.eos_token
+   
+    dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+    with startup_timer.phase("weights"):
+        base = AutoModelForSequenceClassification.from_pretrained(
+            base_dir,
+            num_labels=len(ID2LABEL),
+            id2label=ID2LABEL,
+            label2id={label: i for i, label in ID2LABEL.items()},
+            dtype=dtype,
+            trust_remote_code=True,
+            **fast_load_kwargs(base_dir),
+        )
+        base.config.pad_token_id = classifier_tokenizer.pad_token_id
+        if torch.cuda.is_available():
+            base = base.to('cuda')
        
-        # Check model config for label mappings
-        if hasattr(model.config, 'id2label'):
-            print(f"Model labels: {model.config.id2label}")
+        peft_model = None
+        for domain, path in adapter_dirs.items():
+            if peft_model is None:
+                peft_model = PeftModel.from_pretrained(base, path, adapter_name=domain)
+            else:
+                peft_model.load_adapter(path, adapter_name=domain)
+            logger.info("Adapter loaded", domain=domain, adapter=adapters[domain])
+    return classifier_tokenizer, peft_model.eval()
+
+def load_probe_model(directory=None):
+    """Load the base model a linear probe was trained on, with the probe as its classification head"""
+    global model, tokenizer, model_backend, MODEL_PATH, DEFAULT_DOMAIN
+    from linear_probe import LinearProbe
+    directory = directory or PROBE_DIR
+    probe = LinearProbe.load(directory)
+    MODEL_PATH = probe.metadata['model']
+    DEFAULT_DOMAIN = probe.metadata['domain']
+    DOMAINS.setdefault(DEFAULT_DOMAIN, {'display_name': probe.metadata.get('display_name', DEFAULT_DOMAIN)})
+    logger.info("Loading base model for linear probe", model=MODEL_PATH, probe=directory, domain=DEFAULT_DOMAIN)
+   
+    tokenizer, model = load_sequence_classifier(
+        MODEL_PATH,
+        revision=MODEL_REVISION,
+        num_labels=len(ID2LABEL),
+        id2label=ID2LABEL,
+        label2id={label: i for i, label in ID2LABEL.items()},
+    )
+    # The probe was trained on the last non-padding token, which is where the head pools
+    model.config.pad_token_id = tokenizer.pad_token_id
+    with torch.no_grad():
+        model.score.weight.copy_(torch.from_numpy(probe.weight))
+    model_backend = "torch"
+    logger.info("Linear probe loaded", domain=DEFAULT_DOMAIN, evaluation=probe.metadata.get('evaluation'))
+
+def load_early_exit_heads(path=None, threshold=None):
+    """Hook early-exit heads into the loaded transformer"""
+    global early_exit_runner
+    from early_exit import HEADS_FILENAME, EarlyExitHeads, EarlyExitRunner
+    if model_backend != "torch" or adapter_domains is not None:
+        raise ValueError("Early exit needs the torch backend and a single merged model")
+    path = path or EARLY_EXIT_HEADS or resolve_file(MODEL_PATH, HEADS_FILENAME, MODEL_REVISION, offline=OFFLINE)
+    heads = EarlyExitHeads.load(path)
+    early_exit_runner = EarlyExitRunner(model, heads, EARLY_EXIT_THRESHOLD if threshold is None else threshold)
+    logger.info("Early-exit heads loaded", path=path, layers=heads.layers, threshold=early_exit_runner.threshold)
+
+def run_classifier(inputs, domains):
+    """Forward a tokenized batch, stopping early when early-exit heads are loaded
+    
+    Returns:
+        (logits, exit layer or None if every layer ran)
+    """
+    if early_exit_runner is not None:
+        return early_exit_runner(model, inputs, **adapter_kwargs(domains))
+    return model(**inputs, **adapter_kwargs(domains)).logits, None
+
+def warmup_model():
+    """Run one short message through the model so the first request doesn't pay for lazy initialisation"""
+    inputs = tokenizer(["Hello"], return_tensors="pt", padding=True)
+    inputs = {k: v.to(model.device) for k, v in inputs.items()}
+    with torch.no_grad():
+        model(**inputs, **adapter_kwargs(served_domains()[:1]))
+
+def served_domains():
+    """Domains that requests can ask for"""
+    return adapter_domains or [DEFAULT_DOMAIN]
+
+def unknown_domain_response(domain):
+    return jsonify({'error': f"Unknown domain {domain!r}, available: {served_domains()}"}), 400
+
+def adapter_kwargs(domains):
+    """Per-row adapter selection for a forward pass (nothing unless serving adapters)"""
+    if adapter_domains is None:
+        return {}
+    return {'adapter_names': list(domains)}
 
 @app.route('/api/moderate', methods=['POST', 'OPTIONS'])
 def moderate():
@@ -82,15 +375,17 @@ def moderate():
     try:
         data = request.json or {}
         message = data.get('message', '').strip()
+        domain = data.get('domain') or DEFAULT_DOMAIN
+        if domain not in served_domains():
+            return unknown_domain_response(domain)
        
         if not message:
-            return jsonify({
-                'risk_level': 'Safe',
-                'category': None,
-                'message': '',
-                'predicted_label': 'not_related',
-                'confidence': 0.0
-            }), 200
+            return jsonify(empty_message_response(domain)), 200
+       
+        if batcher is not None:
+            return jsonify(batcher.submit((message, domain)))
+        if neighbour_indexes or distilled_classifiers or escalation_model is not None:
+            return jsonify(classify_messages([message], [domain])[0][0])
        
         # Tokenize the input text
         inputs = tokenizer(
@@ -105,86 +400,492 @@ def moderate():
         # Get model prediction
         model.eval()
         with torch.no_grad():
-            outputs = model(**inputs)
-            logits = outputs.logits
-           
-            # DEBUG: Print raw model outputs
-            print(f"\n{'='*60}")
-            print(f"DEBUG: Moderation Request")
-            print(f"{'='*60}")
-            print(f"Input message: {repr(message)}")
-            print(f"Raw logits: {logits}")
-            print(f"Logits values: {logits.cpu().numpy().flatten()}")
-           
-            # Handle NaN manually (as shown in training code)
-            if torch.isnan(logits).any():
-                print(f"⚠️ NaN detected in logits for input: {message}")
-                predicted_class_id = 0
-                confidence = 0.0
-                probs = None
-            else:
-                probs = torch.nn.functional.softmax(logits, dim=-1)
-                predicted_class_id = probs.argmax().item()
-                confidence = probs.max().item()
-                print(f"Probabilities after softmax: {probs.cpu().numpy().flatten()}")
-                print(f"Predicted class ID: {predicted_class_id}")
-                print(f"Confidence: {confidence:.4f}")
-       
-        # Get predicted label - use class ID directly since model config has generic labels
-        # The model config has LABEL_0/LABEL_1, but we know from training:
-        # 0 = "not_related", 1 = "related"
-        if hasattr(model.config, 'id2label') and model.config.id2label:
-            print(f"Model config id2label: {model.config.id2label}")
-       
-        # Use our known label mapping based on class ID
-        predicted_label = ID2LABEL.get(predicted_class_id, "not_related")
-        print(f"Predicted label (from class ID {predicted_class_id}): {predicted_label}")
+            logits, exit_layer = run_classifier(inputs, [domain])
+            logits = logits[0]
        
-        # Map to risk level: "related" = Safe (Star Trek related), "not_related" = potentially unsafe
-        if predicted_label == "related":
-            risk_level = "Safe"
-            category = "Star Trek Related"
+        response = build_moderation_response(message, logits, domain)
+        if exit_layer is not None:
+            response['exit_layer'] = exit_layer
+        log = logger.for_request()
+        if log.is_enabled_for(logging.DEBUG):
+            log.debug(
+                "Moderation request",
+                message=message,
+                logits=lazy(lambda: logits.float().cpu().tolist()),
+                probabilities=response.get('probabilities'),
+                predicted_class_id=response['predicted_class_id'],
+                predicted_label=response['predicted_label'],
+                risk_level=response['risk_level'],
+                model_id2label=lazy(lambda: getattr(model.config, 'id2label', None))
+            )
+        return jsonify(response)
+   
+    except Exception as e:
+        logger.exception("Error in moderate endpoint")
+        return jsonify({'error': str(e)}), 500
+
+def label_verdict(predicted_label, domain):
+    """Map a predicted label to (risk_level, category) for a domain"""
+    display_name = DOMAINS.get(domain, {}).get('display_name', domain)
+    # "related" = Safe (on topic), "not_related" = potentially unsafe
+    if predicted_label == "related":
+        return "Safe", f"{display_name} Related"
+    return "Unsafe", f"Not {display_name} Related"
+
+def empty_message_response(domain=None):
+    """Build the /api/moderate response fields for an empty message, which is not classified"""
+    return {
+        'risk_level': 'Safe',
+        'category': None,
+        'message': '',
+        'predicted_label': 'not_related',
+        'confidence': 0.0,
+        'domain': domain or DEFAULT_DOMAIN
+    }
+
+def build_moderation_response(message, logits, domain=None):
+    """Build the /api/moderate response fields for one message from its logits row"""
+    domain = domain or DEFAULT_DOMAIN
+    if torch.isnan(logits).any():
+        logger.warning("NaN detected in logits", message=message)
+        predicted_class_id = 0
+        confidence = 0.0
+        probs = None
+    else:
+        probs = torch.nn.functional.softmax(logits.float(), dim=-1)
+        predicted_class_id = probs.argmax().item()
+        confidence = probs.max().item()
+    
+    predicted_label = ID2LABEL.get(predicted_class_id, "not_related")
+    risk_level, category = label_verdict(predicted_label, domain)
+    
+    response = {
+        'risk_level': risk_level,
+        'category': category,
+        'message': message,
+        'confidence': float(confidence),
+        'predicted_label': predicted_label,
+        'predicted_class_id': int(predicted_class_id),
+        'domain': domain
+    }
+    if probs is not None:
+        response['probabilities'] = probs.cpu().tolist()
+    if hasattr(model.config, 'id2label') and model.config.id2label:
+        response['model_id2label'] = model.config.id2label
+    return response
+
+def load_neighbour_indexes(indexes=None):
+    """Load the nearest-neighbour fast path index for each configured domain"""
+    global neighbour_indexes
+    from neighbour_index import NeighbourIndex
+    indexes = NEIGHBOUR_INDEXES if indexes is None else indexes
+    neighbour_indexes = {domain: NeighbourIndex.load(path) for domain, path in indexes.items()}
+    for domain, index in neighbour_indexes.items():
+        logger.info("Nearest-neighbour index loaded", domain=domain, size=len(index),
+                    dataset=index.metadata.get('dataset'))
+
+def neighbour_fast_path(messages, domains, indices):
+    """Answer messages that closely match a labelled dataset question
+    
+    Returns:
+        (responses for hits, {index: neighbour label id} for hits picked for shadow checking);
+        shadow-checked hits are left for the model to answer
+    """
+    hits = {}
+    shadows = {}
+    by_domain = {}
+    for i in indices:
+        if domains[i] in neighbour_indexes:
+            by_domain.setdefault(domains[i], []).append(i)
+    for domain, group in by_domain.items():
+        similarities, label_ids, neighbours = neighbour_indexes[domain].lookup([messages[i] for i in group])
+        for i, similarity, label_id, neighbour in zip(group, similarities, label_ids, neighbours):
+            if similarity < NEIGHBOUR_THRESHOLD:
+                continue
+            if random.random() < NEIGHBOUR_SHADOW_RATE:
+                shadows[i] = int(label_id)
+                continue
+            predicted_label = ID2LABEL[int(label_id)]
+            risk_level, category = label_verdict(predicted_label, domain)
+            hits[i] = {
+                'risk_level': risk_level,
+                'category': category,
+                'message': messages[i],
+                # Fast-path answers report the neighbour similarity as their confidence
+                'confidence': float(similarity),
+                'predicted_label': predicted_label,
+                'predicted_class_id': int(label_id),
+                'domain': domain,
+                'fast_path': {'tier': 'neighbour', 'neighbour': neighbour, 'similarity': float(similarity)}
+            }
+    with tier_stats_lock:
+        neighbour_stats['queries'] += sum(len(group) for group in by_domain.values())
+        neighbour_stats['hits'] += len(hits) + len(shadows)
+    return hits, shadows
+
+def load_distilled_classifiers(classifiers=None):
+    """Load the distilled classifier tier for each configured domain"""
+    global distilled_classifiers
+    from distilled_classifier import DistilledClassifier
+    classifiers = DISTILLED_CLASSIFIERS if classifiers is None else classifiers
+    distilled_classifiers = {domain: DistilledClassifier.load(path) for domain, path in classifiers.items()}
+    for domain, classifier in distilled_classifiers.items():
+        logger.info("Distilled classifier loaded", domain=domain, teacher=classifier.metadata.get('teacher'))
+
+def distilled_tier(messages, domains, indices):
+    """Answer the messages the distilled classifier is confident about
+    
+    Returns:
+        {index: response} for the messages it answered
+    """
+    answered = {}
+    by_domain = {}
+    for i in indices:
+        if domains[i] in distilled_classifiers:
+            by_domain.setdefault(domains[i], []).append(i)
+    for domain, group in by_domain.items():
+        probabilities = distilled_classifiers[domain].predict_proba([messages[i] for i in group])
+        for i, probs in zip(group, probabilities):
+            if probs.max() < DISTILLED_THRESHOLD:
+                continue
+            response = build_moderation_response(messages[i], torch.from_numpy(probs).log(), domain)
+            response['fast_path'] = {'tier': 'distilled'}
+            answered[i] = response
+    with tier_stats_lock:
+        distilled_stats['queries'] += sum(len(group) for group in by_domain.values())
+        distilled_stats['answered'] += len(answered)
+    return answered
+
+def fast_path_stats():
+    """Hit rates of the tiers in front of the model, and the neighbour tier's agreement with it"""
+    with tier_stats_lock:
+        neighbour = dict(neighbour_stats)
+        distilled = dict(distilled_stats)
+    neighbour['domains'] = list(neighbour_indexes)
+    neighbour['threshold'] = NEIGHBOUR_THRESHOLD
+    neighbour['hit_rate'] = neighbour['hits'] / neighbour['queries'] if neighbour['queries'] else None
+    neighbour['agreement'] = neighbour['shadow_agreed'] / neighbour['shadow_checked'] if neighbour['shadow_checked'] else None
+    distilled['domains'] = list(distilled_classifiers)
+    distilled['threshold'] = DISTILLED_THRESHOLD
+    distilled['answer_rate'] = distilled['answered'] / distilled['queries'] if distilled['queries'] else None
+    return {'neighbour': neighbour, 'distilled': distilled}
+
+def length_buckets(lengths, max_size=None, max_tokens=None):
+    """Group indices into buckets of similar length
+    
+    Indices are sorted by length, then cut into consecutive runs holding at most
+    max_size items and at most max_tokens tokens once padded to the longest item.
+    """
+    max_size = max_size or BATCH_MAX_SIZE
+    max_tokens = max_tokens or BATCH_MAX_TOKENS
+    buckets = []
+    current = []
+    for index in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        # Sorted ascending, so this item is the longest in the bucket so far
+        if current and (len(current) >= max_size or (len(current) + 1) * lengths[index] > max_tokens):
+            buckets.append(current)
+            current = []
+        current.append(index)
+    if current:
+        buckets.append(current)
+    return buckets
+
+def padded_buckets(classifier_tokenizer, texts, device):
+    """Tokenize texts once and yield (positions in texts, padded inputs) per length bucket"""
+    encoded = classifier_tokenizer(
+        texts,
+        truncation=True,
+        max_length=MAX_LENGTH
+    )
+    lengths = [len(ids) for ids in encoded['input_ids']]
+    for bucket in length_buckets(lengths):
+        features = [{k: encoded[k][j] for k in encoded.keys()} for j in bucket]
+        inputs = classifier_tokenizer.pad(features, padding=True, return_tensors="pt")
+        yield bucket, {k: v.to(device) for k, v in inputs.items()}
+
+def load_escalation_model(model_path=None, calibration=None):
+    """Load the larger model that low-confidence messages escalate to
+    
+    Args:
+        model_path: Escalation model (defaults to ESCALATION_MODEL_PATH)
+        calibration: JSON written by calibrate_escalation.py; its threshold replaces ESCALATION_THRESHOLD
+    """
+    global escalation_model, escalation_tokenizer, ESCALATION_MODEL_PATH, ESCALATION_THRESHOLD, ESCALATION_DOMAIN
+    model_path = model_path or ESCALATION_MODEL_PATH
+    calibration = calibration or ESCALATION_CALIBRATION
+    if calibration and os.path.exists(calibration):
+        with open(calibration) as f:
+            fitted = json.load(f)
+        ESCALATION_THRESHOLD = fitted['threshold']
+        ESCALATION_DOMAIN = fitted.get('domain', ESCALATION_DOMAIN)
+        logger.info("Escalation threshold calibrated", threshold=ESCALATION_THRESHOLD,
+                    target_accuracy=fitted.get('target_accuracy'), escalation_rate=fitted.get('escalation_rate'))
+    logger.info("Loading escalation model", model=model_path, threshold=ESCALATION_THRESHOLD, domain=ESCALATION_DOMAIN)
+    escalation_tokenizer, escalation_model = load_sequence_classifier(model_path)
+    ESCALATION_MODEL_PATH = model_path
+
+def escalate_messages(messages, indices, results):
+    """Replace the results of low-confidence messages with the escalation model's verdicts"""
+    with torch.no_grad():
+        texts = [messages[i] for i in indices]
+        for bucket, inputs in padded_buckets(escalation_tokenizer, texts, escalation_model.device):
+            logits = escalation_model(**inputs).logits
+            for row, j in enumerate(bucket):
+                index = indices[j]
+                response = build_moderation_response(messages[index], logits[row], DEFAULT_DOMAIN)
+                response['model_id2label'] = escalation_model.config.id2label
+                response['escalated'] = True
+                response['first_tier_confidence'] = results[index]['confidence']
+                results[index] = response
+
+def classify_messages(messages, domains=None):
+    """Classify many messages with one padded forward pass per length bucket
+    
+    When serving adapters, messages for different domains share buckets and
+    each row runs through its own domain's adapter. Messages answered by the
+    nearest-neighbour fast path or a confident distilled classifier skip the
+    model, and low-confidence verdicts are escalated to the larger model when
+    one is loaded.
+    
+    Returns:
+        (results in input order, number of buckets run)
+    """
+    domains = domains or [DEFAULT_DOMAIN] * len(messages)
+    results = [None] * len(messages)
+    pending = []
+    for i, message in enumerate(messages):
+        if message:
+            pending.append(i)
         else:
-            risk_level = "Unsafe"
-            category = "Not Star Trek Related"
-       
-        print(f"Final risk_level: {risk_level}")
-        print(f"Final category: {category}")
-        print(f"{'='*60}\n")
-       
-        # Build response with debug info
-        response = {
-            'risk_level': risk_level,
-            'category': category,
-            'message': message,
-            'confidence': float(confidence),
-            'predicted_label': predicted_label,
-            'predicted_class_id': int(predicted_class_id)
-        }
-       
-        # Add debug info if available
-        if probs is not None:
-            response['probabilities'] = probs.cpu().numpy().flatten().tolist()
-        if hasattr(model.config, 'id2label') and model.config.id2label:
-            response['model_id2label'] = model.config.id2label
-       
+            results[i] = empty_message_response(domains[i])
+    shadows = {}
+    if neighbour_indexes:
+        hits, shadows = neighbour_fast_path(messages, domains, pending)
+        for i, response in hits.items():
+            results[i] = response
+        pending = [i for i in pending if i not in hits]
+    if distilled_classifiers:
+        answered = distilled_tier(messages, domains, [i for i in pending if i not in shadows])
+        for i, response in answered.items():
+            results[i] = response
+        pending = [i for i in pending if i not in answered]
+    if not pending:
+        return results, 0
+    
+    num_buckets = 0
+    model.eval()
+    with torch.no_grad():
+        for bucket, inputs in padded_buckets(tokenizer, [messages[i] for i in pending], model.device):
+            num_buckets += 1
+            logits, exit_layer = run_classifier(inputs, [domains[pending[j]] for j in bucket])
+            for row, j in enumerate(bucket):
+                index = pending[j]
+                results[index] = build_moderation_response(messages[index], logits[row], domains[index])
+                if exit_layer is not None:
+                    results[index]['exit_layer'] = exit_layer
+    if escalation_model is not None:
+        candidates = [i for i in pending if domains[i] == ESCALATION_DOMAIN]
+        escalate = [i for i in candidates if results[i]['confidence'] < ESCALATION_THRESHOLD]
+        if escalate:
+            escalate_messages(messages, escalate, results)
+        with tier_stats_lock:
+            escalation_stats['queries'] += len(candidates)
+            escalation_stats['escalated'] += len(escalate)
+    if shadows:
+        agreed = sum(results[i]['predicted_class_id'] == label_id for i, label_id in shadows.items())
+        with tier_stats_lock:
+            neighbour_stats['shadow_checked'] += len(shadows)
+            neighbour_stats['shadow_agreed'] += agreed
+    return results, num_buckets
+
+def start_batcher(latency_target_ms=None, max_batch_size=None, max_wait_ms=None):
+    """Route /api/moderate through an adaptive dynamic batching queue"""
+    global batcher
+    from dynamic_batching import AdaptiveBatcher
+    batcher = AdaptiveBatcher(
+        lambda items: classify_messages([m for m, _ in items], [d for _, d in items])[0],
+        latency_target_ms=latency_target_ms or DYNAMIC_BATCH_LATENCY_TARGET_MS,
+        max_batch_size=max_batch_size or DYNAMIC_BATCH_MAX_SIZE,
+        max_wait_ms=max_wait_ms if max_wait_ms is not None else DYNAMIC_BATCH_MAX_WAIT_MS,
+    )
+    return batcher
+
+@app.route('/api/moderate_batch', methods=['POST', 'OPTIONS'])
+def moderate_batch():
+    """Moderate many messages in one request, batched by token length"""
+    if request.method == 'OPTIONS':
+        return jsonify({}), 200
+   
+    try:
+        data = request.json or {}
+        messages = data.get('messages', [])
+        if not isinstance(messages, list) or not all(isinstance(m, str) for m in messages):
+            return jsonify({'error': 'messages must be a list of strings'}), 400
+        if len(messages) > MAX_BATCH_MESSAGES:
+            return jsonify({'error': f'At most {MAX_BATCH_MESSAGES} messages per request'}), 400
+        # Either one "domain" for every message or a parallel "domains" list
+        domains = data.get('domains') or [data.get('domain') or DEFAULT_DOMAIN] * len(messages)
+        if (not isinstance(domains, list) or len(domains) != len(messages)
+                or not all(isinstance(d, str) for d in domains)):
+            return jsonify({'error': 'domains must be a list of strings with one domain per message'}), 400
+        for domain in set(domains):
+            if domain not in served_domains():
+                return unknown_domain_response(domain)
+        
+        results, num_buckets = classify_messages([m.strip() for m in messages], domains)
+        return jsonify({
+            'results': results,
+            'count': len(results),
+            'buckets': num_buckets
+        })
+   
+    except Exception as e:
+        logger.exception("Error in moderate_batch endpoint")
+        return jsonify({'error': str(e)}), 500
+
+def incremental_session(session_id, domain):
+    """Return (session_id, session), starting a fresh session for a new, expired or re-domained id"""
+    now = time.monotonic()
+    with incremental_lock:
+        # Sessions are kept in least recently used order, so expired ones are at the front
+        while incremental_sessions:
+            oldest = next(iter(incremental_sessions.values()))
+            if now - oldest['last_used'] <= INCREMENTAL_SESSION_TTL_SECONDS:
+                break
+            incremental_sessions.popitem(last=False)
+        session_id = session_id or uuid.uuid4().hex
+        session = incremental_sessions.get(session_id)
+        if session is None or session['domain'] != domain:
+            # The cached keys and values depend on the domain's adapter
+            session = {'domain': domain, 'token_ids': [], 'cache': None, 'lock': threading.Lock()}
+            incremental_sessions[session_id] = session
+        incremental_sessions.move_to_end(session_id)
+        session['last_used'] = now
+        while len(incremental_sessions) > INCREMENTAL_MAX_SESSIONS:
+            incremental_sessions.popitem(last=False)
+    return session_id, session
+
+def classify_incremental(session, message):
+    """Classify a session's updated text, reusing the KV cache of its unchanged token prefix
+    
+    Returns:
+        (logits row, tokens reused from the cache, tokens encoded)
+    """
+    token_ids = tokenizer(message, truncation=True, max_length=MAX_LENGTH)['input_ids']
+    cached_ids = session['token_ids']
+    common = 0
+    for cached_id, token_id in zip(cached_ids, token_ids):
+        if cached_id != token_id:
+            break
+        common += 1
+    # The last token always runs, since its hidden state gives the logits
+    common = min(common, len(token_ids) - 1)
+    cache = session['cache'] if common > 0 else None
+    try:
+        if cache is not None and common < len(cached_ids):
+            cache.crop(common - len(cached_ids))
+        
+        with torch.no_grad():
+            outputs = model(
+                input_ids=torch.tensor([token_ids[common:]], device=model.device),
+                attention_mask=torch.ones((1, len(token_ids)), dtype=torch.long, device=model.device),
+                past_key_values=cache,
+                use_cache=True,
+                **adapter_kwargs([session['domain']])
+            )
+    except Exception:
+        # The cache is cropped or extended in place, so it no longer matches the
+        # session's token ids; start the session over rather than reuse it
+        session['cache'] = None
+        session['token_ids'] = []
+        raise
+    session['token_ids'] = token_ids
+    session['cache'] = outputs.past_key_values
+    with incremental_lock:
+        incremental_stats['requests'] += 1
+        incremental_stats['reused_tokens'] += common
+        incremental_stats['encoded_tokens'] += len(token_ids) - common
+    return outputs.logits[0], common, len(token_ids) - common
+
+@app.route('/api/moderate_incremental', methods=['POST', 'OPTIONS'])
+def moderate_incremental():
+    """Re-classify a message as it is typed, only encoding the tokens that changed since the last call"""
+    if request.method == 'OPTIONS':
+        return jsonify({}), 200
+   
+    try:
+        if model_backend != 'torch':
+            return jsonify({'error': 'Incremental classification needs the torch backend'}), 400
+        data = request.json or {}
+        message = data.get('message', '').strip()
+        domain = data.get('domain') or DEFAULT_DOMAIN
+        session_id = data.get('session_id')
+        if domain not in served_domains():
+            return unknown_domain_response(domain)
+        if session_id is not None and not isinstance(session_id, str):
+            return jsonify({'error': 'session_id must be a string'}), 400
+        
+        session_id, session = incremental_session(session_id, domain)
+        if not message:
+            return jsonify({**empty_message_response(domain), 'session_id': session_id}), 200
+        
+        # Updates to one session are applied in order, since each builds on the last cache
+        with session['lock']:
+            logits, reused_tokens, encoded_tokens = classify_incremental(session, message)
+        response = build_moderation_response(message, logits, domain)
+        response['session_id'] = session_id
+        response['reused_tokens'] = reused_tokens
+        response['encoded_tokens'] = encoded_tokens
         return jsonify(response)
    
     except Exception as e:
-        print(f"Error in moderate endpoint: {e}", file=sys.stderr)
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in moderate_incremental endpoint")
         return jsonify({'error': str(e)}), 500
 
+def incremental_health():
+    """Open as-you-type sessions and how much of their text came from the KV cache"""
+    with incremental_lock:
+        stats = dict(incremental_stats)
+        stats['sessions'] = len(incremental_sessions)
+    total = stats['reused_tokens'] + stats['encoded_tokens']
+    stats['reuse_rate'] = stats['reused_tokens'] / total if total else None
+    return stats
+
+def escalation_health():
+    """Escalation model, threshold and the share of messages escalated"""
+    if escalation_model is None:
+        return None
+    with tier_stats_lock:
+        stats = dict(escalation_stats)
+    stats['model'] = ESCALATION_MODEL_PATH
+    stats['threshold'] = ESCALATION_THRESHOLD
+    stats['domain'] = ESCALATION_DOMAIN
+    stats['escalation_rate'] = stats['escalated'] / stats['queries'] if stats['queries'] else None
+    return stats
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
         'model_loaded': model is not None,
-        'model_name': MODEL_PATH if model is not None else None
+        'model_name': MODEL_PATH if model is not None else None,
+        'backend': model_backend,
+        'domains': served_domains(),
+        'fast_path': fast_path_stats(),
+        'early_exit': early_exit_runner.stats() if early_exit_runner is not None else None,
+        'escalation': escalation_health(),
+        'incremental': incremental_health(),
+        'dynamic_batching': batcher is not None
     })
 
+@app.route('/api/batching_stats', methods=['GET'])
+def batching_stats():
+    """Batch-size and wait-time distributions of the dynamic batching queue"""
+    if batcher is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **batcher.stats()})
+
 @app.route('/', methods=['GET'])
 def index():
     """API information endpoint"""
@@ -193,6 +894,9 @@ def index():
         'version': '2.0',
         'endpoints': {
             '/api/moderate': 'POST - Moderate a single user message',
+            '/api/moderate_batch': 'POST - Moderate a list of messages in length-bucketed batches',
+            '/api/moderate_incremental': 'POST - Re-moderate a message as it is typed, reusing the KV cache of a session',
+            '/api/batching_stats': 'GET - Dynamic batching queue statistics',
             '/health': 'GET - Health check'
         },
         'model': MODEL_PATH
@@ -206,6 +910,16 @@ if __name__ == '__main__':
 Examples:
   python star_trek_api_server.py                    # Start server with cached model
   python star_trek_api_server.py --force-download    # Refresh model from Hugging Face Hub
+  python star_trek_api_server.py --offline --revision <commit>  # Pinned cached snapshot, no network
+  python star_trek_api_server.py --backend onnxruntime  # Serve the graph exported by export_onnx.py
+  python star_trek_api_server.py --dynamic-batching --latency-target-ms 30  # Batch concurrent requests
+  python star_trek_api_server.py --base-model Qwen/Qwen3-4B  # One base model plus every DOMAINS adapter
+  python star_trek_api_server.py --probe ./probes/new_zealand  # Base model with a linear_probe.py head
+  python star_trek_api_server.py --base-model Qwen/Qwen3-4B --adapter star_trek=./star_trek_guard_finetuned
+  python star_trek_api_server.py --neighbour-index star_trek=./indexes/star_trek  # Nearest-neighbour fast path
+  python star_trek_api_server.py --distilled star_trek=./distilled/star_trek  # Distilled classifier tier
+  python star_trek_api_server.py --early-exit --early-exit-threshold 0.97  # Stop at confident intermediate layers
+  python star_trek_api_server.py --escalate  # Send low-confidence messages to the 4B model
         """
     )
     parser.add_argument(
@@ -213,6 +927,23 @@ Examples:
         action='store_true',
         help='Force re-download the model from Hugging Face Hub (refreshes cache)'
     )
+    parser.add_argument(
+        '--revision',
+        type=str,
+        default=MODEL_REVISION,
+        help='Model revision (commit hash, branch or tag) to load (default: the cached main)'
+    )
+    parser.add_argument(
+        '--offline',
+        action='store_true',
+        default=OFFLINE,
+        help='Only load models from the local cache; fail instead of downloading'
+    )
+    parser.add_argument(
+        '--no-warmup',
+        action='store_true',
+        help='Skip the warmup forward pass before serving'
+    )
     parser.add_argument(
         '--port',
         type=int,
@@ -225,13 +956,211 @@ Examples:
         default='0.0.0.0',
         help='Host to bind the server to (default: 0.0.0.0)'
     )
+    parser.add_argument(
+        '--backend',
+        choices=['torch', 'onnxruntime'],
+        default=BACKEND,
+        help=f'Inference backend (default: {BACKEND}). onnxruntime needs export_onnx.py to have been run'
+    )
+    parser.add_argument(
+        '--onnx-model-dir',
+        type=str,
+        default=ONNX_MODEL_DIR,
+        help=f'Directory written by export_onnx.py (default: {ONNX_MODEL_DIR})'
+    )
+    parser.add_argument(
+        '--base-model',
+        type=str,
+        default=ADAPTER_BASE_MODEL,
+        help='Serve LoRA adapters over this base model instead of the merged MODEL_PATH'
+    )
+    parser.add_argument(
+        '--adapter',
+        action='append',
+        default=[],
+        metavar='DOMAIN=PATH',
+        help='Adapter to serve for a domain (repeatable; default: every adapter in DOMAINS)'
+    )
+    parser.add_argument(
+        '--probe',
+        type=str,
+        default=PROBE_DIR,
+        help='Serve the base model with a head trained by linear_probe.py instead of MODEL_PATH'
+    )
+    parser.add_argument(
+        '--neighbour-index',
+        action='append',
+        default=[],
+        metavar='DOMAIN=DIR',
+        help='Nearest-neighbour index built by neighbour_index.py for a domain (repeatable)'
+    )
+    parser.add_argument(
+        '--neighbour-threshold',
+        type=float,
+        default=NEIGHBOUR_THRESHOLD,
+        help=f'Minimum similarity for a fast-path answer (default: {NEIGHBOUR_THRESHOLD})'
+    )
+    parser.add_argument(
+        '--distilled',
+        action='append',
+        default=[],
+        metavar='DOMAIN=DIR',
+        help='Distilled classifier trained by distilled_classifier.py for a domain (repeatable)'
+    )
+    parser.add_argument(
+        '--distilled-threshold',
+        type=float,
+        default=DISTILLED_THRESHOLD,
+        help=f'Minimum distilled classifier confidence before deferring to the transformer (default: {DISTILLED_THRESHOLD})'
+    )
+    parser.add_argument(
+        '--early-exit',
+        action='store_true',
+        default=EARLY_EXIT,
+        help='Stop the forward pass at the first confident early-exit head (torch backend; heads come from a local fine-tuning run)'
+    )
+    parser.add_argument(
+        '--early-exit-heads',
+        type=str,
+        default=EARLY_EXIT_HEADS,
+        help='Heads file written by the fine-tuning scripts (default: early_exit_heads.pt next to the model)'
+    )
+    parser.add_argument(
+        '--early-exit-threshold',
+        type=float,
+        default=EARLY_EXIT_THRESHOLD,
+        help=f'Minimum head confidence to exit early (default: {EARLY_EXIT_THRESHOLD})'
+    )
+    parser.add_argument(
+        '--escalate',
+        action='store_true',
+        default=ESCALATION,
+        help='Re-classify low-confidence messages with the larger escalation model'
+    )
+    parser.add_argument(
+        '--escalation-model',
+        type=str,
+        default=ESCALATION_MODEL_PATH,
+        help=f'Escalation model (default: {ESCALATION_MODEL_PATH})'
+    )
+    parser.add_argument(
+        '--escalation-calibration',
+        type=str,
+        default=ESCALATION_CALIBRATION,
+        help=f'Threshold file written by calibrate_escalation.py (default: {ESCALATION_CALIBRATION})'
+    )
+    parser.add_argument(
+        '--escalation-threshold',
+        type=float,
+        default=None,
+        help=f'Escalate below this confidence, overriding any calibration file (default: {ESCALATION_THRESHOLD})'
+    )
+    parser.add_argument(
+        '--log-level',
+        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+        default=LOG_LEVEL,
+        help=f'Minimum log level (default: {LOG_LEVEL})'
+    )
+    parser.add_argument(
+        '--log-format',
+        choices=['text', 'json'],
+        default=LOG_FORMAT,
+        help=f'Log output format (default: {LOG_FORMAT})'
+    )
+    parser.add_argument(
+        '--log-sample-rate',
+        type=float,
+        default=LOG_SAMPLE_RATE,
+        help=f'Fraction of requests whose debug records are logged (default: {LOG_SAMPLE_RATE})'
+    )
+    parser.add_argument(
+        '--dynamic-batching',
+        action='store_true',
+        default=DYNAMIC_BATCHING,
+        help='Batch concurrent /api/moderate requests through an adaptive queue'
+    )
+    parser.add_argument(
+        '--latency-target-ms',
+        type=float,
+        default=DYNAMIC_BATCH_LATENCY_TARGET_MS,
+        help=f'Dynamic batching latency target in ms (default: {DYNAMIC_BATCH_LATENCY_TARGET_MS})'
+    )
+    parser.add_argument(
+        '--max-batch-size',
+        type=int,
+        default=DYNAMIC_BATCH_MAX_SIZE,
+        help=f'Dynamic batching maximum batch size (default: {DYNAMIC_BATCH_MAX_SIZE})'
+    )
+    parser.add_argument(
+        '--max-wait-ms',
+        type=float,
+        default=DYNAMIC_BATCH_MAX_WAIT_MS,
+        help=f'Dynamic batching maximum wait window in ms (default: {DYNAMIC_BATCH_MAX_WAIT_MS})'
+    )
    
     args = parser.parse_args()
    
-    print(f"Initializing Qwen3Guard-StarTrek API Server (Model: {MODEL_PATH})...")
-    load_model(force_download=args.force_download)
-    print(f"Starting server on http://{args.host}:{args.port}")
-    print("API endpoints:")
-    print("  - POST /api/moderate - Moderate a single message")
-    print("  - GET /health - Health check")
+    setup_logging(args.log_level, args.log_format, args.log_sample_rate)
+    logger.info("Initializing Qwen3Guard-StarTrek API Server", model=MODEL_PATH)
+    ONNX_MODEL_DIR = args.onnx_model_dir
+    MODEL_REVISION = args.revision
+    OFFLINE = args.offline
+    if args.early_exit and args.backend == 'onnxruntime':
+        parser.error('--early-exit needs the torch backend, not --backend onnxruntime')
+    if args.early_exit and args.base_model:
+        parser.error('--early-exit cannot be combined with --base-model adapters')
+    if args.probe:
+        if args.base_model or args.adapter:
+            parser.error('--probe cannot be combined with --base-model or --adapter')
+        load_probe_model(args.probe)
+    elif args.base_model:
+        adapters = {}
+        for spec in args.adapter:
+            domain, sep, path = spec.partition('=')
+            if not sep:
+                parser.error(f'--adapter expects DOMAIN=PATH, got {spec!r}')
+            adapters[domain] = path
+        load_adapter_model(args.base_model, adapters or None)
+    elif args.adapter:
+        parser.error('--adapter needs --base-model')
+    else:
+        load_model(force_download=args.force_download, backend=args.backend)
+    NEIGHBOUR_THRESHOLD = args.neighbour_threshold
+    indexes = dict(NEIGHBOUR_INDEXES)
+    for spec in args.neighbour_index:
+        domain, sep, path = spec.partition('=')
+        if not sep:
+            parser.error(f'--neighbour-index expects DOMAIN=DIR, got {spec!r}')
+        indexes[domain] = path
+    if indexes:
+        load_neighbour_indexes(indexes)
+    if args.early_exit:
+        try:
+            load_early_exit_heads(args.early_exit_heads, args.early_exit_threshold)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.escalate:
+        load_escalation_model(args.escalation_model, args.escalation_calibration)
+        if args.escalation_threshold is not None:
+            ESCALATION_THRESHOLD = args.escalation_threshold
+    DISTILLED_THRESHOLD = args.distilled_threshold
+    classifiers = dict(DISTILLED_CLASSIFIERS)
+    for spec in args.distilled:
+        domain, sep, path = spec.partition('=')
+        if not sep:
+            parser.error(f'--distilled expects DOMAIN=DIR, got {spec!r}')
+        classifiers[domain] = path
+    if classifiers:
+        load_distilled_classifiers(classifiers)
+    if STARTUP_WARMUP and not args.no_warmup:
+        with startup_timer.phase("warmup"):
+            warmup_model()
+    startup_timer.report(model=MODEL_PATH, backend=model_backend, offline=OFFLINE)
+    if args.dynamic_batching:
+        start_batcher(args.latency_target_ms, args.max_batch_size, args.max_wait_ms)
+        logger.info("Dynamic batching enabled", latency_target_ms=args.latency_target_ms,
+                    max_batch_size=args.max_batch_size)
+    logger.info("Starting server", url=f"http://{args.host}:{args.port}")
+    logger.info("API endpoints: POST /api/moderate, POST /api/moderate_batch, POST /api/moderate_incremental, "
+                "GET /api/batching_stats, GET /health")
     app.run(host=args.host, port=args.port, debug=False)
\ No newline at end of file
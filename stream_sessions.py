@@ -0,0 +1,324 @@
+"""
+Stream-state tracking for the Qwen3Guard-Stream model.
+
+Every call to `model.stream_moderate_from_ids` returns a `stream_state` that
+holds the KV cache of the conversation so far. If it is never passed to
+`model.close_stream` (an exception half way through, a client that disconnects
+mid-stream) the cache stays in memory. `StreamStateRegistry` owns every open
+state, closes it when its `StreamSession` is closed, leaves a `with` block or
+is garbage collected, and refuses new streams once a global cap is reached.
+
+With a window size set, each session keeps a bounded context: the user turn,
+the assistant turn header and the most recent assistant tokens. Once the
+assistant part outgrows the window by `window_slack` tokens the state is
+rebuilt from the user turn, the header and the last `window_tokens` assistant
+tokens, so per-token latency and memory stay flat however long the response
+gets.
+"""
+
+import contextlib
+import threading
+import time
+import uuid
+import weakref
+
+import torch
+
+from guard_logging import get_logger
+
+STEP_MODES = ("eager", "inference", "compiled")
+
+logger = get_logger(__name__)
+
+
+class StreamCapacityError(RuntimeError):
+    """Raised when a new stream would exceed the registry's stream or memory cap"""
+
+
+def compile_stream_model(model, mode=None):
+    """Compile the Stream model's forward for the incremental single-token step
+
+    `stream_moderate_from_ids` calls the module's forward once per step. The KV
+    cache grows by one token every step, so the graph is compiled with dynamic
+    shapes to avoid a recompile per sequence length.
+
+    This is not a static-cache step. A preallocated StaticCache with a captured
+    graph for the fixed single-token shape would need the step to be driven
+    outside `stream_moderate_from_ids`. That function belongs to the model's
+    remote code: it owns the cache layout and the per-token risk and category
+    post-processing. So "compiled" only gets the kernel fusion torch.compile
+    finds for the forward, not the removal of per-token launch overhead.
+
+    Args:
+        model: The loaded Qwen3Guard-Stream model
+        mode: Optional torch.compile mode, e.g. "max-autotune-no-cudagraphs"
+    """
+    model.forward = torch.compile(model.forward, dynamic=True, mode=mode)
+    return model
+
+
+def estimate_state_bytes(state):
+    """Estimate the memory held by a stream state by summing its tensors
+
+    Walks dicts, lists, tuples and object attributes (e.g. transformers Cache
+    objects) and counts each underlying tensor storage once.
+    """
+    seen_objects = set()
+    seen_storages = set()
+    total = 0
+    stack = [state]
+    while stack:
+        obj = stack.pop()
+        if obj is None or isinstance(obj, (str, bytes, int, float, bool)):
+            continue
+        if id(obj) in seen_objects:
+            continue
+        seen_objects.add(id(obj))
+        if isinstance(obj, torch.Tensor):
+            storage = obj.untyped_storage()
+            key = (storage.data_ptr(), obj.device)
+            if key not in seen_storages:
+                seen_storages.add(key)
+                total += storage.nbytes()
+        elif isinstance(obj, dict):
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set)):
+            stack.extend(obj)
+        elif hasattr(obj, "__dict__"):
+            stack.extend(vars(obj).values())
+    return total
+
+
+class StreamSession:
+    """Handle on one open stream state
+
+    Use as a context manager, or call `close()` explicitly. The state itself is
+    owned by the registry, so a session that is dropped without being closed
+    still releases its KV cache when it is garbage collected.
+    """
+
+    def __init__(self, registry, model, session_id):
+        self.registry = registry
+        self.model = model
+        self.session_id = session_id
+        self.closed = False
+        self._finalizer = weakref.finalize(self, registry._release, session_id)
+
+    def moderate(self, token_ids, role):
+        """Run `stream_moderate_from_ids` on this session's state and return the result"""
+        if self.closed:
+            raise RuntimeError(f"Stream session {self.session_id} is closed")
+        entry = self.registry._entry(self.session_id)
+        with self.registry.step_context():
+            result, entry["state"] = self.model.stream_moderate_from_ids(
+                token_ids,
+                role=role,
+                stream_state=entry["state"]
+            )
+        entry["steps"] += 1
+        entry["last_used"] = time.monotonic()
+        if self.registry.window_tokens is not None:
+            self._track_window(entry, token_ids, role)
+        # Walking the state costs a little on every call, so only re-estimate after
+        # a prefill or every few single-token steps
+        if role != "assistant" or entry["steps"] % self.registry.memory_check_interval == 0:
+            entry["bytes"] = estimate_state_bytes(entry["state"])
+        return result
+
+    def _track_window(self, entry, token_ids, role):
+        token_ids = token_ids.reshape(-1).tolist()
+        if role != "assistant":
+            # Everything before the assistant turn is kept in full
+            entry["prefix_ids"].extend(entry["header_ids"])
+            entry["prefix_ids"].extend(entry["assistant_ids"])
+            entry["prefix_ids"].extend(token_ids)
+            entry["header_ids"] = []
+            entry["assistant_ids"] = []
+            return
+        header = self.registry.assistant_header_ids
+        for token_id in token_ids:
+            # The turn header (e.g. "\n<|im_start|>assistant\n") is pinned, never slid out
+            position = len(entry["header_ids"])
+            if not entry["assistant_ids"] and position < len(header) and token_id == header[position]:
+                entry["header_ids"].append(token_id)
+            else:
+                entry["assistant_ids"].append(token_id)
+        if len(entry["assistant_ids"]) > self.registry.window_tokens + self.registry.window_slack:
+            self._slide_window(entry)
+            entry["bytes"] = estimate_state_bytes(entry["state"])
+
+    def _slide_window(self, entry):
+        """Rebuild the state from the prefix, the header and the last `window_tokens` assistant tokens
+
+        Re-prefilling (rather than deleting KV entries in place) keeps positions
+        contiguous and works with any stream state layout. The prefix is one
+        batched user call, as for a new conversation; assistant tokens are fed
+        one at a time, the only way the moderation calls ever pass them.
+        """
+        kept = entry["assistant_ids"][-self.registry.window_tokens:] if self.registry.window_tokens else []
+        device = self.model.device
+        state = None
+        try:
+            with self.registry.step_context():
+                _, state = self.model.stream_moderate_from_ids(
+                    torch.tensor(entry["prefix_ids"], device=device),
+                    role="user",
+                    stream_state=None
+                )
+                for token_id in entry["header_ids"] + kept:
+                    _, state = self.model.stream_moderate_from_ids(
+                        torch.tensor(token_id, device=device),
+                        role="assistant",
+                        stream_state=state
+                    )
+        except Exception:
+            if state is not None:
+                self.model.close_stream(state)
+            raise
+        old_state, entry["state"] = entry["state"], state
+        entry["assistant_ids"] = kept
+        self.model.close_stream(old_state)
+        self.registry.evictions_total += 1
+
+    @property
+    def state(self):
+        """The current raw stream state (None before the first call)"""
+        return self.registry._entry(self.session_id)["state"]
+
+    @property
+    def idle_seconds(self):
+        """Seconds since this session last ran a step"""
+        return time.monotonic() - self.registry._entry(self.session_id)["last_used"]
+
+    def window_ids(self):
+        """The (prefix_ids, header_ids, assistant_ids) a bounded window would rebuild from"""
+        entry = self.registry._entry(self.session_id)
+        return list(entry["prefix_ids"]), list(entry["header_ids"]), list(entry["assistant_ids"])
+
+    def close(self):
+        """Close the underlying stream state. Safe to call more than once."""
+        if not self.closed:
+            self.closed = True
+            self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class StreamStateRegistry:
+    """Tracks open stream states, their estimated memory and enforces global caps
+
+    Args:
+        max_streams: Maximum number of concurrently open streams (None for no limit)
+        max_bytes: Refuse new streams while the estimated total exceeds this (None for no limit)
+        memory_check_interval: Re-estimate a state's memory every N assistant tokens
+        window_tokens: Keep only the user turn plus this many recent assistant tokens in
+            each state (None keeps the full context)
+        window_slack: How many tokens past the window to accept before rebuilding, so
+            the rebuild cost (window_tokens single steps) is amortised over that many steps
+        assistant_header_ids: Token ids that open an assistant turn; they are kept with
+            the prefix instead of being slid out of the window
+        step_mode: "eager" runs steps as the model does by default; "inference" and
+            "compiled" run them under torch.inference_mode(), which skips autograd
+            version-counter bookkeeping on every op (see compile_stream_model for
+            the extra step "compiled" needs at load time)
+    """
+
+    def __init__(self, max_streams=None, max_bytes=None, memory_check_interval=32, step_mode="eager",
+                 window_tokens=None, window_slack=64, assistant_header_ids=()):
+        if step_mode not in STEP_MODES:
+            raise ValueError(f"step_mode must be one of {STEP_MODES}, got {step_mode!r}")
+        self.max_streams = max_streams
+        self.max_bytes = max_bytes
+        self.memory_check_interval = memory_check_interval
+        self.step_mode = step_mode
+        self.step_context = contextlib.nullcontext if step_mode == "eager" else torch.inference_mode
+        self.window_tokens = window_tokens
+        self.window_slack = window_slack
+        self.assistant_header_ids = list(assistant_header_ids)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.opened_total = 0
+        self.closed_total = 0
+        self.rejected_total = 0
+        self.evictions_total = 0
+
+    def open(self, model, session_id=None, state=None, window_ids=None):
+        """Open a stream session, or raise StreamCapacityError if a cap is reached
+
+        Args:
+            model: The Stream model that owns the state
+            session_id: Reuse this id (e.g. for a restored session) instead of a new one
+            state: Adopt an existing stream state, such as one restored from a snapshot
+            window_ids: The (prefix_ids, header_ids, assistant_ids) lists from `StreamSession.window_ids()`
+                when adopting a state under a bounded window
+        """
+        with self._lock:
+            if self.max_streams is not None and len(self._entries) >= self.max_streams:
+                self.rejected_total += 1
+                raise StreamCapacityError(f"Too many open streams ({len(self._entries)}/{self.max_streams})")
+            total_bytes = sum(entry["bytes"] for entry in self._entries.values())
+            if self.max_bytes is not None and total_bytes >= self.max_bytes:
+                self.rejected_total += 1
+                raise StreamCapacityError(
+                    f"Stream memory cap reached ({total_bytes / 2**20:.1f}/{self.max_bytes / 2**20:.1f} MiB)"
+                )
+            session_id = session_id or uuid.uuid4().hex
+            if session_id in self._entries:
+                raise ValueError(f"Stream session {session_id} is already open")
+            prefix_ids, header_ids, assistant_ids = window_ids or ([], [], [])
+            self._entries[session_id] = {
+                "model": model,
+                "state": state,
+                "bytes": estimate_state_bytes(state) if state is not None else 0,
+                "steps": 0,
+                "prefix_ids": list(prefix_ids),
+                "header_ids": list(header_ids),
+                "assistant_ids": list(assistant_ids),
+                "opened": time.monotonic(),
+                "last_used": time.monotonic(),
+            }
+            self.opened_total += 1
+        return StreamSession(self, model, session_id)
+
+    def _entry(self, session_id):
+        return self._entries[session_id]
+
+    def _release(self, session_id):
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is None:
+                return
+            self.closed_total += 1
+        if entry["state"] is not None:
+            try:
+                entry["model"].close_stream(entry["state"])
+            except Exception:
+                logger.exception("Error closing stream", session_id=session_id)
+
+    def close_all(self):
+        """Close every open stream state"""
+        for session_id in list(self._entries):
+            self._release(session_id)
+
+    def stats(self):
+        """Return counts and estimated memory of the open streams"""
+        with self._lock:
+            entries = list(self._entries.values())
+            return {
+                "open_streams": len(entries),
+                "estimated_bytes": sum(entry["bytes"] for entry in entries),
+                "largest_stream_bytes": max((entry["bytes"] for entry in entries), default=0),
+                "max_streams": self.max_streams,
+                "max_bytes": self.max_bytes,
+                "step_mode": self.step_mode,
+                "window_tokens": self.window_tokens,
+                "evictions_total": self.evictions_total,
+                "opened_total": self.opened_total,
+                "closed_total": self.closed_total,
+                "rejected_total": self.rejected_total,
+            }
@@ -0,0 +1,255 @@
+"""
+Serialization and a local disk store for Qwen3Guard-Stream stream states.
+
+A stream state is an arbitrary Python object (dicts, transformers Cache
+objects, ...) holding KV-cache tensors. It is written as:
+
+    magic | version | header length | JSON header | pickled skeleton | tensor data
+
+The skeleton is the state pickled with every tensor replaced by a reference
+into the header's tensor table, so the large KV buffers are never pickled.
+Tensor bytes are written straight from the tensors' memory and, on load, the
+file is memory-mapped and each tensor is a view onto the mapping until it is
+moved to the target device. Any worker sharing the store directory can
+restore a state and continue `stream_moderate_from_ids` where it left off.
+"""
+
+import io
+import json
+import mmap
+import os
+import pickle
+import re
+import struct
+import tempfile
+
+import torch
+
+MAGIC = b"QGSS"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+_PREFIX = struct.Struct("<4sIQ")
+
+# Globals the skeleton may reference: containers, torch dtypes/devices/sizes
+# and KV-cache classes. Tensors are persistent references into the tensor
+# table, so none of torch's tensor rebuild helpers are ever needed.
+ALLOWED_GLOBALS = {
+    ("builtins", "set"),
+    ("builtins", "frozenset"),
+    ("builtins", "slice"),
+    ("builtins", "object"),
+    ("collections", "OrderedDict"),
+    ("collections", "defaultdict"),
+    ("collections", "deque"),
+    ("copyreg", "_reconstructor"),
+    ("torch", "device"),
+    ("torch", "Size"),
+} | {
+    ("torch", str(dtype).replace("torch.", ""))
+    for dtype in (torch.float64, torch.float32, torch.float16, torch.bfloat16,
+                  torch.int64, torch.int32, torch.int16, torch.int8, torch.uint8, torch.bool)
+}
+# Modules whose classes are allowed if they are KV caches or cache layers.
+# Remote-code models define their own cache classes, so these are checked by type.
+CACHE_MODULES = ("transformers.cache_utils", "transformers_modules.")
+
+_SESSION_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+class _TensorPickler(pickle.Pickler):
+    def __init__(self, file):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.tensors = []
+        self._indices = {}
+
+    def persistent_id(self, obj):
+        if isinstance(obj, torch.Tensor):
+            index = self._indices.get(id(obj))
+            if index is None:
+                index = len(self.tensors)
+                self._indices[id(obj)] = index
+                self.tensors.append(obj)
+            return ("tensor", index)
+        return None
+
+
+class _TensorUnpickler(pickle.Unpickler):
+    def __init__(self, file, tensors):
+        super().__init__(file)
+        self.tensors = tensors
+
+    def persistent_load(self, pid):
+        kind, index = pid
+        if kind != "tensor":
+            raise pickle.UnpicklingError(f"Unknown persistent id: {pid!r}")
+        return self.tensors[index]
+
+    def find_class(self, module, name):
+        if (module, name) in ALLOWED_GLOBALS:
+            return super().find_class(module, name)
+        if module == CACHE_MODULES[0] or module.startswith(CACHE_MODULES[1]):
+            cls = super().find_class(module, name)
+            if isinstance(cls, type) and issubclass(cls, _cache_base_classes()):
+                return cls
+        raise pickle.UnpicklingError(f"Refusing to load {module}.{name} from a stream state")
+
+
+def _cache_base_classes():
+    """Base classes of transformers KV caches and (in newer versions) their per-layer storage"""
+    from transformers import cache_utils
+    return tuple(getattr(cache_utils, name) for name in ("Cache", "CacheLayerMixin") if hasattr(cache_utils, name))
+
+
+def _tensor_bytes(tensor):
+    """Return a buffer over the tensor's bytes, without copying when it is already contiguous on the CPU"""
+    tensor = tensor.detach()
+    if tensor.device.type != "cpu":
+        tensor = tensor.cpu()
+    tensor = tensor.contiguous().reshape(-1)
+    if tensor.numel() == 0:
+        return b""
+    return memoryview(tensor.view(torch.uint8).numpy())
+
+
+def write_stream_state(file, state, metadata=None):
+    """Serialize a stream state and JSON-compatible metadata to a binary file object"""
+    skeleton = io.BytesIO()
+    pickler = _TensorPickler(skeleton)
+    pickler.dump(state)
+
+    table = []
+    offset = 0
+    for tensor in pickler.tensors:
+        nbytes = tensor.numel() * tensor.element_size()
+        table.append({
+            "dtype": str(tensor.dtype).replace("torch.", ""),
+            "shape": list(tensor.shape),
+            "offset": offset,
+            "nbytes": nbytes,
+        })
+        offset += -(-nbytes // ALIGNMENT) * ALIGNMENT
+
+    header = json.dumps({
+        "metadata": metadata or {},
+        "tensors": table,
+        "skeleton_bytes": skeleton.tell(),
+    }).encode("utf-8")
+
+    file.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+    file.write(header)
+    file.write(skeleton.getbuffer())
+    position = _PREFIX.size + len(header) + skeleton.tell()
+    padding = -position % ALIGNMENT
+    file.write(b"\0" * padding)
+    data_start = position + padding
+    for tensor, entry in zip(pickler.tensors, table):
+        file.write(_tensor_bytes(tensor))
+        written = data_start + entry["offset"] + entry["nbytes"]
+        file.write(b"\0" * (-written % ALIGNMENT))
+
+
+def serialize_stream_state(state, metadata=None):
+    """Serialize a stream state to bytes"""
+    buffer = io.BytesIO()
+    write_stream_state(buffer, state, metadata)
+    return buffer.getvalue()
+
+
+def deserialize_stream_state(buffer, device=None):
+    """Restore a stream state from a bytes-like object or mmap
+
+    Tensors are created as views onto `buffer` and only copied when moved to
+    `device`. Keep the buffer writable (e.g. an ACCESS_COPY mmap) if the model
+    updates tensors in place.
+
+    Returns:
+        (state, metadata)
+    """
+    view = memoryview(buffer)
+    magic, version, header_length = _PREFIX.unpack_from(view, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a serialized stream state")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported stream state format version {version}")
+    header_start = _PREFIX.size
+    header = json.loads(bytes(view[header_start:header_start + header_length]))
+    skeleton_start = header_start + header_length
+    skeleton_end = skeleton_start + header["skeleton_bytes"]
+    data_start = skeleton_end + (-skeleton_end % ALIGNMENT)
+
+    tensors = []
+    for entry in header["tensors"]:
+        dtype = getattr(torch, entry["dtype"])
+        if entry["nbytes"] == 0:
+            tensor = torch.empty(entry["shape"], dtype=dtype)
+        else:
+            tensor = torch.frombuffer(
+                buffer,
+                dtype=dtype,
+                count=entry["nbytes"] // dtype.itemsize,
+                offset=data_start + entry["offset"],
+            ).reshape(entry["shape"])
+        if device is not None:
+            tensor = tensor.to(device)
+        tensors.append(tensor)
+
+    state = _TensorUnpickler(io.BytesIO(view[skeleton_start:skeleton_end]), tensors).load()
+    return state, header["metadata"]
+
+
+class StreamStateStore:
+    """Directory of serialized stream states keyed by session id
+
+    Point several workers at the same directory (e.g. a shared volume) to move
+    sessions between them.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id):
+        if not _SESSION_ID_PATTERN.fullmatch(session_id):
+            raise ValueError(f"Invalid session id: {session_id!r}")
+        return os.path.join(self.directory, f"{session_id}.qgss")
+
+    def save(self, session_id, state, metadata=None):
+        """Atomically write a state to the store and return its size in bytes"""
+        path = self._path(session_id)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write_stream_state(f, state, metadata)
+                size = f.tell()
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return size
+
+    def load(self, session_id, device=None):
+        """Memory-map and restore a state. Raises KeyError if it is not in the store.
+
+        Returns:
+            (state, metadata)
+        """
+        path = self._path(session_id)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            raise KeyError(session_id)
+        with f:
+            # ACCESS_COPY gives copy-on-write pages, so tensors left on the CPU stay writable
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        return deserialize_stream_state(mapping, device=device)
+
+    def exists(self, session_id):
+        return os.path.exists(self._path(session_id))
+
+    def delete(self, session_id):
+        """Remove a state from the store if present"""
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,42 @@
+"""
+Shared fixtures for the tests.
+
+The tests never download a model: they use the stand-ins in
+`tiny_guard_models.py` or tiny randomly initialised Qwen3 models built from a
+config, so the whole suite runs on a CPU in seconds.
+"""
+
+import os
+import sys
+
+import pytest
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tiny_guard_models import VOCAB_SIZE  # noqa: E402
+
+
+def tiny_qwen3_classifier(num_labels=2):
+    """Randomly initialised two-layer Qwen3ForSequenceClassification, sized for TinyTokenizer's ids"""
+    from transformers import Qwen3Config, Qwen3ForSequenceClassification
+
+    torch.manual_seed(0)
+    config = Qwen3Config(
+        vocab_size=VOCAB_SIZE,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        head_dim=8,
+        max_position_embeddings=512,
+        num_labels=num_labels,
+        pad_token_id=0,
+    )
+    return Qwen3ForSequenceClassification(config).eval()
+
+
+@pytest.fixture
+def qwen3_classifier():
+    return tiny_qwen3_classifier()
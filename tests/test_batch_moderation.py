@@ -0,0 +1,39 @@
+"""Tests for the Star Trek server's length-bucketed batch endpoint"""
+
+import pytest
+
+import star_trek_api_server as server
+
+
+def test_length_buckets_sort_by_length_and_respect_limits():
+    lengths = [5, 40, 3, 12, 41, 6, 11]
+    buckets = server.length_buckets(lengths, max_size=3, max_tokens=64)
+    assert sorted(i for bucket in buckets for i in bucket) == list(range(len(lengths)))
+    for bucket in buckets:
+        assert len(bucket) <= 3
+        assert len(bucket) * max(lengths[i] for i in bucket) <= 64
+    flattened = [lengths[i] for bucket in buckets for i in bucket]
+    assert flattened == sorted(lengths)
+
+
+def test_length_buckets_keep_an_oversized_item_on_its_own():
+    assert server.length_buckets([100, 2, 3], max_size=8, max_tokens=10) == [[1, 2], [0]]
+
+
+def test_length_buckets_of_nothing():
+    assert server.length_buckets([], max_size=4, max_tokens=16) == []
+
+
+@pytest.mark.parametrize("domains", [
+    ["star_trek"],
+    "star_trek",
+    [["star_trek"], "star_trek"],
+    [{"name": "star_trek"}, "star_trek"],
+])
+def test_moderate_batch_rejects_malformed_domains(monkeypatch, domains):
+    monkeypatch.setattr(server, "adapter_domains", None)
+    response = server.app.test_client().post(
+        '/api/moderate_batch', json={'messages': ['Engage', 'Make it so'], 'domains': domains}
+    )
+    assert response.status_code == 400
+    assert 'domains' in response.get_json()['error']
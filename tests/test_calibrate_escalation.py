@@ -0,0 +1,53 @@
+"""Tests for fitting the escalation threshold between the two classifier tiers"""
+
+import numpy as np
+import pytest
+
+from calibrate_escalation import fit_threshold
+
+
+def two_tier_accuracy(confidence, small_correct, large_correct, threshold):
+    """Accuracy when every message below the threshold is escalated"""
+    escalated = confidence < threshold
+    return np.where(escalated, large_correct, small_correct).mean(), escalated.mean()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_fitted_threshold_is_the_cheapest_that_reaches_the_target(seed):
+    rng = np.random.default_rng(seed)
+    n = 200
+    confidence = np.round(rng.uniform(0.5, 1.0, n), 2)  # Rounded, so there are ties
+    small_correct = rng.uniform(size=n) < confidence
+    large_correct = rng.uniform(size=n) < 0.97
+    target = 0.9
+    fitted = fit_threshold(confidence, small_correct, large_correct, target)
+
+    accuracy, escalation_rate = two_tier_accuracy(confidence, small_correct, large_correct, fitted["threshold"])
+    assert fitted["accuracy"] == pytest.approx(accuracy)
+    assert fitted["escalation_rate"] == pytest.approx(escalation_rate)
+    candidates = [two_tier_accuracy(confidence, small_correct, large_correct, t)
+                  for t in np.append(np.unique(confidence), 1.0 + 1e-6)]
+    reaching = [rate for acc, rate in candidates if acc >= target]
+    if reaching:
+        assert fitted["target_reached"]
+        assert fitted["escalation_rate"] == pytest.approx(min(reaching))
+    for point in fitted["curve"]:
+        assert point["accuracy"] == pytest.approx(
+            two_tier_accuracy(confidence, small_correct, large_correct, point["threshold"])[0]
+        )
+
+
+def test_unreachable_target_settles_for_the_most_accurate_threshold():
+    confidence = np.array([0.6, 0.7, 0.8, 0.9])
+    small_correct = np.array([False, True, True, False])
+    large_correct = np.array([True, False, True, True])
+    fitted = fit_threshold(confidence, small_correct, large_correct, target_accuracy=1.0)
+    assert not fitted["target_reached"]
+    assert fitted["accuracy"] == max(point["accuracy"] for point in fitted["curve"]) == 0.75
+
+
+def test_no_escalation_when_the_small_model_is_good_enough():
+    confidence = np.array([0.55, 0.7, 0.95])
+    fitted = fit_threshold(confidence, np.ones(3, bool), np.zeros(3, bool), target_accuracy=0.99)
+    assert fitted["escalation_rate"] == 0.0
+    assert fitted["threshold"] == 0.55
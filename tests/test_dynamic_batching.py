@@ -0,0 +1,79 @@
+"""Tests for the adaptive server-side batcher"""
+
+import queue
+import threading
+
+import pytest
+
+from dynamic_batching import AdaptiveBatcher
+
+
+@pytest.fixture
+def batcher(monkeypatch):
+    batcher = AdaptiveBatcher(lambda items: items, latency_target_ms=50.0, max_batch_size=16, max_wait_ms=10.0)
+    # The worker keeps blocking on the original queue; _adapt only reads the depth of this one
+    monkeypatch.setattr(batcher, "_queue", queue.Queue())
+    return batcher
+
+
+def queue_depth(batcher, depth):
+    for _ in range(depth):
+        batcher._queue.put(None)
+
+
+def test_deep_queue_doubles_the_batch_limit_up_to_the_maximum(batcher):
+    queue_depth(batcher, 64)
+    limits = []
+    for _ in range(6):
+        batcher._adapt(batcher.batch_limit, 0.010)
+        limits.append(batcher.batch_limit)
+    assert limits == [2, 4, 8, 16, 16, 16]
+
+
+def test_latency_over_target_halves_the_window_and_cuts_the_limit(batcher):
+    batcher.wait = 0.008
+    batcher.batch_limit = 8
+    queue_depth(batcher, 64)
+    batcher._adapt(8, 0.080)
+    assert batcher.wait == pytest.approx(0.004)
+    assert batcher.batch_limit == 6
+
+
+def test_a_lone_request_shrinks_the_window_to_zero(batcher):
+    batcher.wait = 0.004
+    for _ in range(6):
+        batcher._adapt(1, 0.002)
+    assert batcher.wait == 0.0
+
+
+def test_traffic_under_target_grows_the_window_up_to_the_maximum(batcher):
+    batcher.batch_limit = 4
+    queue_depth(batcher, 1)
+    for _ in range(20):
+        batcher._adapt(2, 0.005)
+    assert batcher.wait == pytest.approx(batcher.max_wait)
+    assert batcher.batch_limit == batcher.max_batch_size
+
+
+def test_concurrent_submissions_get_their_own_results():
+    batcher = AdaptiveBatcher(lambda items: [item * 2 for item in items], max_batch_size=8, max_wait_ms=5.0)
+    results = {}
+
+    def submit(i):
+        results[i] = batcher.submit(i, timeout=5)
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(32)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {i: i * 2 for i in range(32)}
+
+
+def test_a_failing_batch_fails_each_of_its_requests():
+    def fail(items):
+        raise RuntimeError("model failed")
+
+    batcher = AdaptiveBatcher(fail)
+    with pytest.raises(RuntimeError, match="model failed"):
+        batcher.submit("Engage", timeout=5)
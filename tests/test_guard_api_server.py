@@ -0,0 +1,45 @@
+"""Tests for the combined guard server's error handling"""
+
+import threading
+
+import guard_api_server as server
+
+
+def unparseable(message, message_ids=None):
+    raise StopIteration
+
+
+def test_parse_error_survives_a_failing_topic_check(monkeypatch):
+    def failing_topic_check(message, domain, message_ids=None):
+        raise RuntimeError("topic model failed")
+
+    monkeypatch.setattr(server, "safety_check", unparseable)
+    monkeypatch.setattr(server, "topic_check", failing_topic_check)
+    monkeypatch.setattr(server.topic, "adapter_domains", None)
+    response = server.app.test_client().post('/api/guard', json={'message': 'Engage'})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Failed to parse user message'}
+
+
+def test_parse_error_does_not_wait_for_a_queued_topic_check(monkeypatch):
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocking_safety_check(message, message_ids=None):
+        started.set()
+        release.wait(timeout=5)
+        raise StopIteration
+
+    def topic_check(message, domain, message_ids=None):
+        raise AssertionError("a cancelled topic check must not run")
+
+    # A one-worker pool: the topic check queues behind the safety check and is cancelled
+    monkeypatch.setattr(server, "executor", server.ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(server, "safety_check", blocking_safety_check)
+    monkeypatch.setattr(server, "topic_check", topic_check)
+    monkeypatch.setattr(server.topic, "adapter_domains", None)
+    threading.Timer(0.1, release.set).start()
+    response = server.app.test_client().post('/api/guard', json={'message': 'Engage'})
+    assert started.is_set()
+    assert response.status_code == 400
+    server.executor.shutdown(wait=True)
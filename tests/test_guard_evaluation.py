@@ -0,0 +1,48 @@
+"""Tests for the dataset split and scoring helpers shared by the offline scripts"""
+
+import numpy as np
+import pytest
+
+from guard_datasets import split_rows
+from guard_evaluation import percentile, predict
+
+
+@pytest.mark.parametrize("num_rows,test_size,seed", [(10, 0.2, 42), (101, 0.1, 0), (7, 0.5, 3)])
+def test_split_rows_matches_train_test_split(num_rows, test_size, seed):
+    datasets = pytest.importorskip("datasets")
+    split = datasets.Dataset.from_dict({"row": list(range(num_rows))}).train_test_split(
+        test_size=test_size, seed=seed
+    )
+    train, held_out = split_rows(num_rows, test_size, seed)
+    assert list(held_out) == split["test"]["row"]
+    assert list(train) == split["train"]["row"]
+
+
+def test_percentile_interpolates():
+    assert percentile([], 50) is None
+    assert percentile([3.0], 99) == 3.0
+    assert percentile([4, 1, 3, 2], 50) == 2.5
+    assert percentile([1, 2, 3, 4, 5], 100) == 5
+    assert percentile(list(range(101)), 95) == pytest.approx(95)
+
+
+def test_predict_returns_probabilities_in_input_order(qwen3_classifier):
+    transformers = pytest.importorskip("transformers")
+    tokenizer = transformers.PreTrainedTokenizerFast(
+        tokenizer_object=_word_tokenizer(), pad_token="<pad>"
+    )
+    texts = ["Engage", "Make it so, Number One", "Tea, Earl Grey, hot", "Warp nine"]
+    probabilities = predict(tokenizer, qwen3_classifier, texts)
+    assert probabilities.shape == (len(texts), 2)
+    np.testing.assert_allclose(probabilities.sum(axis=1), 1.0, rtol=1e-5)
+    for i, text in enumerate(texts):
+        np.testing.assert_allclose(predict(tokenizer, qwen3_classifier, [text])[0], probabilities[i], rtol=1e-4, atol=1e-6)
+
+
+def _word_tokenizer():
+    from tokenizers import Tokenizer, models, pre_tokenizers
+
+    words = "<pad> <unk> Engage Make it so , Number One Tea Earl Grey hot Warp nine".split()
+    tokenizer = Tokenizer(models.WordLevel({w: i for i, w in enumerate(words)}, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    return tokenizer
@@ -0,0 +1,62 @@
+"""Tests for the Star Trek server's KV-cached incremental classification"""
+
+import pytest
+import torch
+
+import star_trek_api_server as server
+from tiny_guard_models import TinyTokenizer
+
+
+@pytest.fixture
+def incremental_server(monkeypatch, qwen3_classifier):
+    monkeypatch.setattr(server, "model", qwen3_classifier)
+    monkeypatch.setattr(server, "tokenizer", TinyTokenizer())
+    monkeypatch.setattr(server, "model_backend", "torch")
+    monkeypatch.setattr(server, "adapter_domains", None)
+    return server
+
+
+def fresh_session():
+    return {'domain': server.DEFAULT_DOMAIN, 'token_ids': [], 'cache': None}
+
+
+def full_encode_logits(message):
+    logits, reused, _ = server.classify_incremental(fresh_session(), message)
+    assert reused == 0
+    return logits
+
+
+def test_edit_in_the_middle_matches_full_reencode(incremental_server):
+    session = fresh_session()
+    server.classify_incremental(session, "Captain Picard commands the Enterprise on a mission to Vulcan")
+    edited = "Captain Picard commands the Defiant on a mission to Vulcan"
+    logits, reused, computed = server.classify_incremental(session, edited)
+    assert 0 < reused < len(session['token_ids'])
+    assert reused + computed == len(session['token_ids'])
+    torch.testing.assert_close(logits, full_encode_logits(edited), rtol=1e-4, atol=1e-5)
+
+
+def test_appended_text_matches_full_reencode(incremental_server):
+    session = fresh_session()
+    server.classify_incremental(session, "Spock is a Vulcan")
+    extended = "Spock is a Vulcan science officer"
+    logits, reused, _ = server.classify_incremental(session, extended)
+    assert reused > 0
+    torch.testing.assert_close(logits, full_encode_logits(extended), rtol=1e-4, atol=1e-5)
+
+
+def test_failed_step_resets_the_session(incremental_server, monkeypatch):
+    session = fresh_session()
+    server.classify_incremental(session, "Data plays the violin on the holodeck")
+
+    class FailingModel:
+        device = torch.device("cpu")
+
+        def __call__(self, **kwargs):
+            raise RuntimeError("out of memory")
+
+    monkeypatch.setattr(server, "model", FailingModel())
+    with pytest.raises(RuntimeError):
+        server.classify_incremental(session, "Data plays the cello on the holodeck")
+    assert session['cache'] is None
+    assert session['token_ids'] == []
@@ -0,0 +1,82 @@
+"""Tests for offline-first snapshot resolution and the .bin weights fallback"""
+
+import os
+
+import pytest
+import torch
+
+import model_loading
+from model_loading import BIN_SNAPSHOT_PATTERNS, SNAPSHOT_PATTERNS, fast_load_kwargs, resolve_snapshot
+
+
+def touch(directory, *names):
+    os.makedirs(directory, exist_ok=True)
+    for name in names:
+        open(os.path.join(directory, name), "w").close()
+
+
+def test_fast_load_kwargs_only_ask_for_safetensors_when_present(tmp_path):
+    touch(tmp_path / "safetensors", "config.json", "model.safetensors")
+    touch(tmp_path / "bin", "config.json", "pytorch_model.bin")
+    assert fast_load_kwargs(str(tmp_path / "safetensors")) == {"use_safetensors": True, "low_cpu_mem_usage": True}
+    assert fast_load_kwargs(str(tmp_path / "bin")) == {"low_cpu_mem_usage": True}
+
+
+class FakeHub:
+    """snapshot_download stand-in for a repo that only ships .bin weights"""
+
+    files = ["config.json", "tokenizer.json", "pytorch_model.bin"]
+
+    def __init__(self, root, cached=False):
+        self.root = root
+        self.cached = cached
+        self.calls = []
+
+    def __call__(self, repo_id, revision=None, allow_patterns=None, local_files_only=False, force_download=False):
+        import fnmatch
+        from huggingface_hub.utils import LocalEntryNotFoundError
+
+        self.calls.append((allow_patterns, local_files_only))
+        if local_files_only and not self.cached:
+            raise LocalEntryNotFoundError("not cached")
+        snapshot = os.path.join(self.root, "snapshot")
+        if not local_files_only:
+            touch(snapshot, *[f for f in self.files if any(fnmatch.fnmatch(f, p) for p in allow_patterns)])
+        return snapshot
+
+
+def test_resolve_snapshot_falls_back_to_bin_weights(monkeypatch, tmp_path):
+    huggingface_hub = pytest.importorskip("huggingface_hub")
+    hub = FakeHub(str(tmp_path))
+    monkeypatch.setattr(huggingface_hub, "snapshot_download", hub)
+    model_dir = resolve_snapshot("example/bin-only-model")
+    assert os.path.exists(os.path.join(model_dir, "pytorch_model.bin"))
+    assert [patterns for patterns, local in hub.calls if not local] == [SNAPSHOT_PATTERNS, BIN_SNAPSHOT_PATTERNS]
+    assert "use_safetensors" not in fast_load_kwargs(model_dir)
+
+    # Once cached, neither pass goes to the network
+    hub.cached = True
+    hub.calls.clear()
+    assert resolve_snapshot("example/bin-only-model", offline=True) == model_dir
+    assert all(local for _, local in hub.calls)
+
+
+def test_offline_bin_fallback_without_cached_weights_raises(monkeypatch, tmp_path):
+    huggingface_hub = pytest.importorskip("huggingface_hub")
+    hub = FakeHub(str(tmp_path), cached=True)
+    touch(os.path.join(str(tmp_path), "snapshot"), "config.json")
+    monkeypatch.setattr(huggingface_hub, "snapshot_download", hub)
+    with pytest.raises(FileNotFoundError):
+        resolve_snapshot("example/bin-only-model", offline=True)
+
+
+def test_bin_only_checkpoint_loads_with_fast_load_kwargs(tmp_path, qwen3_classifier):
+    from transformers import AutoModelForSequenceClassification
+
+    model_dir = str(tmp_path / "model")
+    qwen3_classifier.config.save_pretrained(model_dir)
+    torch.save(qwen3_classifier.state_dict(), os.path.join(model_dir, "pytorch_model.bin"))
+    assert not model_loading.has_safetensors(model_dir)
+    loaded = AutoModelForSequenceClassification.from_pretrained(model_dir, **fast_load_kwargs(model_dir)).eval()
+    input_ids = torch.tensor([[5, 6, 7, 8]])
+    torch.testing.assert_close(loaded(input_ids=input_ids).logits, qwen3_classifier(input_ids=input_ids).logits)
@@ -0,0 +1,61 @@
+"""Tests for packing fine-tuning questions into block-diagonal sequences"""
+
+import math
+import random
+
+import pytest
+import torch
+
+from sequence_packing import PackedCollator, pack_examples, packed_logits
+
+
+def random_examples(count, max_tokens, seed=0):
+    rng = random.Random(seed)
+    input_ids = [[rng.randrange(3, 4096) for _ in range(rng.randint(1, max_tokens))] for _ in range(count)]
+    labels = [rng.randint(0, 1) for _ in range(count)]
+    return input_ids, labels
+
+
+def test_first_fit_packs_stay_within_bounds():
+    input_ids, labels = random_examples(200, 60)
+    input_ids.append(list(range(3, 103)))  # Longer than a pack, so it is truncated
+    labels.append(1)
+    max_length = 64
+    columns = pack_examples(input_ids, labels, max_length)
+
+    total = sum(min(len(ids), max_length) for ids in input_ids)
+    num_packs = len(columns["input_ids"])
+    # First fit decreasing never needs more than 11/9 of the optimal number of packs, plus one
+    assert math.ceil(total / max_length) <= num_packs <= 11 / 9 * math.ceil(total / max_length) + 1
+    seen = []
+    for ids, lengths, pack_labels in zip(columns["input_ids"], columns["segment_lengths"], columns["labels"]):
+        assert len(ids) == sum(lengths) <= max_length
+        assert len(lengths) == len(pack_labels)
+        start = 0
+        for length, label in zip(lengths, pack_labels):
+            segment = ids[start:start + length]
+            matches = [i for i, example in enumerate(input_ids)
+                       if example[:max_length] == segment and labels[i] == label and i not in seen]
+            assert matches
+            seen.append(matches[0])
+            start += length
+    assert sorted(seen) == list(range(len(input_ids)))
+
+
+@pytest.mark.parametrize("attn_implementation", ["sdpa", "eager"])
+def test_packed_logits_match_unpacked_questions(qwen3_classifier, attn_implementation):
+    qwen3_classifier.set_attn_implementation(attn_implementation)
+    input_ids, labels = random_examples(12, 20, seed=1)
+    columns = pack_examples(input_ids, labels, max_length=48)
+    rows = [dict(zip(columns, values)) for values in zip(*columns.values())]
+    assert any(len(row["segment_lengths"]) > 1 for row in rows)
+    batch = PackedCollator(pad_token_id=0)(rows)
+
+    with torch.no_grad():
+        packed = packed_logits(qwen3_classifier, batch)
+        segments = [row["input_ids"][sum(row["segment_lengths"][:i]):sum(row["segment_lengths"][:i + 1])]
+                    for row in rows for i in range(len(row["segment_lengths"]))]
+        unpacked = torch.cat([qwen3_classifier(input_ids=torch.tensor([segment])).logits for segment in segments])
+
+    assert batch["labels"].tolist() == [label for row in rows for label in row["labels"]]
+    torch.testing.assert_close(packed, unpacked, rtol=1e-4, atol=1e-5)
@@ -0,0 +1,151 @@
+"""Tests for stream state serialization, the disk store and session hand-over"""
+
+import json
+import os
+import pickle
+from collections import OrderedDict
+
+import pytest
+import torch
+
+import qwen_stream_api_server as server
+from stream_state_store import _PREFIX, StreamStateStore, deserialize_stream_state, serialize_stream_state
+from tiny_guard_models import install_tiny_models
+
+SESSION_ID = "0123456789abcdef0123456789abcdef"
+
+
+def nested_state():
+    shared = torch.arange(6, dtype=torch.float32).reshape(2, 3)
+    return {
+        "layers": (
+            (torch.randn(1, 2, 4, 8), torch.randn(1, 2, 4, 8, dtype=torch.float16)),
+            (torch.randn(1, 2, 4, 8).bfloat16(), torch.zeros(0, 8)),
+        ),
+        "positions": torch.tensor([3, 4, 5]),
+        "flags": OrderedDict(done=torch.tensor(False), seen={1, 2}),
+        "shared": (shared, shared),
+        "step": 7,
+    }
+
+
+def assert_same_state(restored, original):
+    assert type(restored) is type(original)
+    if isinstance(original, torch.Tensor):
+        assert restored.dtype == original.dtype
+        assert torch.equal(restored, original)
+    elif isinstance(original, (dict, OrderedDict)):
+        assert list(restored) == list(original)
+        for key in original:
+            assert_same_state(restored[key], original[key])
+    elif isinstance(original, (tuple, list)):
+        assert len(restored) == len(original)
+        for restored_item, original_item in zip(restored, original):
+            assert_same_state(restored_item, original_item)
+    else:
+        assert restored == original
+
+
+def test_nested_state_round_trips():
+    state = nested_state()
+    restored, metadata = deserialize_stream_state(bytearray(serialize_stream_state(state, {"model": "tiny"})))
+    assert metadata == {"model": "tiny"}
+    assert_same_state(restored, state)
+    # A tensor referenced twice is stored once and restored as one tensor
+    assert restored["shared"][0] is restored["shared"][1]
+
+
+def test_store_load_is_a_copy_on_write_view(tmp_path):
+    store = StreamStateStore(str(tmp_path))
+    state = nested_state()
+    store.save(SESSION_ID, state)
+    path = os.path.join(str(tmp_path), f"{SESSION_ID}.qgss")
+    with open(path, "rb") as f:
+        on_disk = f.read()
+
+    restored, _ = store.load(SESSION_ID)
+    key = restored["layers"][0][0]
+    # Writable in memory, but writes never reach the file or other loads
+    key.add_(1.0)
+    assert torch.equal(key, state["layers"][0][0] + 1.0)
+    with open(path, "rb") as f:
+        assert f.read() == on_disk
+    reloaded, _ = store.load(SESSION_ID)
+    assert torch.equal(reloaded["layers"][0][0], state["layers"][0][0])
+
+
+def test_store_rejects_bad_session_ids_and_reports_missing_ones(tmp_path):
+    store = StreamStateStore(str(tmp_path))
+    with pytest.raises(ValueError):
+        store.save("../escape", nested_state())
+    with pytest.raises(KeyError):
+        store.load(SESSION_ID)
+
+
+class Payload:
+    def __init__(self, function, argument):
+        self.function = function
+        self.argument = argument
+
+    def __reduce__(self):
+        return self.function, (self.argument,)
+
+
+def with_skeleton(data, skeleton):
+    """A serialized state with its pickled skeleton swapped for another one"""
+    magic, version, header_length = _PREFIX.unpack_from(data, 0)
+    header = json.loads(data[_PREFIX.size:_PREFIX.size + header_length])
+    header["skeleton_bytes"] = len(skeleton)
+    header = json.dumps(header).encode("utf-8")
+    return _PREFIX.pack(magic, version, len(header)) + header + skeleton
+
+
+@pytest.mark.parametrize("function,argument", [(eval, "1 + 1"), (os.system, "true"), (torch.load, "state.pt")])
+def test_unpickling_refuses_code_execution_globals(function, argument):
+    skeleton = pickle.dumps({"payload": Payload(function, argument)}, protocol=pickle.HIGHEST_PROTOCOL)
+    forged = with_skeleton(serialize_stream_state({"payload": None}), skeleton)
+    with pytest.raises(pickle.UnpicklingError, match="Refusing to load"):
+        deserialize_stream_state(forged)
+
+
+@pytest.fixture
+def stream_server(monkeypatch, tmp_path):
+    for name in ("model", "tokenizer", "MODEL_PATH", "state_store", "assistant_prefix_ids"):
+        monkeypatch.setattr(server, name, getattr(server, name))
+    install_tiny_models(server, "stream")
+    monkeypatch.setattr(server, "STREAM_STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "state_store", None)
+    monkeypatch.setattr(server, "assistant_prefix_ids", None)
+    monkeypatch.setattr(server, "live_sessions", {})
+    return server.app.test_client()
+
+
+def start_session(client):
+    response = client.post('/api/stream/start', json={'message': 'How do I set phasers to stun?'})
+    assert response.status_code == 200
+    return response.get_json()['session_id']
+
+
+def test_append_after_a_concurrent_snapshot_restores_the_session(stream_server, monkeypatch):
+    chunk = {'text': 'Turn the dial on the side of the phaser.'}
+    reference_id = start_session(stream_server)
+    reference = stream_server.post('/api/stream/append', json={'session_id': reference_id, **chunk}).get_json()
+
+    session_id = start_session(stream_server)
+    get_live_session = server.get_live_session
+
+    def racing_get_live_session(sid):
+        # The first lookup wins the session, then a snapshot releases it before the append runs
+        live = get_live_session(sid)
+        monkeypatch.setattr(server, "get_live_session", get_live_session)
+        assert server.snapshot_session(sid, release=True) is not None
+        return live
+
+    monkeypatch.setattr(server, "get_live_session", racing_get_live_session)
+    response = stream_server.post('/api/stream/append', json={'session_id': session_id, **chunk})
+    assert response.status_code == 200
+    result = response.get_json()
+    assert [t['risk_level'] for t in result['tokens']] == [t['risk_level'] for t in reference['tokens']]
+    assert session_id in server.live_sessions
+    # The restored session took the snapshot over, so no other worker can fork it
+    assert not server.get_state_store().exists(session_id)
@@ -0,0 +1,41 @@
+"""Tests for merging the Stream server's per-token verdicts into spans"""
+
+from qwen_stream_api_server import append_verdict_span
+
+
+def spans_of(verdicts):
+    spans = []
+    for i, (risk_level, category) in enumerate(verdicts):
+        append_verdict_span(spans, i * 2, i * 2 + 2, risk_level, category)
+    return spans
+
+
+def test_equal_verdicts_merge_into_one_span():
+    assert spans_of([('Safe', None)] * 3) == [
+        {'start': 0, 'end': 6, 'risk_level': 'Safe', 'category': None, 'token_count': 3}
+    ]
+
+
+def test_safe_tokens_merge_whatever_category_the_model_reports():
+    spans = spans_of([('Safe', None), ('Safe', 'Violent'), ('Safe', 'PII')])
+    assert len(spans) == 1
+    assert spans[0]['category'] is None
+    assert spans[0]['token_count'] == 3
+
+
+def test_a_new_risk_level_or_category_starts_a_new_span():
+    spans = spans_of([
+        ('Safe', None),
+        ('Unsafe', 'Violent'),
+        ('Unsafe', 'Violent'),
+        ('Unsafe', 'PII'),
+        ('Controversial', 'PII'),
+        ('Safe', 'PII'),
+    ])
+    assert [(s['risk_level'], s['category'], s['start'], s['end'], s['token_count']) for s in spans] == [
+        ('Safe', None, 0, 2, 1),
+        ('Unsafe', 'Violent', 2, 6, 2),
+        ('Unsafe', 'PII', 6, 8, 1),
+        ('Controversial', 'PII', 8, 10, 1),
+        ('Safe', None, 10, 12, 1),
+    ]
@@ -0,0 +1,252 @@
+"""
+Tiny stand-in models for benchmarking the API servers without the real weights.
+
+These mimic just enough of the Qwen3Guard-Stream model, the Star Trek
+classification model and their tokenizer for `qwen_stream_api_server.py` and
+`star_trek_api_server.py` to run end-to-end. The models are randomly
+initialised and their verdicts are meaningless; they only exist so that
+server overhead (HTTP, JSON, tokenization, streaming) can be measured.
+"""
+
+import re
+import zlib
+from types import SimpleNamespace
+
+import torch
+from torch import nn
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+VOCAB_SIZE = 4096
+HIDDEN_SIZE = 64
+SPECIAL_TOKENS = ["<|endoftext|>", "<|im_start|>", "<|im_end|>"]
+RISK_LEVELS = ["Safe", "Controversial", "Unsafe"]
+CATEGORIES = [
+    "Violent",
+    "Non-violent Illegal Acts",
+    "Sexual Content or Sexual Acts",
+    "PII",
+    "Suicide & Self-Harm",
+    "Unethical Acts",
+    "Politically Sensitive Topics",
+    "Copyright Violation",
+    "Jailbreak",
+]
+
+# ============================================================================
+
+_TOKEN_PATTERN = re.compile(
+    "|".join(re.escape(t) for t in SPECIAL_TOKENS) + r"|[ \t]*\w+|[ \t]*[^\w\s]|\s+"
+)
+
+
+class TinyBatchEncoding(dict):
+    """Dict of tensors that also allows attribute access, like transformers' BatchEncoding"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def to(self, device):
+        return TinyBatchEncoding({k: v.to(device) for k, v in self.items()})
+
+
+class TinyTokenizer:
+    """Word-level hashing tokenizer with a Qwen-style chat template"""
+
+    def __init__(self):
+        self.eos_token = "<|endoftext|>"
+        self.pad_token = self.eos_token
+        self.padding_side = "right"
+        self.name_or_path = "tiny-guard-tokenizer"
+        self._special_ids = {token: i for i, token in enumerate(SPECIAL_TOKENS)}
+        self._id_to_token = {i: token for token, i in self._special_ids.items()}
+
+    @property
+    def eos_token_id(self):
+        return self._special_ids[self.eos_token]
+
+    @property
+    def pad_token_id(self):
+        return self.convert_tokens_to_ids(self.pad_token)
+
+    def convert_tokens_to_ids(self, token):
+        if token in self._special_ids:
+            return self._special_ids[token]
+        token_id = len(SPECIAL_TOKENS) + zlib.crc32(token.encode("utf-8")) % (VOCAB_SIZE - len(SPECIAL_TOKENS))
+        self._id_to_token.setdefault(token_id, token)
+        return token_id
+
+    def tokenize(self, text):
+        return _TOKEN_PATTERN.findall(text)
+
+    def encode(self, text):
+        return [self.convert_tokens_to_ids(token) for token in self.tokenize(text)]
+
+    def _encode_with_offsets(self, text):
+        matches = list(_TOKEN_PATTERN.finditer(text))
+        return [self.convert_tokens_to_ids(m.group()) for m in matches], [m.span() for m in matches]
+
+    def decode(self, token_ids, skip_special_tokens=False):
+        if isinstance(token_ids, torch.Tensor):
+            token_ids = token_ids.reshape(-1).tolist()
+        pieces = []
+        for token_id in token_ids:
+            token_id = int(token_id)
+            if skip_special_tokens and token_id < len(SPECIAL_TOKENS):
+                continue
+            pieces.append(self._id_to_token.get(token_id, ""))
+        return "".join(pieces)
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=False, **kwargs):
+        text = "".join(
+            f"<|im_start|>{message['role']}\n{message['content']}<|im_end|>\n" for message in messages
+        )
+        if add_generation_prompt:
+            text += "<|im_start|>assistant\n"
+        return self.encode(text) if tokenize else text
+
+    def __call__(self, text, return_tensors=None, truncation=False, padding=False, max_length=None,
+                 return_offsets_mapping=False, **kwargs):
+        texts = [text] if isinstance(text, str) else list(text)
+        encoded, offsets = zip(*(self._encode_with_offsets(t) for t in texts))
+        if truncation and max_length is not None:
+            encoded = [ids[:max_length] for ids in encoded]
+            offsets = [spans[:max_length] for spans in offsets]
+        if return_tensors != "pt":
+            if isinstance(text, str):
+                batch = TinyBatchEncoding(input_ids=encoded[0], attention_mask=[1] * len(encoded[0]))
+                if return_offsets_mapping:
+                    batch["offset_mapping"] = list(offsets[0])
+            else:
+                batch = TinyBatchEncoding(input_ids=list(encoded), attention_mask=[[1] * len(ids) for ids in encoded])
+                if return_offsets_mapping:
+                    batch["offset_mapping"] = [list(spans) for spans in offsets]
+            return batch
+
+        width = max(len(ids) for ids in encoded) if padding or len(encoded) > 1 else len(encoded[0])
+        input_ids = torch.full((len(encoded), width), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(encoded), width), dtype=torch.long)
+        for row, ids in enumerate(encoded):
+            if self.padding_side == "left":
+                input_ids[row, width - len(ids):] = torch.tensor(ids, dtype=torch.long)
+                attention_mask[row, width - len(ids):] = 1
+            else:
+                input_ids[row, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+                attention_mask[row, :len(ids)] = 1
+        batch = TinyBatchEncoding(input_ids=input_ids, attention_mask=attention_mask)
+        if return_offsets_mapping:
+            offset_mapping = torch.zeros((len(encoded), width, 2), dtype=torch.long)
+            for row, spans in enumerate(offsets):
+                if spans:
+                    start = width - len(spans) if self.padding_side == "left" else 0
+                    offset_mapping[row, start:start + len(spans)] = torch.tensor(spans, dtype=torch.long)
+            batch["offset_mapping"] = offset_mapping
+        return batch
+
+
+class TinyStreamGuard(nn.Module):
+    """Single attention layer with a growing KV cache and Stream-style moderation heads"""
+
+    def __init__(self, seed=0):
+        super().__init__()
+        generator = torch.Generator().manual_seed(seed)
+        self.embed = nn.Embedding(VOCAB_SIZE, HIDDEN_SIZE)
+        self.q_proj = nn.Linear(HIDDEN_SIZE, HIDDEN_SIZE, bias=False)
+        self.k_proj = nn.Linear(HIDDEN_SIZE, HIDDEN_SIZE, bias=False)
+        self.v_proj = nn.Linear(HIDDEN_SIZE, HIDDEN_SIZE, bias=False)
+        self.risk_level_head = nn.Linear(HIDDEN_SIZE, len(RISK_LEVELS))
+        self.category_head = nn.Linear(HIDDEN_SIZE, len(CATEGORIES))
+        for param in self.parameters():
+            param.data.normal_(0.0, 0.02, generator=generator)
+        # Bias towards "Safe" so the stand-in produces a realistic verdict mix
+        self.risk_level_head.bias.data[0] = 1.0
+        self.config = SimpleNamespace(name_or_path="tiny-stream-guard")
+
+    @property
+    def device(self):
+        return self.embed.weight.device
+
+    def forward(self, input_ids, past_key_values=None):
+        x = self.embed(input_ids)
+        q, k, v = self.q_proj(x), self.k_proj(x), self.v_proj(x)
+        past_length = 0
+        if past_key_values is not None:
+            past_k, past_v = past_key_values
+            past_length = past_k.shape[0]
+            k = torch.cat([past_k, k], dim=0)
+            v = torch.cat([past_v, v], dim=0)
+        scores = q @ k.T / HIDDEN_SIZE ** 0.5
+        positions = torch.arange(k.shape[0], device=x.device)
+        causal = positions[None, :] <= (past_length + torch.arange(x.shape[0], device=x.device))[:, None]
+        scores = scores.masked_fill(~causal, float("-inf"))
+        hidden = torch.softmax(scores, dim=-1) @ v + x
+        return self.risk_level_head(hidden), self.category_head(hidden), (k, v)
+
+    @torch.no_grad()
+    def stream_moderate_from_ids(self, token_ids, role, stream_state=None):
+        input_ids = token_ids.reshape(-1).to(self.device)
+        past_key_values = stream_state["past_key_values"] if stream_state is not None else None
+        risk_logits, category_logits, past_key_values = self(input_ids, past_key_values)
+        result = {
+            "risk_level": [RISK_LEVELS[i] for i in risk_logits.argmax(dim=-1).tolist()],
+            "category": [CATEGORIES[i] for i in category_logits.argmax(dim=-1).tolist()],
+        }
+        stream_state = {
+            "past_key_values": past_key_values,
+            "role": role,
+            "num_tokens": past_key_values[0].shape[0],
+        }
+        return result, stream_state
+
+    def close_stream(self, stream_state):
+        if stream_state is not None:
+            stream_state.clear()
+
+
+class TinyClassifier(nn.Module):
+    """Mean-pooled bag of embeddings with a linear head, shaped like a sequence classifier"""
+
+    def __init__(self, num_labels=2, seed=0):
+        super().__init__()
+        generator = torch.Generator().manual_seed(seed)
+        self.embed = nn.Embedding(VOCAB_SIZE, HIDDEN_SIZE)
+        self.score = nn.Linear(HIDDEN_SIZE, num_labels, bias=False)
+        for param in self.parameters():
+            param.data.normal_(0.0, 0.02, generator=generator)
+        self.config = SimpleNamespace(
+            name_or_path="tiny-classifier",
+            id2label={i: f"LABEL_{i}" for i in range(num_labels)},
+            num_labels=num_labels,
+        )
+
+    @property
+    def device(self):
+        return self.embed.weight.device
+
+    def forward(self, input_ids, attention_mask=None, **kwargs):
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        mask = attention_mask.unsqueeze(-1).to(self.embed.weight.dtype)
+        pooled = (self.embed(input_ids) * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1.0)
+        return SimpleNamespace(logits=self.score(pooled))
+
+
+def install_tiny_models(server_module, kind):
+    """Replace a server module's global model and tokenizer with tiny stand-ins
+
+    Args:
+        server_module: The imported `qwen_stream_api_server` or `star_trek_api_server` module
+        kind: "stream" or "star_trek"
+    """
+    if kind == "stream":
+        server_module.model = TinyStreamGuard().eval()
+    elif kind == "star_trek":
+        server_module.model = TinyClassifier().eval()
+    else:
+        raise ValueError(f"Unknown server kind: {kind}")
+    server_module.tokenizer = TinyTokenizer()
+    server_module.MODEL_PATH = f"tiny-{kind}-stand-in"
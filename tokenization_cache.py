@@ -0,0 +1,128 @@
+"""
+Fingerprinted cache of tokenized fine-tuning datasets.
+
+Tokenizing the dataset is the same work on every run of a training script,
+and it is repeated for every run of a hyperparameter sweep. `tokenize_cached`
+keys a tokenized dataset on a fingerprint of everything that determines it:
+the dataset file's SHA-256, the tokenizer (its full serialized definition and
+special tokens), the maximum length, the padding mode and the label mapping.
+The first run saves the result as Arrow shards with `save_to_disk`. Later
+runs with the same fingerprint load them memory-mapped with `load_from_disk`
+and skip tokenization entirely.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+from datasets import load_from_disk
+
+from guard_datasets import file_sha256
+
+FINGERPRINT_FILENAME = "fingerprint.json"
+DATASET_DIRNAME = "dataset"
+
+
+def tokenizer_fingerprint(tokenizer):
+    """SHA-256 of what decides a tokenizer's output: its definition and special tokens"""
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        definition = json.loads(backend.to_str())
+        # Truncation and padding are per-call settings left on the backend, not part of the tokenizer
+        definition.pop("truncation", None)
+        definition.pop("padding", None)
+    else:
+        definition = sorted(tokenizer.get_vocab().items())
+    state = {
+        "class": type(tokenizer).__name__,
+        "definition": definition,
+        "special_tokens": {name: str(value) for name, value in sorted(tokenizer.special_tokens_map.items())},
+        "padding_side": tokenizer.padding_side,
+        "truncation_side": tokenizer.truncation_side,
+    }
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def derive_max_length(token_lengths, percentile, cap, multiple=8):
+    """Length covering `percentile` of the examples, rounded up to a multiple of `multiple` and capped"""
+    max_length = int(np.ceil(np.percentile(token_lengths, percentile) / multiple) * multiple)
+    return min(max_length, cap)
+
+
+def tokenize_cached(dataset, dataset_path, tokenizer, cache_dir, max_length=None, padding=False,
+                    max_length_percentile=99.9, max_length_cap=512, text_column="input",
+                    remove_columns=(), label2id=None):
+    """Tokenize a dataset, or load the same tokenization from the cache
+
+    Args:
+        dataset: datasets.Dataset read from dataset_path
+        dataset_path: File the dataset was read from (its hash is part of the fingerprint)
+        max_length: Truncation length; None derives it from the token lengths (percentile, cap)
+        padding: Tokenizer padding mode (False for dynamic padding in the collator)
+        remove_columns: Columns to drop after tokenization
+        label2id: Label mapping applied to the dataset, recorded in the fingerprint
+
+    Returns:
+        (memory-mapped tokenized dataset, {"fingerprint", "max_length", "token_lengths", ...},
+        True if it was loaded from the cache)
+    """
+    key = {
+        "dataset_sha256": file_sha256(dataset_path),
+        "tokenizer": tokenizer_fingerprint(tokenizer),
+        "max_length": max_length if max_length is not None else f"p{max_length_percentile}<={max_length_cap}",
+        "padding": str(padding),
+        "text_column": text_column,
+        "remove_columns": sorted(remove_columns),
+        "label2id": label2id,
+    }
+    fingerprint = hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    entry = os.path.join(cache_dir, fingerprint)
+    fingerprint_path = os.path.join(entry, FINGERPRINT_FILENAME)
+    if os.path.exists(fingerprint_path):
+        with open(fingerprint_path) as f:
+            info = json.load(f)
+        if info["key"] == key:
+            return load_from_disk(os.path.join(entry, DATASET_DIRNAME)), info, True
+
+    token_lengths = None
+    if max_length is None:
+        # Deriving the length needs the untruncated lengths, so this is the one extra pass
+        token_lengths = np.array([len(ids) for ids in tokenizer(list(dataset[text_column]))["input_ids"]])
+        max_length = derive_max_length(token_lengths, max_length_percentile, max_length_cap)
+        truncated = int((token_lengths > max_length).sum())
+
+    def tokenize_function(examples):
+        return tokenizer(
+            examples[text_column],
+            truncation=True,
+            padding=padding,
+            max_length=max_length,
+        )
+
+    tokenized = dataset.map(tokenize_function, batched=True, remove_columns=list(remove_columns))
+    if token_lengths is None:
+        # Lengths after truncation, so "truncated" counts the examples that reach max_length
+        token_lengths = np.array([sum(mask) for mask in tokenized["attention_mask"]])
+        truncated = int((token_lengths >= max_length).sum())
+    if os.path.exists(entry):
+        shutil.rmtree(entry)
+    tokenized.save_to_disk(os.path.join(entry, DATASET_DIRNAME))
+    info = {
+        "key": key,
+        "fingerprint": fingerprint,
+        "size": len(tokenized),
+        "max_length": max_length,
+        "token_lengths": {
+            "median": int(np.median(token_lengths)),
+            "p99": int(np.percentile(token_lengths, 99)),
+            "max": int(token_lengths.max()),
+            "truncated": truncated,
+        },
+    }
+    # Written last, so an interrupted run never leaves an entry that looks complete
+    with open(fingerprint_path, "w") as f:
+        json.dump(info, f, indent=2)
+    # Reload so a fresh tokenization is memory-mapped from the cache just like a hit
+    return load_from_disk(os.path.join(entry, DATASET_DIRNAME)), info, False